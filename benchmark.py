@@ -0,0 +1,278 @@
+# coding: utf-8
+
+"""Benchmark the stages of the submissions.
+
+The following stages are timed and memory-profiled:
+
+* ``problem.get_train_data``;
+* ``load_fmri`` of ``connectome.py``, for each atlas;
+* the fit and the transform of the tangent-space
+  ``BatchedConnectivityMeasure`` of ``connectome.py`` and, as a reference, of
+  the ``ConnectivityMeasure`` of nilearn, for each atlas;
+* the fit and the transform of the ``FeatureExtractor`` and the fit and the
+  ``predict_proba`` of the ``Classifier`` of each submission.
+
+The stages working on the time-series are also run on synthetic subjects, in
+numbers beyond the 1150 subjects of the challenge, with the number of regions
+of each atlas.
+
+For each stage, the wall time, the CPU time and the peak of the memory
+allocated (traced with ``tracemalloc``) are stored in a JSON file such that
+two commits can be compared::
+
+    python benchmark.py --output new.json --compare old.json
+
+Each stage is run twice: once timed and once with ``tracemalloc``, which slows
+down the allocations. The feature extractors cache the covariances in a
+temporary directory, emptied before each run of their fit, such that their
+fit is always measured without the cache of previous benchmarks.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import rampwf as rw
+from nilearn.connectome import ConnectivityMeasure
+
+from fmri_store import ATLAS
+
+N_REGIONS = {'basc064': 64, 'basc122': 122, 'basc197': 197,
+             'craddock_scorr_mean': 249, 'harvard_oxford_cort_prob_2mm': 48,
+             'msdl': 39, 'power_2011': 264}
+
+
+def _measure(function, *args, setup=None, **kwargs):
+    """Call a function twice to measure its time and then its peak memory.
+
+    ``setup`` is called before each call, if given.
+    """
+    if setup is not None:
+        setup()
+    gc.collect()
+    wall_time, cpu_time = time.perf_counter(), time.process_time()
+    function(*args, **kwargs)
+    wall_time = time.perf_counter() - wall_time
+    cpu_time = time.process_time() - cpu_time
+
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    result = function(*args, **kwargs)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'wall_time': wall_time, 'cpu_time': cpu_time,
+                    'peak_memory': peak_memory}
+
+
+def _empty_directory(directory):
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def _record(results, stage, metrics, **context):
+    record = dict(stage=stage, atlas=None, submission=None, n_subjects=None)
+    record.update(context)
+    record.update(metrics)
+    results.append(record)
+    print('{stage:<36} {atlas!s:<28} {submission!s:<28} {n_subjects!s:>6} '
+          '{wall_time:9.3f} s {peak_memory:12,d} B'.format(**record))
+
+
+def _import_connectome():
+    return rw.utils.import_module_from_source('connectome.py', 'connectome')
+
+
+def _import_submission(submission_path, module):
+    return rw.utils.import_module_from_source(
+        os.path.join(submission_path, module + '.py'), module)
+
+
+def benchmark_data(results, path='.', atlases=ATLAS,
+                   submissions_dir='submissions'):
+    """Benchmark the stages on the data of the challenge."""
+    problem = rw.utils.import_module_from_source(
+        os.path.join(path, 'problem.py'), 'problem')
+    (X, y), metrics = _measure(problem.get_train_data, path=path)
+    _record(results, 'get_train_data', metrics, n_subjects=len(X))
+
+    connectome = _import_connectome()
+    for atlas in atlases:
+        if not os.path.isdir(os.path.join(path, 'data', 'fmri', atlas)):
+            print('Skipping the atlas {}: not downloaded'.format(atlas))
+            continue
+        context = dict(atlas=atlas, n_subjects=len(X))
+        time_series, metrics = _measure(connectome.load_fmri,
+                                        X['fmri_' + atlas])
+        _record(results, 'load_fmri', metrics, **context)
+        _benchmark_connectome(results, connectome, time_series, context)
+
+    # the covariances cached by previous benchmarks are not used
+    cache_directory = tempfile.mkdtemp(prefix='autism_benchmark_')
+    previous_cache = os.environ.get('AUTISM_CONNECTOME_CACHE')
+    os.environ['AUTISM_CONNECTOME_CACHE'] = cache_directory
+    try:
+        for submission in sorted(os.listdir(submissions_dir)):
+            submission_path = os.path.join(submissions_dir, submission)
+            if not os.path.isfile(os.path.join(submission_path,
+                                               'classifier.py')):
+                continue
+            context = dict(submission=submission, n_subjects=len(X))
+            feature_extractor = _import_submission(
+                submission_path, 'feature_extractor').FeatureExtractor()
+            _, metrics = _measure(
+                feature_extractor.fit, X, y,
+                setup=lambda: _empty_directory(cache_directory))
+            _record(results, 'FeatureExtractor.fit', metrics, **context)
+            X_features, metrics = _measure(feature_extractor.transform, X)
+            _record(results, 'FeatureExtractor.transform', metrics,
+                    **context)
+            _benchmark_classifier(results, _import_submission(
+                submission_path, 'classifier').Classifier(), X_features, y,
+                context)
+    finally:
+        if previous_cache is None:
+            os.environ.pop('AUTISM_CONNECTOME_CACHE', None)
+        else:
+            os.environ['AUTISM_CONNECTOME_CACHE'] = previous_cache
+        shutil.rmtree(cache_directory, ignore_errors=True)
+
+
+def _benchmark_connectome(results, connectome, time_series, context):
+    for connectivity in (ConnectivityMeasure(kind='tangent'),
+                         connectome.BatchedConnectivityMeasure(
+                             kind='tangent')):
+        name = type(connectivity).__name__
+        _, metrics = _measure(connectivity.fit, time_series)
+        _record(results, name + '.fit', metrics, **context)
+        X_connectome, metrics = _measure(connectivity.transform, time_series)
+        _record(results, name + '.transform', metrics, **context)
+    # the features of the connectome engine of the submissions
+    return X_connectome
+
+
+def _benchmark_classifier(results, classifier, X, y, context):
+    _, metrics = _measure(classifier.fit, X, y)
+    _record(results, 'Classifier.fit', metrics, **context)
+    _, metrics = _measure(classifier.predict_proba, X)
+    _record(results, 'Classifier.predict_proba', metrics, **context)
+
+
+def benchmark_synthetic(results, n_subjects=(1150, 4600), n_time=150,
+                        atlases=ATLAS, submissions_dir='submissions',
+                        random_state=0):
+    """Benchmark the stages on synthetic time-series."""
+    functional_path = os.path.join(submissions_dir,
+                                   'starting_kit_functional')
+    connectome = _import_connectome()
+    rng = np.random.RandomState(random_state)
+    for n in n_subjects:
+        y = rng.randint(2, size=n)
+        for atlas in atlases:
+            time_series = [
+                rng.standard_normal((n_time, N_REGIONS[atlas])).astype(
+                    np.float32) for _ in range(n)]
+            context = dict(atlas=atlas, submission='synthetic',
+                           n_subjects=n)
+            X_connectome = _benchmark_connectome(results, connectome,
+                                                 time_series, context)
+            del time_series
+            _benchmark_classifier(results, _import_submission(
+                functional_path, 'classifier').Classifier(), X_connectome, y,
+                context)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_results, new_results):
+    """Print the ratio of the time and memory of two benchmarks.
+
+    Parameters
+    ----------
+    old_results, new_results : dict
+        The content of the JSON files written by this script.
+
+    Returns
+    -------
+    None
+
+    """
+    def key(record):
+        return (record['stage'], record['atlas'], record['submission'],
+                record['n_subjects'])
+
+    old = {key(record): record for record in old_results['results']}
+    print('Comparison of {} (new) with {} (old):'.format(
+        new_results['commit'], old_results['commit']))
+    for record in new_results['results']:
+        if key(record) not in old:
+            continue
+        old_record = old[key(record)]
+        print('{:<36} {!s:<28} {!s:<28} {!s:>6} time x{:6.2f} '
+              'memory x{:6.2f}'.format(
+                  *key(record) + (
+                      record['wall_time'] / max(old_record['wall_time'],
+                                                1e-9),
+                      record['peak_memory'] / max(old_record['peak_memory'],
+                                                  1))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the loading, connectome and classifier '
+        'stages of the submissions.')
+    parser.add_argument('--atlas', nargs='+', default=list(ATLAS),
+                        choices=ATLAS, help='Atlases to benchmark.')
+    parser.add_argument('--n-subjects', nargs='+', type=int,
+                        default=[1150, 4600],
+                        help='Numbers of synthetic subjects.')
+    parser.add_argument('--n-time', type=int, default=150,
+                        help='Length of the synthetic time series.')
+    parser.add_argument('--skip-data', action='store_true',
+                        help='Only run the benchmark on synthetic subjects.')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='JSON file in which the results are stored.')
+    parser.add_argument('--compare', default=None,
+                        help='JSON file of a previous benchmark to compare '
+                        'with.')
+    args = parser.parse_args()
+
+    results = []
+    if not args.skip_data:
+        benchmark_data(results, atlases=args.atlas)
+    benchmark_synthetic(results, n_subjects=args.n_subjects,
+                        n_time=args.n_time, atlases=args.atlas)
+
+    benchmark = {'commit': _git_commit(),
+                 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(),
+                 'numpy': np.__version__,
+                 'machine': platform.platform(),
+                 'cpu_count': os.cpu_count(),
+                 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(benchmark, f, indent=2)
+    print('Results written in {}'.format(args.output))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(json.load(f), benchmark)
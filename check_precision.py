@@ -0,0 +1,109 @@
+# coding: utf-8
+
+"""Check that the float32 mode of a submission does not change its scores.
+
+The submission is trained on each fold of ``problem.get_cv`` once with the
+time-series and connectome features in float64 and once in float32 (see the
+``AUTISM_DTYPE`` environment variable read by the functional feature
+extractors). The AUC of both precisions on the validation set of each fold
+are printed along with the memory of the features, and the script exits with
+an error if an AUC differs by more than the tolerance::
+
+    python check_precision.py --submission starting_kit_functional
+
+The same check is run by the tests on a small synthetic dataset written by
+``generate_data.py``.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import rampwf as rw
+from sklearn.metrics import roc_auc_score
+
+# largest difference of AUC tolerated on a fold between the two precisions
+TOL = 0.005
+
+
+def _cv_auc(problem, module_path, X, y, dtype):
+    """AUC on the validation set of each fold with a given precision."""
+    os.environ['AUTISM_DTYPE'] = dtype
+    results = []
+    for train_is, valid_is in problem.get_cv(X, y):
+        fe, clf = problem.workflow.train_submission(module_path, X, y,
+                                                    train_is=train_is)
+        X_features = fe.transform(X.iloc[valid_is])
+        y_pred = clf.predict_proba(X_features)
+        results.append({'auc': roc_auc_score(y[valid_is], y_pred[:, 1]),
+                        'features_dtype': str(X_features.dtype),
+                        'features_nbytes': X_features.nbytes})
+    return pd.DataFrame(results)
+
+
+def check_precision(submission, ramp_kit_dir='.', ramp_data_dir='.',
+                    ramp_submission_dir='submissions'):
+    """Compare the AUC of a submission in float64 and in float32.
+
+    Parameters
+    ----------
+    submission : string
+        The name of the submission folder.
+
+    ramp_kit_dir : string, default='.'
+        The directory containing ``problem.py``.
+
+    ramp_data_dir : string, default='.'
+        The root directory containing the ``data`` folder.
+
+    ramp_submission_dir : string, default='submissions'
+        The directory containing the submission folders.
+
+    Returns
+    -------
+    scores : DataFrame
+        The AUC and the memory of the features for each fold and precision.
+
+    """
+    problem = rw.utils.import_module_from_source(
+        os.path.join(ramp_kit_dir, 'problem.py'), 'problem')
+    X, y = problem.get_train_data(path=ramp_data_dir)
+    module_path = os.path.join(ramp_submission_dir, submission)
+    dtype = os.environ.get('AUTISM_DTYPE')
+    try:
+        scores = pd.concat(
+            {precision: _cv_auc(problem, module_path, X, y, precision)
+             for precision in ('float64', 'float32')}, axis=1)
+    finally:
+        if dtype is None:
+            os.environ.pop('AUTISM_DTYPE', None)
+        else:
+            os.environ['AUTISM_DTYPE'] = dtype
+    scores.index.name = 'fold'
+    scores['auc_difference'] = np.abs(scores['float64', 'auc'] -
+                                      scores['float32', 'auc'])
+    return scores
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Check that the float32 mode of a submission does not '
+        'change its AUC on the cross-validation folds.')
+    parser.add_argument('--submission', default='starting_kit_functional',
+                        help='Name of the submission folder.')
+    parser.add_argument('--tol', type=float, default=TOL,
+                        help='Largest difference of AUC tolerated on a fold.')
+    args = parser.parse_args()
+
+    scores = check_precision(args.submission)
+    print(scores.to_string())
+    max_difference = scores['auc_difference'].max()
+    print('Largest difference of AUC: {:.5f} (tolerance {})'.format(
+        max_difference, args.tol))
+    if max_difference > args.tol:
+        sys.exit(1)
@@ -0,0 +1,347 @@
+# coding: utf-8
+
+"""Connectome engine shared by the functional submissions.
+
+The functional starting kits compute the tangent-space connectome of the
+time-series of an atlas. This module gathers the machinery they share:
+
+* :func:`load_fmri` loads the time-series from the store packed with
+  ``fmri_store.py`` when available, from the CSV files otherwise;
+* :func:`load_covariances` loads the covariance matrices of the subjects from
+  an on-disk cache, estimating only the missing ones;
+* :class:`BatchedConnectivityMeasure` is a NumPy-batched equivalent of
+  nilearn's ``ConnectivityMeasure``.
+
+The submissions load this module from the root of the kit, two levels above
+their own folder::
+
+    connectome = rw.utils.import_module_from_source(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                     'connectome.py'), 'connectome')
+
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import rampwf as rw
+
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.covariance import LedoitWolf
+
+fmri_store = rw.utils.import_module_from_source(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fmri_store.py'),
+    'fmri_store')
+
+# memory-mapped stores written by fmri_store.py, indexed by atlas directory
+_FMRI_STORES = {}
+
+# name of the covariance estimator used as a key in the covariance cache
+_COVARIANCE_ESTIMATOR = 'ledoit_wolf'
+
+# precision of the time-series and connectome features when not given, e.g.
+# AUTISM_DTYPE=float32 halves the memory of the largest arrays
+_DEFAULT_DTYPE = 'float64'
+
+
+def get_dtype(dtype=None):
+    """Precision of the features, read from ``AUTISM_DTYPE`` if not given."""
+    return np.dtype(dtype or os.environ.get('AUTISM_DTYPE', _DEFAULT_DTYPE))
+
+
+def _atlas_directory(subject_filename):
+    # the files are stored as <atlas>/<subject_id>/<run>/<filename>.csv
+    return os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.normpath(subject_filename))))
+
+
+def _open_fmri_store(atlas_directory):
+    """Open the store of an atlas packed with ``fmri_store.py``, if any."""
+    if atlas_directory not in _FMRI_STORES:
+        if not fmri_store.is_packed(atlas_directory):
+            return None
+        _FMRI_STORES[atlas_directory] = fmri_store.FMRIStore(atlas_directory)
+    return _FMRI_STORES[atlas_directory]
+
+
+def load_fmri(fmri_filenames, dtype=None):
+    """Load time-series extracted from the fMRI using a specific atlas.
+
+    The time-series are memory-mapped views of the store written by
+    ``fmri_store.py`` if the atlas was packed, copied only if ``dtype``
+    differs from the one of the store. Otherwise, the CSV file of each
+    subject is parsed, in ``dtype`` if given.
+    """
+    fmri_filenames = list(fmri_filenames)
+    if fmri_filenames:
+        store = _open_fmri_store(_atlas_directory(fmri_filenames[0]))
+        if store is not None:
+            return [ts.astype(dtype or ts.dtype, copy=False)
+                    for ts in store.load(fmri_filenames)]
+    return [pd.read_csv(subject_filename, header=None, dtype=dtype).values
+            for subject_filename in fmri_filenames]
+
+
+def _covariance_cache_directory(atlas_directory, dtype):
+    """Directory caching the covariance matrices of the subjects of an atlas.
+
+    The cache is located in ``data/fmri/cache`` unless the environment
+    variable ``AUTISM_CONNECTOME_CACHE`` gives another location, with a
+    folder per precision of the time-series the covariances are estimated on.
+    """
+    cache_directory = os.environ.get(
+        'AUTISM_CONNECTOME_CACHE',
+        os.path.join(os.path.dirname(atlas_directory), 'cache'))
+    return os.path.join(cache_directory, os.path.basename(atlas_directory),
+                        _COVARIANCE_ESTIMATOR, np.dtype(dtype).name)
+
+
+def _hash_time_series(subject_filename):
+    """Hash the content of the time-series of a subject."""
+    store = _open_fmri_store(_atlas_directory(subject_filename))
+    subject_id = fmri_store._subject_id_from_filename(subject_filename)
+    # the CSV file is hashed when it changed since the store was packed
+    if store is not None and store.is_current(subject_id):
+        content = np.ascontiguousarray(store[subject_id])
+    else:
+        # hash the raw file such that it is not parsed when already cached
+        with open(subject_filename, 'rb') as f:
+            content = f.read()
+    return hashlib.sha1(content).hexdigest()
+
+
+def load_covariances(fmri_filenames, dtype=np.float64):
+    """Load the covariance matrices of the time-series of each subject.
+
+    The covariances do not depend on the training set and are cached on disk,
+    keyed by the atlas, the covariance estimator, ``dtype`` and a hash of the
+    content of the time-series. Only the subjects missing from the cache are
+    estimated, in float64 from their time-series loaded in ``dtype``, and the
+    stack is returned in ``dtype``.
+    """
+    fmri_filenames = list(fmri_filenames)
+    if not fmri_filenames:
+        return np.empty((0, 0, 0), dtype=dtype)
+    cache_directory = _covariance_cache_directory(
+        _atlas_directory(fmri_filenames[0]), dtype)
+    cache_filenames = [
+        os.path.join(cache_directory,
+                     _hash_time_series(subject_filename) + '.npy')
+        for subject_filename in fmri_filenames]
+
+    covariances = {}
+    missing = [idx for idx, cache_filename in enumerate(cache_filenames)
+               if not os.path.isfile(cache_filename)]
+    if missing:
+        if not os.path.isdir(cache_directory):
+            os.makedirs(cache_directory, exist_ok=True)
+        time_series = load_fmri([fmri_filenames[idx] for idx in missing],
+                                dtype=dtype)
+        for idx, ts in zip(missing, time_series):
+            covariance = LedoitWolf(store_precision=False).fit(
+                np.asarray(ts, dtype=np.float64)).covariance_
+            # write in a temporary file and rename it to be safe with
+            # concurrent processes filling the same cache
+            tmp_filename = '{}.{}.tmp.npy'.format(cache_filenames[idx][:-4],
+                                                  os.getpid())
+            np.save(tmp_filename, covariance)
+            os.replace(tmp_filename, cache_filenames[idx])
+            covariances[idx] = covariance
+
+    return np.array([covariances[idx] if idx in covariances
+                     else np.load(cache_filename)
+                     for idx, cache_filename in enumerate(cache_filenames)],
+                    dtype=dtype)
+
+
+def _map_eigenvalues(function, symmetric):
+    """Apply a function to the eigenvalues of a stack of symmetric matrices.
+
+    All the matrices of the stack are decomposed with a single batched call
+    to :func:`numpy.linalg.eigh`.
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(symmetric)
+    return np.matmul(eigenvectors * function(eigenvalues)[..., np.newaxis, :],
+                     np.swapaxes(eigenvectors, -1, -2))
+
+
+def _whitened_log(covariances, whitening, batch_size):
+    """Yield the logarithm of the whitened covariances, batch by batch.
+
+    The batches are computed in the precision of ``whitening`` whatever the
+    precision of the stored covariances.
+    """
+    for start in range(0, covariances.shape[0], batch_size):
+        whitened = np.matmul(np.matmul(
+            whitening, covariances[start:start + batch_size]), whitening)
+        yield start, _map_eigenvalues(np.log, whitened)
+
+
+def _covariances_to_correlations(covariances):
+    """Correlation matrices of a stack of covariance matrices."""
+    stds = np.sqrt(np.diagonal(covariances, axis1=-2, axis2=-1))
+    correlations = covariances / stds[..., np.newaxis] / stds[
+        ..., np.newaxis, :]
+    diagonal = np.arange(correlations.shape[-1])
+    correlations[..., diagonal, diagonal] = 1.
+    return correlations
+
+
+def _standardize(time_series):
+    """Center the time-series and scale them to unit variance as nilearn."""
+    time_series = time_series - time_series.mean(axis=0)
+    stds = np.std(time_series, axis=0)
+    stds[stds < np.finfo(np.float64).eps] = 1.
+    return time_series / stds
+
+
+def _geometric_mean(covariances, max_iter=30, tol=1e-7, batch_size=100):
+    """Geometric mean of a stack of symmetric positive definite matrices.
+
+    Same gradient descent as nilearn's ``_geometric_mean`` where the matrices
+    are whitened and mapped to the tangent space by batches instead of one at
+    a time. The mean is computed in float64 even if the covariances are
+    stored in float32.
+    """
+    gmean = covariances.mean(axis=0, dtype=np.float64)
+    norm_old = np.inf
+    step = 1.
+    for _ in range(max_iter):
+        vals_gmean, vecs_gmean = np.linalg.eigh(gmean)
+        gmean_inv_sqrt = (vecs_gmean / np.sqrt(vals_gmean)).dot(vecs_gmean.T)
+        logs_mean = np.zeros_like(gmean)
+        for _, logs in _whitened_log(covariances, gmean_inv_sqrt,
+                                     batch_size):
+            logs_mean += logs.sum(axis=0)
+        logs_mean /= covariances.shape[0]
+        if np.any(np.isnan(logs_mean)):
+            raise FloatingPointError("Nan value after logarithm operation.")
+        # norm of the covariant derivative on the tangent space at gmean
+        norm = np.linalg.norm(logs_mean)
+        # move along the geodesic
+        gmean_sqrt = (vecs_gmean * np.sqrt(vals_gmean)).dot(vecs_gmean.T)
+        gmean = gmean_sqrt.dot(
+            _map_eigenvalues(lambda x: np.exp(x * step), logs_mean)).dot(
+                gmean_sqrt)
+        # update the norm and the step size
+        if norm < norm_old:
+            norm_old = norm
+        elif norm > norm_old:
+            step = step / 2.
+            norm = norm_old
+        if tol is not None and norm / gmean.size < tol:
+            break
+    return gmean
+
+
+class BatchedConnectivityMeasure(BaseEstimator, TransformerMixin):
+    """NumPy-batched equivalent of nilearn's ``ConnectivityMeasure``.
+
+    The covariances of all the subjects are stacked in an array of shape
+    (n_subjects, n_regions, n_regions) which is whitened, mapped to the
+    tangent space with batched eigendecompositions and vectorized in a single
+    indexing.
+
+    Parameters
+    ----------
+    cov_estimator : estimator object or 'precomputed', default=None
+        The covariance estimator, ``LedoitWolf(store_precision=False)`` by
+        default. If 'precomputed', X is the stack of covariance matrices
+        instead of a list of time-series.
+
+    kind : {'correlation', 'covariance', 'precision', 'tangent'}, \
+default='tangent'
+        The matrix kind. As in nilearn, the correlations are estimated on
+        the standardized time-series, or derived from the covariances if
+        precomputed.
+
+    vectorize : bool, default=True
+        If True, the connectivity matrices are reshaped into 1D arrays of
+        their flattened lower triangular parts, as in nilearn.
+
+    discard_diagonal : bool, default=False
+        If True, the diagonal is not included when vectorizing.
+
+    batch_size : int, default=100
+        Number of subjects decomposed at once. It bounds the memory used for
+        atlases with many regions such as basc197 or power_2011.
+
+    dtype : numpy dtype, default=np.float64
+        The type of the stacked covariances and of the returned
+        connectivities. With float32, the memory of the largest arrays is
+        halved while the mean, the whitening and the decompositions of each
+        batch are still computed in float64.
+
+    """
+
+    def __init__(self, cov_estimator=None, kind='tangent', vectorize=True,
+                 discard_diagonal=False, batch_size=100, dtype=np.float64):
+        self.cov_estimator = cov_estimator
+        self.kind = kind
+        self.vectorize = vectorize
+        self.discard_diagonal = discard_diagonal
+        self.batch_size = batch_size
+        self.dtype = dtype
+
+    def _covariances(self, X):
+        if self.cov_estimator == 'precomputed':
+            covariances = np.asarray(X, dtype=self.dtype)
+        else:
+            cov_estimator = (LedoitWolf(store_precision=False)
+                             if self.cov_estimator is None
+                             else clone(self.cov_estimator))
+            prepare = (_standardize if self.kind == 'correlation'
+                       else np.asarray)
+            covariances = np.array(
+                [cov_estimator.fit(prepare(np.asarray(x, dtype=np.float64)))
+                 .covariance_ for x in X], dtype=self.dtype)
+        if self.kind == 'correlation':
+            return _covariances_to_correlations(covariances)
+        return covariances
+
+    def fit(self, X, y=None):
+        if self.kind not in ('correlation', 'covariance', 'precision',
+                             'tangent'):
+            raise ValueError("'kind' should be one of 'correlation', "
+                             "'covariance', 'precision' or 'tangent'. Got {} "
+                             "instead.".format(self.kind))
+        covariances = self._covariances(X)
+        if self.kind == 'tangent':
+            self.mean_ = _geometric_mean(covariances, max_iter=30, tol=1e-7,
+                                         batch_size=self.batch_size)
+            self.whitening_ = _map_eigenvalues(lambda x: 1. / np.sqrt(x),
+                                               self.mean_)
+        else:
+            connectivities = (np.linalg.inv(covariances)
+                              if self.kind == 'precision' else covariances)
+            self.mean_ = connectivities.mean(axis=0, dtype=np.float64)
+            self.mean_ = (self.mean_ + self.mean_.T) / 2
+            self.whitening_ = None
+        return self
+
+    def transform(self, X):
+        covariances = self._covariances(X)
+        if self.kind == 'tangent':
+            connectivities = np.empty_like(covariances)
+            for start, logs in _whitened_log(covariances, self.whitening_,
+                                             self.batch_size):
+                connectivities[start:start + logs.shape[0]] = logs
+        elif self.kind == 'precision':
+            connectivities = np.linalg.inv(
+                covariances.astype(np.float64)).astype(self.dtype)
+        else:
+            connectivities = covariances
+        if not self.vectorize:
+            return connectivities
+
+        # the lower triangular part is flattened row by row as in nilearn
+        # and the diagonal is scaled to preserve the norm
+        n_regions = connectivities.shape[-1]
+        rows, cols = np.tril_indices(n_regions,
+                                     k=-1 if self.discard_diagonal else 0)
+        vectors = connectivities[:, rows, cols]
+        if not self.discard_diagonal:
+            vectors[:, rows == cols] /= np.sqrt(2)
+        return vectors
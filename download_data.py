@@ -3,21 +3,19 @@
 from __future__ import print_function
 
 import argparse
-import glob
 import os
-import shutil
 import hashlib
 import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 try:
-    from urllib.request import urlretrieve
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
 except ImportError:
-    from urllib import urlretrieve
+    from urllib2 import HTTPError, Request, urlopen
 
-import numpy as np
 import pandas as pd
-# import joblib from scikit-learn to avoid an extra dependency
-from sklearn.externals import joblib
 
 ATLAS = ('basc064', 'basc122', 'basc197', 'craddock_scorr_mean',
          'harvard_oxford_cort_prob_2mm', 'msdl', 'power_2011')
@@ -42,71 +40,189 @@ CHECKSUM = {
     'd1e3cd8eaa867079fe6b24dfaee08bd3b2d9e0ebbd806a2a982db5407328990a'}
 
 
+CHUNK_SIZE = 1024 * 1024
+
+# file recording the size, modification time and hash of each file of an atlas
+MANIFEST_FILENAME = 'manifest.csv'
+
+
+def _download(url, output_file, checksum):
+    """Download a file, resuming a previous partial download if any.
+
+    The data are streamed to ``<output_file>.part`` which is renamed once
+    complete. The sha256 hash is computed while streaming such that the
+    archive is not read a second time to check its integrity.
+    """
+    sha256hash = hashlib.sha256()
+    partial_file = output_file + '.part'
+    n_bytes = 0
+    if os.path.isfile(partial_file):
+        # only the bytes already on disk need to be read to resume the hash
+        with open(partial_file, 'rb') as f:
+            for buffer in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha256hash.update(buffer)
+                n_bytes += len(buffer)
+
+    request = Request(url)
+    if n_bytes:
+        request.add_header('Range', 'bytes={}-'.format(n_bytes))
+    try:
+        response = urlopen(request)
+    except HTTPError as e:
+        # a range starting at the end of the file is not satisfiable: the
+        # previous download was already complete
+        if not (n_bytes and e.code == 416):
+            raise
+        response = None
+
+    if response is not None:
+        with response:
+            mode = 'ab'
+            if n_bytes and response.getcode() != 206:
+                # the server does not support range requests: start again
+                sha256hash = hashlib.sha256()
+                mode = 'wb'
+            with open(partial_file, mode) as f:
+                for buffer in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    sha256hash.update(buffer)
+                    f.write(buffer)
+
+    if sha256hash.hexdigest() != checksum:
+        os.remove(partial_file)
+        raise IOError('The file downloaded was corrupted. Try again '
+                      'to execute this script.')
+    os.rename(partial_file, output_file)
+
+
 def _sha256(path):
     """Calculate the sha256 hash of the file at path."""
     sha256hash = hashlib.sha256()
-    chunk_size = 8192
     with open(path, "rb") as f:
-        while True:
-            buffer = f.read(chunk_size)
-            if not buffer:
-                break
+        for buffer in iter(lambda: f.read(CHUNK_SIZE), b''):
             sha256hash.update(buffer)
     return sha256hash.hexdigest()
 
 
-def _check_and_unzip(output_file, atlas, atlas_directory):
-    checksum_download = _sha256(output_file)
-    if checksum_download != CHECKSUM[atlas]:
-        os.remove(output_file)
-        raise IOError('The file downloaded was corrupted. Try again '
-                      'to execute this script.')
+def _extract_members(archive_file, members, directory):
+    with zipfile.ZipFile(archive_file, 'r') as zip_ref:
+        for member in members:
+            zip_ref.extract(member, directory)
 
-    print('Decompressing the archive ...')
-    zip_ref = zipfile.ZipFile(output_file, 'r')
-    zip_ref.extractall(atlas_directory)
-    zip_ref.close()
 
+def _unzip(archive_file, directory, members=None, n_jobs=None):
+    """Extract the members of a zip archive with several threads.
 
-def _download_fmri_data(atlas):
-    print('Downloading the data from {} ...'.format(ARCHIVE[atlas]))
+    Only the files listed in ``members`` are extracted if given. The names
+    of the extracted files are returned.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    with zipfile.ZipFile(archive_file, 'r') as zip_ref:
+        files = [member.filename for member in zip_ref.infolist()
+                 if not member.filename.endswith('/')]
+    if members is not None:
+        members = set(members)
+        files = [member for member in files if member in members]
+    # create the folders beforehand to not have threads racing to create them
+    for member in files:
+        member_directory = os.path.dirname(os.path.join(directory, member))
+        if not os.path.isdir(member_directory):
+            os.makedirs(member_directory, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        list(executor.map(
+            lambda idx: _extract_members(archive_file, files[idx::n_jobs],
+                                         directory),
+            range(n_jobs)))
+    return files
+
+
+def _fetch_archive(atlas):
+    """Get the path of the archive of an atlas, downloading it if needed."""
     output_file = os.path.abspath(
         os.path.join('.', 'data', 'fmri', atlas + '.zip'))
-    urlretrieve(ARCHIVE[atlas], filename=output_file)
-    atlas_directory = os.path.abspath(os.path.join('.', 'data', 'fmri'))
-    _check_and_unzip(output_file, atlas, atlas_directory)
+    if not os.path.isfile(output_file):
+        if not os.path.isdir(os.path.dirname(output_file)):
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        print('Downloading the data from {} ...'.format(ARCHIVE[atlas]))
+        _download(ARCHIVE[atlas], output_file, CHECKSUM[atlas])
+    return output_file
+
+
+def _manifest_entry(fmri_directory, member):
+    filename = os.path.join(fmri_directory, member)
+    stat = os.stat(filename)
+    return {'member': member, 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns, 'sha256': _sha256(filename)}
+
+
+def _write_manifest(manifest, manifest_file):
+    manifest.to_csv(manifest_file + '.tmp', index=False)
+    os.rename(manifest_file + '.tmp', manifest_file)
+
+
+def _verify_manifest(manifest, fmri_directory):
+    """Find the files which are missing or differ from the manifest.
+
+    The files are only hashed when their size matches but their modification
+    time changed. The manifest is updated in place for the files which were
+    touched without being modified.
+    """
+    damaged = []
+    for idx, entry in manifest.iterrows():
+        filename = os.path.join(fmri_directory, entry['member'])
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            damaged.append(entry['member'])
+            continue
+        if stat.st_size != entry['size']:
+            damaged.append(entry['member'])
+        elif stat.st_mtime_ns != entry['mtime_ns']:
+            if _sha256(filename) != entry['sha256']:
+                damaged.append(entry['member'])
+            else:
+                manifest.loc[idx, 'mtime_ns'] = stat.st_mtime_ns
+    return damaged
 
 
 def _check_integrity_atlas(atlas):
-    # check that the folder is existing
-    atlas_directory = os.path.abspath(os.path.join('.', 'data', 'fmri', atlas))
-    if os.path.isdir(atlas_directory):
-        # compute the hash of the current data present on the disk
-        filenames_atlas_current = np.array(
-            glob.glob(os.path.join(atlas_directory, '*', '*', '*')),
-            dtype=object)
-        filenames_atlas_current.sort()
-        current_hash = joblib.hash(filenames_atlas_current)
-
-        # compute the expected hash from the data set which we provide
-        filenames_atlas_expected = pd.read_csv(
-            os.path.abspath(os.path.join('.', 'data', 'fmri_filename.csv')),
-            index_col=0)[atlas].values
-        for idx in range(filenames_atlas_expected.size):
-            filenames_atlas_expected[idx] = os.path.abspath(
-                filenames_atlas_expected[idx])
-        filenames_atlas_expected.sort()
-        expected_hash = joblib.hash(filenames_atlas_expected)
-
-        if current_hash == expected_hash:
-            return
-
-        shutil.rmtree(atlas_directory)
-
-    _download_fmri_data(atlas)
-
-
-def fetch_fmri_time_series(atlas='all'):
+    fmri_directory = os.path.abspath(os.path.join('.', 'data', 'fmri'))
+    manifest_file = os.path.join(fmri_directory, atlas, MANIFEST_FILENAME)
+
+    if not os.path.isfile(manifest_file):
+        # extract the full archive and record the size, modification time
+        # and hash of each file to only check these later on
+        archive_file = _fetch_archive(atlas)
+        print('Decompressing the archive {} ...'.format(archive_file))
+        members = _unzip(archive_file, fmri_directory)
+        manifest = pd.DataFrame(
+            [_manifest_entry(fmri_directory, member) for member in members],
+            columns=['member', 'size', 'mtime_ns', 'sha256'])
+        _write_manifest(manifest, manifest_file)
+        return
+
+    manifest = pd.read_csv(manifest_file)
+    damaged = _verify_manifest(manifest, fmri_directory)
+    if damaged:
+        print('Restoring {} missing or corrupted files of the atlas {} ...'
+              .format(len(damaged), atlas))
+        archive_file = _fetch_archive(atlas)
+        try:
+            _unzip(archive_file, fmri_directory, members=damaged)
+        except (zipfile.BadZipFile, zlib.error):
+            # the local archive is itself corrupted: download it again
+            os.remove(archive_file)
+            archive_file = _fetch_archive(atlas)
+            _unzip(archive_file, fmri_directory, members=damaged)
+        manifest = manifest.set_index('member')
+        for member in damaged:
+            entry = _manifest_entry(fmri_directory, member)
+            manifest.loc[member, ['size', 'mtime_ns', 'sha256']] = [
+                entry['size'], entry['mtime_ns'], entry['sha256']]
+        manifest = manifest.reset_index()
+    _write_manifest(manifest, manifest_file)
+
+
+def fetch_fmri_time_series(atlas='all', n_jobs=None):
     """Fetch the time-series extracted from the fMRI data using a specific
     atlas.
 
@@ -124,6 +240,18 @@ def fetch_fmri_time_series(atlas='all'):
         * `'msdl'`: MSDL functional atlas [3]_;
         * `'power_2011'`: Power atlas [4]_.
 
+    n_jobs : int or None, default=None
+        The number of archives downloaded concurrently. By default, all the
+        requested archives are downloaded at once. An interrupted download is
+        resumed when calling this function again.
+
+    Notes
+    -----
+    Once an archive is extracted, the size, modification time and hash of
+    each file are recorded in ``data/fmri/<atlas>/manifest.csv``. Subsequent
+    calls only restore the files which are missing or differ from the
+    manifest, from the archive kept in ``data/fmri``.
+
     Returns
     -------
     None
@@ -147,13 +275,16 @@ def fetch_fmri_time_series(atlas='all'):
 
     """
     if atlas == 'all':
-        for single_atlas in ATLAS:
-            _check_integrity_atlas(single_atlas)
+        atlases = ATLAS
     elif atlas in ATLAS:
-        _check_integrity_atlas(atlas)
+        atlases = (atlas,)
     else:
         raise ValueError("'atlas' should be one of {}. Got {} instead."
                          .format(ATLAS, atlas))
+    # the archives are fetched concurrently such that the download takes the
+    # time of the largest archive
+    with ThreadPoolExecutor(max_workers=n_jobs or len(atlases)) as executor:
+        list(executor.map(_check_integrity_atlas, atlases))
     print('Downloading completed ...')
 
 
@@ -165,6 +296,11 @@ if __name__ == '__main__':
                         default='all',
                         help='Name of the atlas. One of {}. To download '
                         'all atlases, use "all".'.format(ATLAS))
-    atlas = parser.parse_args().atlas
-
-    fetch_fmri_time_series(atlas)
+    parser.add_argument('--n-jobs',
+                        type=int,
+                        default=None,
+                        help='Number of archives downloaded concurrently. '
+                        'By default, all archives are downloaded at once.')
+    args = parser.parse_args()
+
+    fetch_fmri_time_series(args.atlas, n_jobs=args.n_jobs)
@@ -0,0 +1,239 @@
+# coding: utf-8
+
+"""Resample the fMRI time-series of an atlas to a common repetition time.
+
+The time-series of the subjects have different lengths because the sites
+differ in repetition time and in number of volumes. This script resamples the
+time-series of each subject, by linear interpolation, on a common grid of
+``n_time`` samples spaced by ``repetition_time`` seconds starting at the first
+volume, and stores them as a single dense array
+``data/fmri/<atlas>/timeseries_resampled.npy`` of shape
+(n_subjects, n_time, n_regions). The subjects are given, in the same order, by
+``data/fmri/<atlas>/timeseries_resampled_index.csv``.
+
+By default, ``n_time`` is the largest number of samples covered by the
+shortest acquisition, such that no subject is extrapolated.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from fmri_store import ATLAS, load_fmri_store, _subject_id_from_filename
+
+RESAMPLED_FILENAME = 'timeseries_resampled.npy'
+RESAMPLED_INDEX_FILENAME = 'timeseries_resampled_index.csv'
+
+
+def _max_n_time(n_samples, source_repetition_time, repetition_time):
+    """Number of samples of the common grid covered by an acquisition."""
+    # tolerate rounding errors in the repetition times
+    return (np.floor((n_samples - 1) * source_repetition_time /
+                     repetition_time + 1e-6) + 1).astype(int)
+
+
+def resample_time_series(time_series, source_repetition_time,
+                         repetition_time=2., n_time=None,
+                         dtype=np.float32):
+    """Resample time-series to a common repetition time and length.
+
+    Parameters
+    ----------
+    time_series : list of ndarray, shape (n_samples_i, n_regions)
+        The time-series of each subject.
+
+    source_repetition_time : array-like, shape (n_subjects,)
+        The repetition time, in seconds, of each subject.
+
+    repetition_time : float, default=2.
+        The common repetition time, in seconds.
+
+    n_time : int or None, default=None
+        The number of samples of the common grid. By default, the largest
+        number of samples covered by all the subjects.
+
+    dtype : numpy dtype, default=np.float32
+        The type of the resampled time-series.
+
+    Returns
+    -------
+    resampled : ndarray, shape (n_subjects, n_time, n_regions)
+        The resampled time-series.
+
+    """
+    source_repetition_time = np.asarray(source_repetition_time, dtype=float)
+    n_samples = np.array([ts.shape[0] for ts in time_series])
+    max_n_time = _max_n_time(n_samples, source_repetition_time,
+                             repetition_time)
+    if n_time is None:
+        n_time = int(max_n_time.min())
+    elif np.any(max_n_time < n_time):
+        raise ValueError('{} subjects are too short to be resampled on {} '
+                         'samples of {} s. Use n_time <= {}.'
+                         .format(np.sum(max_n_time < n_time), n_time,
+                                 repetition_time, max_n_time.min()))
+
+    n_regions = time_series[0].shape[1]
+    resampled = np.empty((len(time_series), n_time, n_regions), dtype=dtype)
+    for i, (ts, source_tr) in enumerate(zip(time_series,
+                                            source_repetition_time)):
+        # position of the common grid in samples of the acquisition
+        position = np.arange(n_time) * repetition_time / source_tr
+        lower = np.minimum(position.astype(int), ts.shape[0] - 2)
+        weight = (position - lower)[:, np.newaxis]
+        resampled[i] = (1 - weight) * ts[lower] + weight * ts[lower + 1]
+    return resampled
+
+
+def _resample_atlas(atlas, path='.', repetition_time=2., n_time=None,
+                    dtype=np.float32):
+    atlas_directory = os.path.join(path, 'data', 'fmri', atlas)
+    fmri_filenames = pd.read_csv(
+        os.path.join(path, 'data', 'fmri_filename.csv'), index_col=0,
+        dtype={'subject_id': str})[atlas]
+    source_repetition_time = pd.read_csv(
+        os.path.join(path, 'data', 'fmri_repetition_time.csv'), index_col=0,
+        dtype={'subject_id': str})['repetition_time']
+
+    print('Resampling the time-series of the atlas {} ...'.format(atlas))
+    store = load_fmri_store(atlas, path=path)
+    if store is not None:
+        time_series = store.load([os.path.join(path, filename)
+                                  for filename in fmri_filenames])
+    else:
+        time_series = [pd.read_csv(os.path.join(path, filename),
+                                   header=None).values
+                       for filename in fmri_filenames]
+    subject_id = [_subject_id_from_filename(filename)
+                  for filename in fmri_filenames]
+    source_repetition_time = source_repetition_time.loc[subject_id].values
+    resampled = resample_time_series(
+        time_series, source_repetition_time, repetition_time=repetition_time,
+        n_time=n_time, dtype=dtype)
+
+    index = pd.DataFrame({
+        'repetition_time': source_repetition_time,
+        'n_samples': [ts.shape[0] for ts in time_series]},
+        index=pd.Index(subject_id, name='subject_id'))
+    # write in temporary files and rename them to never expose a partially
+    # written array to a concurrent reader
+    resampled_filename = os.path.join(atlas_directory, RESAMPLED_FILENAME)
+    index_filename = os.path.join(atlas_directory, RESAMPLED_INDEX_FILENAME)
+    np.save(resampled_filename + '.tmp.npy', resampled)
+    index.to_csv(index_filename + '.tmp')
+    os.rename(resampled_filename + '.tmp.npy', resampled_filename)
+    os.rename(index_filename + '.tmp', index_filename)
+    print('{} subjects resampled on {} samples of {} s'.format(
+        *resampled.shape[:2], repetition_time))
+
+
+def resample_fmri_time_series(atlas='all', path='.', repetition_time=2.,
+                              n_time=None, dtype=np.float32):
+    """Resample the time-series of an atlas into a dense array.
+
+    Parameters
+    ----------
+    atlas : string, default='all'
+        The name of the atlas to resample. Refer to
+        :func:`download_data.fetch_fmri_time_series` for the possibilities.
+
+    path : string, default='.'
+        The root directory containing the ``data`` folder.
+
+    repetition_time : float, default=2.
+        The common repetition time, in seconds.
+
+    n_time : int or None, default=None
+        The number of samples of the common grid. By default, the largest
+        number of samples covered by all the subjects.
+
+    dtype : numpy dtype, default=np.float32
+        The type used to store the time-series.
+
+    Returns
+    -------
+    None
+
+    """
+    if atlas == 'all':
+        for single_atlas in ATLAS:
+            _resample_atlas(single_atlas, path=path,
+                            repetition_time=repetition_time, n_time=n_time,
+                            dtype=dtype)
+    elif atlas in ATLAS:
+        _resample_atlas(atlas, path=path, repetition_time=repetition_time,
+                        n_time=n_time, dtype=dtype)
+    else:
+        raise ValueError("'atlas' should be one of {}. Got {} instead."
+                         .format(ATLAS, atlas))
+
+
+def load_resampled_time_series(atlas, subject_id=None, path='.',
+                               mmap_mode='r'):
+    """Load the resampled time-series of an atlas.
+
+    Parameters
+    ----------
+    atlas : string
+        The name of the atlas.
+
+    subject_id : array-like or None, default=None
+        The subjects to load, e.g. the index of the data returned by
+        ``problem.get_train_data``. By default, all the subjects are loaded.
+
+    path : string, default='.'
+        The root directory containing the ``data`` folder.
+
+    mmap_mode : {None, 'r', 'r+', 'c'}, default='r'
+        The memory-mapping mode passed to :func:`numpy.load`.
+
+    Returns
+    -------
+    time_series : ndarray, shape (n_subjects, n_time, n_regions)
+        The resampled time-series, in the order of ``subject_id``.
+
+    """
+    atlas_directory = os.path.join(path, 'data', 'fmri', atlas)
+    resampled = np.load(os.path.join(atlas_directory, RESAMPLED_FILENAME),
+                        mmap_mode=mmap_mode)
+    if subject_id is None:
+        return resampled
+    index = pd.read_csv(os.path.join(atlas_directory,
+                                     RESAMPLED_INDEX_FILENAME),
+                        dtype={'subject_id': str}, index_col=0)
+    rows = index.index.get_indexer([str(subject) for subject in subject_id])
+    if np.any(rows < 0):
+        raise KeyError('{} subjects were not resampled.'
+                       .format(np.sum(rows < 0)))
+    return resampled[rows]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Resample the time series of an atlas to a common '
+        'repetition time and length, stored as a dense array.')
+    parser.add_argument('atlas',
+                        default='all',
+                        help='Name of the atlas. One of {}. To resample all '
+                        'atlases, use "all".'.format(ATLAS))
+    parser.add_argument('--repetition-time', type=float, default=2.,
+                        help='Common repetition time, in seconds.')
+    parser.add_argument('--n-time', type=int, default=None,
+                        help='Number of samples of the common grid. By '
+                        'default, the largest number covered by all the '
+                        'subjects.')
+    parser.add_argument('--dtype',
+                        default='float32',
+                        choices=['float32', 'float64'],
+                        help='Type used to store the time series.')
+    args = parser.parse_args()
+
+    resample_fmri_time_series(args.atlas,
+                              repetition_time=args.repetition_time,
+                              n_time=args.n_time,
+                              dtype=np.dtype(args.dtype))
@@ -0,0 +1,291 @@
+# coding: utf-8
+
+"""Pack the fMRI time-series of an atlas into a single binary store.
+
+The time-series of each atlas are distributed as one CSV file per subject in
+``data/fmri/<atlas>/<subject_id>/run_1``. Parsing these text files is the
+bottleneck when loading the functional data. This script concatenates all the
+time-series of an atlas along the time axis into a single contiguous array
+``data/fmri/<atlas>/timeseries.npy`` and writes an index
+``data/fmri/<atlas>/timeseries_index.csv`` giving, for each subject, the rows
+of the array containing its time-series. The array is memory-mapped when
+loading such that each subject is resolved into a view without copy.
+
+The index also records the modification time and the size of the CSV file of
+each subject. When loading, the subjects whose CSV file changed since the
+packing, e.g. after a new extraction, are read from their CSV file instead of
+the store, with a warning to pack the atlas again.
+
+The time-series are stored in float64, the precision of the CSV files. They
+can be stored in float32 with ``--dtype float32`` to halve the size of the
+store, which changes the values loaded by the submissions.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+ATLAS = ('basc064', 'basc122', 'basc197', 'craddock_scorr_mean',
+         'harvard_oxford_cort_prob_2mm', 'msdl', 'power_2011')
+
+STORE_FILENAME = 'timeseries.npy'
+INDEX_FILENAME = 'timeseries_index.csv'
+
+
+def _subject_id_from_filename(fmri_filename):
+    """Get the subject id from the path of a time-series CSV file."""
+    # the files are stored as <atlas>/<subject_id>/<run>/<filename>.csv
+    return os.path.basename(
+        os.path.dirname(os.path.dirname(os.path.normpath(fmri_filename))))
+
+
+def _source_stat(subject_filename):
+    """Modification time and size identifying a version of a CSV file."""
+    stat = os.stat(subject_filename)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _pack_atlas(atlas, path='.', dtype=np.float64):
+    atlas_directory = os.path.join(path, 'data', 'fmri', atlas)
+    if not os.path.isdir(atlas_directory):
+        raise IOError('The time-series for the atlas {} are not available '
+                      'in {}. Run "python download_data.py {}" first.'
+                      .format(atlas, atlas_directory, atlas))
+    fmri_filenames = pd.read_csv(
+        os.path.join(path, 'data', 'fmri_filename.csv'), index_col=0,
+        dtype={'subject_id': str})[atlas]
+
+    print('Packing the time-series of the atlas {} ...'.format(atlas))
+    time_series, start, stop = [], [], []
+    filename, mtime, size = [], [], []
+    n_samples = 0
+    for subject_filename in fmri_filenames:
+        # the filenames are given relatively to the root of the data
+        subject_filename = os.path.join(path, subject_filename)
+        subject_mtime, subject_size = _source_stat(subject_filename)
+        ts = pd.read_csv(subject_filename, header=None).values.astype(dtype)
+        time_series.append(ts)
+        start.append(n_samples)
+        n_samples += ts.shape[0]
+        stop.append(n_samples)
+        filename.append(os.path.relpath(subject_filename, atlas_directory))
+        mtime.append(subject_mtime)
+        size.append(subject_size)
+
+    index = pd.DataFrame({'start': start, 'stop': stop, 'filename': filename,
+                          'mtime': mtime, 'size': size},
+                         columns=['start', 'stop', 'filename', 'mtime',
+                                  'size'],
+                         index=pd.Index(
+                             [_subject_id_from_filename(filename)
+                              for filename in fmri_filenames],
+                             name='subject_id'))
+
+    # write in temporary files and rename them to never expose a partially
+    # written store to a concurrent reader
+    store_filename = os.path.join(atlas_directory, STORE_FILENAME)
+    index_filename = os.path.join(atlas_directory, INDEX_FILENAME)
+    np.save(store_filename + '.tmp.npy', np.concatenate(time_series, axis=0))
+    index.to_csv(index_filename + '.tmp')
+    os.rename(store_filename + '.tmp.npy', store_filename)
+    os.rename(index_filename + '.tmp', index_filename)
+
+
+def pack_fmri_time_series(atlas='all', path='.', dtype=np.float64):
+    """Pack the time-series of an atlas into a memory-mappable binary store.
+
+    Parameters
+    ----------
+    atlas : string, default='all'
+        The name of the atlas to pack. Refer to
+        :func:`download_data.fetch_fmri_time_series` for the possibilities.
+
+    path : string, default='.'
+        The root directory containing the ``data`` folder.
+
+    dtype : numpy dtype, default=np.float64
+        The type used to store the time-series. With np.float32, the store
+        is twice smaller but the values of the time-series are rounded.
+
+    Returns
+    -------
+    None
+
+    """
+    if atlas == 'all':
+        for single_atlas in ATLAS:
+            _pack_atlas(single_atlas, path=path, dtype=dtype)
+    elif atlas in ATLAS:
+        _pack_atlas(atlas, path=path, dtype=dtype)
+    else:
+        raise ValueError("'atlas' should be one of {}. Got {} instead."
+                         .format(ATLAS, atlas))
+    print('Packing completed ...')
+
+
+class FMRIStore(object):
+    """Memory-mapped time-series of a packed atlas.
+
+    Parameters
+    ----------
+    atlas_directory : string
+        The directory ``data/fmri/<atlas>`` in which the store was written by
+        :func:`pack_fmri_time_series`.
+
+    mmap_mode : {None, 'r', 'r+', 'c'}, default='r'
+        The memory-mapping mode passed to :func:`numpy.load`.
+
+    Attributes
+    ----------
+    data_ : ndarray, shape (n_samples, n_regions)
+        The time-series of all subjects concatenated along the time axis.
+
+    index_ : dict
+        Mapping from a subject id to the ``(start, stop)`` rows of ``data_``.
+
+    stale_ : dict
+        Mapping from the id of the subjects whose CSV file changed since the
+        packing to the path of this file. Their time-series are read from
+        the CSV file instead of the store.
+
+    """
+
+    def __init__(self, atlas_directory, mmap_mode='r'):
+        self.atlas_directory = atlas_directory
+        self.mmap_mode = mmap_mode
+        # view the memory-map as a plain array such that the time-series are
+        # not exposed as np.memmap which some estimators reject
+        self.data_ = np.asarray(np.load(
+            os.path.join(atlas_directory, STORE_FILENAME),
+            mmap_mode=mmap_mode))
+        index = pd.read_csv(os.path.join(atlas_directory, INDEX_FILENAME),
+                            dtype={'subject_id': str}, index_col=0)
+        self.index_ = dict(zip(index.index,
+                               zip(index['start'].values,
+                                   index['stop'].values)))
+        self.stale_ = self._find_stale(index)
+        if self.stale_:
+            warnings.warn('The time-series of {} subjects changed since the '
+                          'store {} was packed and are read from their CSV '
+                          'file. Pack the atlas again with fmri_store.py.'
+                          .format(len(self.stale_), atlas_directory))
+
+    def _find_stale(self, index):
+        if not {'filename', 'mtime', 'size'}.issubset(index.columns):
+            # packed before the source files were recorded, nothing can be
+            # checked: read all the subjects from their CSV file
+            return {subject_id: None for subject_id in index.index}
+        stale = {}
+        for subject_id, filename, mtime, size in zip(
+                index.index, index['filename'], index['mtime'],
+                index['size']):
+            filename = os.path.join(self.atlas_directory, filename)
+            # a file removed since the packing is only available in the
+            # store
+            if (os.path.isfile(filename) and
+                    _source_stat(filename) != (mtime, size)):
+                stale[subject_id] = filename
+        return stale
+
+    def __len__(self):
+        return len(self.index_)
+
+    def __contains__(self, subject_id):
+        return str(subject_id) in self.index_
+
+    def __getitem__(self, subject_id):
+        subject_id = str(subject_id)
+        if subject_id in self.stale_:
+            filename = self.stale_[subject_id]
+            if filename is None:
+                raise KeyError('The source file of the subject {} is not '
+                               'recorded in the store.'.format(subject_id))
+            return pd.read_csv(filename, header=None).values
+        start, stop = self.index_[subject_id]
+        return self.data_[start:stop]
+
+    def is_current(self, subject_id):
+        """Check if the store holds the current time-series of a subject."""
+        subject_id = str(subject_id)
+        return subject_id in self.index_ and subject_id not in self.stale_
+
+    def load(self, fmri_filenames):
+        """Resolve the time-series CSV filenames into views of the store.
+
+        Parameters
+        ----------
+        fmri_filenames : iterable of string
+            The ``fmri_<atlas>`` column returned by ``problem.get_train_data``
+            or ``problem.get_test_data``.
+
+        Returns
+        -------
+        time_series : list of ndarray, shape (n_samples_i, n_regions)
+            The time-series of each subject.
+
+        """
+        time_series = []
+        for filename in fmri_filenames:
+            subject_id = _subject_id_from_filename(filename)
+            if self.is_current(subject_id):
+                time_series.append(self[subject_id])
+            else:
+                time_series.append(pd.read_csv(filename, header=None).values)
+        return time_series
+
+
+def is_packed(atlas_directory):
+    """Check if the time-series of an atlas directory have been packed."""
+    return (os.path.isfile(os.path.join(atlas_directory, STORE_FILENAME)) and
+            os.path.isfile(os.path.join(atlas_directory, INDEX_FILENAME)))
+
+
+def load_fmri_store(atlas, path='.', mmap_mode='r'):
+    """Load the packed store of an atlas.
+
+    Parameters
+    ----------
+    atlas : string
+        The name of the atlas.
+
+    path : string, default='.'
+        The root directory containing the ``data`` folder.
+
+    mmap_mode : {None, 'r', 'r+', 'c'}, default='r'
+        The memory-mapping mode passed to :func:`numpy.load`.
+
+    Returns
+    -------
+    store : FMRIStore or None
+        The store or None if the atlas was not packed.
+
+    """
+    atlas_directory = os.path.join(path, 'data', 'fmri', atlas)
+    if not is_packed(atlas_directory):
+        return None
+    return FMRIStore(atlas_directory, mmap_mode=mmap_mode)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Pack the time series extracted from the functional MRI '
+        'data of an atlas into a single memory-mappable binary file.')
+    parser.add_argument('atlas',
+                        default='all',
+                        help='Name of the atlas. One of {}. To pack all '
+                        'atlases, use "all".'.format(ATLAS))
+    parser.add_argument('--dtype',
+                        default='float64',
+                        choices=['float32', 'float64'],
+                        help='Type used to store the time series. float32 '
+                        'halves the size of the store but rounds the time '
+                        'series.')
+    args = parser.parse_args()
+
+    pack_fmri_time_series(args.atlas, dtype=np.dtype(args.dtype))
@@ -0,0 +1,231 @@
+# coding: utf-8
+
+"""Generate a synthetic dataset with the layout of the ``data`` folder.
+
+The subjects are drawn with replacement from the metadata shipped with the
+starting kit, such that the sites, the phenotypes, the anatomical features,
+the quality checks and the repetition times keep realistic joint
+distributions. The age and the anatomical features are slightly jittered. The
+number of volumes of each subject is given by an acquisition duration drawn
+for each site and the repetition time of the subject.
+
+The time-series of each atlas, with the number of regions of the real atlas,
+are generated from a few latent components whose loadings vary across
+subjects and are slightly shifted for the ASD subjects, such that the
+submissions have a weak signal to learn. The following
+files are written in ``<path>/data``, such that ``problem.get_train_data`` and
+the submissions run unchanged from ``<path>``:
+
+* ``participants.csv``, ``anatomy.csv``, ``anatomy_qc.csv``, ``fmri_qc.csv``,
+  ``fmri_filename.csv``, ``fmri_repetition_time.csv``, ``train.csv`` and
+  ``test.csv``;
+* ``fmri/<atlas>/<subject_id>/run_1/<subject_id>_task-Rest_confounds.csv``
+  and ``fmri/motions/<subject_id>/run_1/motions.txt``.
+
+The dataset only depends on the seed, not on the number of workers.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from fmri_store import ATLAS
+
+N_REGIONS = {'basc064': 64, 'basc122': 122, 'basc197': 197,
+             'craddock_scorr_mean': 249, 'harvard_oxford_cort_prob_2mm': 48,
+             'msdl': 39, 'power_2011': 264}
+
+# range of the duration of the resting-state acquisitions, in seconds
+DURATION_RANGE = (300., 480.)
+N_LATENT = 8
+N_MOTIONS = 6
+
+
+def _read_reference(reference_path, filename):
+    return pd.read_csv(os.path.join(reference_path, 'data', filename),
+                       index_col=0, dtype={'subject_id': str})
+
+
+def _time_series_filename(atlas, subject_id):
+    if atlas == 'motions':
+        return './data/fmri/motions/{}/run_1/motions.txt'.format(subject_id)
+    return './data/fmri/{0}/{1}/run_1/{1}_task-Rest_confounds.csv'.format(
+        atlas, subject_id)
+
+
+def _atlas_loadings(atlas, random_state):
+    """Loadings of the latent components for the controls and the shift for
+    the ASD subjects."""
+    rng = np.random.RandomState([random_state, ATLAS.index(atlas)])
+    loadings = rng.standard_normal((N_LATENT, N_REGIONS[atlas]))
+    shift = 0.04 * rng.standard_normal((N_LATENT, N_REGIONS[atlas]))
+    return loadings, shift
+
+
+def _write_subjects(path, subjects, atlases, random_state):
+    """Write the time-series of a batch of subjects."""
+    loadings = {atlas: _atlas_loadings(atlas, random_state)
+                for atlas in atlases}
+    for index, subject_id, n_volumes, asd in subjects:
+        # seed each subject such that the data do not depend on the batches
+        rng = np.random.RandomState([random_state, len(ATLAS), index])
+        latent = rng.standard_normal((n_volumes, N_LATENT))
+        for atlas in atlases + ['motions']:
+            filename = os.path.join(path,
+                                    _time_series_filename(atlas, subject_id))
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            if atlas == 'motions':
+                ts = np.cumsum(
+                    0.01 * rng.standard_normal((n_volumes, N_MOTIONS)),
+                    axis=0)
+                np.savetxt(filename, ts, fmt='%.6f')
+                continue
+            atlas_loadings, shift = loadings[atlas]
+            # inter-subject variability of the loadings
+            subject_loadings = (
+                atlas_loadings + asd * shift +
+                0.5 * rng.standard_normal(atlas_loadings.shape))
+            ts = (latent.dot(subject_loadings) +
+                  rng.standard_normal((n_volumes, N_REGIONS[atlas])))
+            np.savetxt(filename, ts, fmt='%.6f', delimiter=',')
+
+
+def generate_data(path, n_subjects=1150, reference_path='.', test_size=0.2,
+                  atlases=ATLAS, random_state=0, n_jobs=1, batch_size=100):
+    """Generate a synthetic dataset.
+
+    Parameters
+    ----------
+    path : string
+        The root directory in which the ``data`` folder is written.
+
+    n_subjects : int, default=1150
+        The number of subjects.
+
+    reference_path : string, default='.'
+        The root directory containing the ``data`` folder whose metadata are
+        sampled.
+
+    test_size : float, default=0.2
+        The proportion of the subjects in ``test.csv``.
+
+    atlases : list of string, default=ATLAS
+        The atlases for which the time-series are written.
+
+    random_state : int, default=0
+        The seed of the generator.
+
+    n_jobs : int, default=1
+        The number of workers writing the time-series.
+
+    batch_size : int, default=100
+        The number of subjects written by a task.
+
+    Returns
+    -------
+    None
+
+    """
+    atlases = list(atlases)
+    rng = np.random.RandomState(random_state)
+    participants = _read_reference(reference_path, 'participants.csv')
+    anatomy = _read_reference(reference_path, 'anatomy.csv')
+    anatomy_qc = _read_reference(reference_path, 'anatomy_qc.csv')
+    fmri_qc = _read_reference(reference_path, 'fmri_qc.csv')
+    repetition_time = _read_reference(reference_path,
+                                      'fmri_repetition_time.csv')
+
+    # unique ids across the range of uint64 as the real ones, read as such
+    # by problem.py
+    subject_id = set()
+    while len(subject_id) < n_subjects:
+        subject_id.update(rng.randint(1, np.iinfo(np.uint64).max,
+                                      size=n_subjects - len(subject_id),
+                                      dtype=np.uint64))
+    subject_id = pd.Index(
+        [str(subject) for subject in rng.permutation(sorted(subject_id))],
+        name='subject_id')
+
+    # draw the reference subjects with replacement
+    reference = rng.choice(participants.index.values, size=n_subjects)
+
+    def sample(df):
+        sampled = df.loc[reference].copy()
+        sampled.index = subject_id
+        return sampled
+
+    participants = sample(participants)
+    participants['age'] = np.round(np.clip(
+        participants['age'] + rng.normal(0, 0.5, n_subjects), 5., None), 2)
+    anatomy = sample(anatomy)
+    anatomy *= 1 + 0.02 * rng.standard_normal(anatomy.shape)
+    anatomy_qc, fmri_qc = sample(anatomy_qc), sample(fmri_qc)
+    repetition_time = sample(repetition_time)
+
+    sites = np.unique(participants['site'])
+    duration = dict(zip(sites, rng.uniform(*DURATION_RANGE,
+                                           size=sites.size)))
+    n_volumes = np.round(
+        participants['site'].map(duration).values /
+        repetition_time['repetition_time'].values).astype(int)
+
+    fmri_filename = pd.DataFrame(
+        {atlas: [_time_series_filename(atlas, subject)
+                 for subject in subject_id]
+         for atlas in sorted(list(ATLAS) + ['motions'])},
+        index=subject_id)
+
+    data_path = os.path.join(path, 'data')
+    if not os.path.exists(data_path):
+        os.makedirs(data_path)
+    for filename, df in (('participants.csv', participants),
+                         ('anatomy.csv', anatomy),
+                         ('anatomy_qc.csv', anatomy_qc),
+                         ('fmri_qc.csv', fmri_qc),
+                         ('fmri_filename.csv', fmri_filename),
+                         ('fmri_repetition_time.csv', repetition_time)):
+        df.to_csv(os.path.join(data_path, filename))
+    n_test = int(round(test_size * n_subjects))
+    pd.Series(subject_id[n_test:]).to_csv(
+        os.path.join(data_path, 'train.csv'), header=False, index=False)
+    pd.Series(subject_id[:n_test]).to_csv(
+        os.path.join(data_path, 'test.csv'), header=False, index=False)
+
+    subjects = list(zip(range(n_subjects), subject_id, n_volumes,
+                        participants['asd'].values))
+    Parallel(n_jobs=n_jobs, verbose=1)(
+        delayed(_write_subjects)(path, subjects[start:start + batch_size],
+                                 atlases, random_state)
+        for start in range(0, n_subjects, batch_size))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic dataset with the layout of the '
+        'data folder.')
+    parser.add_argument('path',
+                        help='Root directory in which the data folder is '
+                        'written.')
+    parser.add_argument('--n-subjects', type=int, default=1150,
+                        help='Number of subjects.')
+    parser.add_argument('--atlas', nargs='+', default=list(ATLAS),
+                        choices=ATLAS,
+                        help='Atlases for which the time series are written.')
+    parser.add_argument('--test-size', type=float, default=0.2,
+                        help='Proportion of the subjects in test.csv.')
+    parser.add_argument('--random-state', type=int, default=0,
+                        help='Seed of the generator.')
+    parser.add_argument('--n-jobs', type=int, default=1,
+                        help='Number of workers writing the time series.')
+    args = parser.parse_args()
+
+    generate_data(args.path, n_subjects=args.n_subjects,
+                  test_size=args.test_size, atlases=args.atlas,
+                  random_state=args.random_state, n_jobs=args.n_jobs)
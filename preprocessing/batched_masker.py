@@ -0,0 +1,265 @@
+"""Extract the time-series of several atlases with a single sparse product.
+
+Each atlas is converted into a sparse matrix of weights of shape
+(n_regions, n_voxels) on the grid of the functional images:
+
+* labels atlases: the regions are the mean of the voxels of each label;
+* probabilistic atlases: the regions are the least-squares fit of the maps,
+  i.e. the pseudo-inverse of the maps;
+* coordinates atlases: the regions are the mean of the voxels in a sphere
+  around each seed.
+
+These are the reductions applied by ``NiftiLabelsMasker``, ``NiftiMapsMasker``
+and ``NiftiSpheresMasker``. The matrices of all the atlases are stacked such
+that the time-series of every atlas are extracted with one product per
+subject.
+
+Computing the weights of an atlas requires to resample it on the functional
+grid. The weights are therefore cached on disk, keyed by the atlas and the
+affine and shape of the grid, such that they are computed once and loaded by
+the workers for every subject sharing the same grid.
+
+"""
+
+import hashlib
+import os
+
+import numpy as np
+from scipy import linalg, sparse
+from sklearn.neighbors import NearestNeighbors
+
+from nilearn import image, signal
+from nilearn.image.resampling import coord_transform
+
+try:
+    from nilearn.image import check_niimg
+except ImportError:
+    # nilearn < 0.9
+    from nilearn._utils import check_niimg
+
+# weights already loaded in the process, keyed as in the cache on disk
+_WEIGHTS = {}
+# part of the key of the weights, to increment when their computation changes
+_WEIGHTS_VERSION = 2
+
+
+def _labels_weights(labels_img, affine, shape, background_label=0):
+    """Weights averaging the voxels of each label of an atlas."""
+    labels_img = image.resample_img(labels_img, target_affine=affine,
+                                    target_shape=shape,
+                                    interpolation='nearest', copy=True)
+    labels_data = np.asanyarray(labels_img.dataobj).ravel()
+    labels = np.unique(labels_data)
+    labels = labels[labels != background_label]
+    voxels = np.flatnonzero(labels_data != background_label)
+    rows = np.searchsorted(labels, labels_data[voxels])
+    counts = np.bincount(rows, minlength=labels.size)
+    return sparse.csr_matrix((1. / counts[rows], (rows, voxels)),
+                             shape=(labels.size, labels_data.size))
+
+
+def _maps_weights(maps_img, affine, shape):
+    """Weights fitting the maps of an atlas by least-squares."""
+    # the interpolation of NiftiMapsMasker
+    maps_img = image.resample_img(maps_img, target_affine=affine,
+                                  target_shape=shape,
+                                  interpolation='linear')
+    maps_data = maps_img.get_fdata()
+    maps_data = np.where(np.isfinite(maps_data), maps_data, 0)
+    maps_data = maps_data.reshape(-1, maps_data.shape[-1])
+    # the least-squares solution only depends on the voxels covered by a map
+    voxels = np.flatnonzero(np.any(maps_data != 0, axis=1))
+    weights = np.zeros((maps_data.shape[1], maps_data.shape[0]))
+    weights[:, voxels] = linalg.pinv(maps_data[voxels])
+    return sparse.csr_matrix(weights)
+
+
+def _spheres_weights(seeds, affine, shape, radius):
+    """Weights averaging the voxels in a sphere around each seed."""
+    voxels = np.indices(shape).reshape(3, -1)
+    world = np.asarray(coord_transform(voxels[0], voxels[1], voxels[2],
+                                       affine)).T
+    adjacency = NearestNeighbors(radius=radius).fit(
+        world).radius_neighbors_graph(seeds).tolil()
+    # the voxel nearest to a seed is included even if the sphere is smaller
+    # than a voxel
+    nearests = np.round(np.asarray(coord_transform(
+        seeds[:, 0], seeds[:, 1], seeds[:, 2], linalg.inv(affine))).T)
+    for i, nearest in enumerate(nearests.astype(int)):
+        if np.all(nearest >= 0) and np.all(nearest < shape):
+            adjacency[i, np.ravel_multi_index(nearest, shape)] = True
+    adjacency = adjacency.tocsr().astype(np.float64)
+    adjacency.data[:] = 1
+    # as NiftiSpheresMasker, which does not allow overlap by default
+    if adjacency.sum(axis=0).max() > 1:
+        raise ValueError('Overlap detected between spheres')
+    counts = np.asarray(adjacency.sum(axis=1)).ravel()
+    return sparse.diags(1. / counts).dot(adjacency).tocsr()
+
+
+def _atlas_weights(atlas, affine, shape, radius=5.):
+    """Weights of an atlas as given to ``_make_masker_from_atlas``."""
+    if isinstance(atlas, str):
+        atlas_ = check_niimg(atlas)
+        if len(atlas_.shape) == 3:
+            return _labels_weights(atlas_, affine, shape)
+        if 'craddock' in atlas:
+            return _labels_weights(image.index_img(atlas_, 25), affine,
+                                   shape)
+        return _maps_weights(atlas_, affine, shape)
+    seeds = np.vstack((atlas.rois['x'],
+                       atlas.rois['y'],
+                       atlas.rois['z'])).T
+    return _spheres_weights(seeds, affine, shape, radius)
+
+
+def _atlas_key(atlas, affine, shape, radius=5.):
+    """Hash identifying the weights of an atlas on a grid."""
+    hasher = hashlib.sha1(str(_WEIGHTS_VERSION).encode('utf-8'))
+    if isinstance(atlas, str):
+        # a modified atlas file invalidates the cache
+        atlas_stat = os.stat(atlas)
+        hasher.update('{}:{}:{}'.format(
+            os.path.abspath(atlas), atlas_stat.st_size,
+            atlas_stat.st_mtime).encode('utf-8'))
+    else:
+        seeds = np.vstack((atlas.rois['x'],
+                           atlas.rois['y'],
+                           atlas.rois['z'])).T
+        hasher.update(np.ascontiguousarray(seeds, dtype=np.float64).tobytes())
+        hasher.update(np.float64(radius).tobytes())
+    hasher.update(np.ascontiguousarray(affine, dtype=np.float64).tobytes())
+    hasher.update(np.asarray(shape, dtype=np.int64).tobytes())
+    return hasher.hexdigest()
+
+
+def _load_atlas_weights(atlas, affine, shape, radius=5., cache_dir=None):
+    """Weights of an atlas, computed once per grid if ``cache_dir`` is set."""
+    key = _atlas_key(atlas, affine, shape, radius=radius)
+    if key in _WEIGHTS:
+        return _WEIGHTS[key]
+    if cache_dir is None:
+        weights = _atlas_weights(atlas, affine, shape, radius=radius)
+    else:
+        filename = os.path.join(cache_dir, key + '.npz')
+        if os.path.isfile(filename):
+            weights = sparse.load_npz(filename)
+        else:
+            weights = _atlas_weights(atlas, affine, shape, radius=radius)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            # the workers computing the same weights concurrently write in
+            # their own temporary file and the last rename wins
+            tmp_filename = os.path.join(
+                cache_dir, '{}.{}.tmp.npz'.format(key, os.getpid()))
+            sparse.save_npz(tmp_filename, weights)
+            os.replace(tmp_filename, filename)
+    _WEIGHTS[key] = weights
+    return weights
+
+
+class BatchedMasker(object):
+    """Extract the time-series of several atlases at once.
+
+    Parameters
+    ----------
+    atlases : list of atlases
+        The atlases, as given to ``_make_masker_from_atlas``.
+
+    atlases_descr : list of str
+        The names of the atlases.
+
+    radius : float, optional (default=5.)
+        The radius, in millimeters, of the spheres of the coordinates
+        atlases.
+
+    detrend : bool, optional (default=True)
+        Whether to detrend the extracted time-series.
+
+    cache_dir : str or None, optional (default=None)
+        The directory in which the weights of the atlases are cached. By
+        default, the weights are only kept in memory.
+
+    Attributes
+    ----------
+    weights_ : sparse matrix, shape (n_regions_total, n_voxels)
+        The stacked weights of all the atlases.
+
+    slices_ : dict
+        The rows of ``weights_`` corresponding to each atlas.
+
+    affine_ : ndarray, shape (4, 4)
+        The affine of the functional grid.
+
+    shape_ : tuple of int
+        The shape of the functional grid.
+
+    """
+
+    def __init__(self, atlases, atlases_descr, radius=5., detrend=True,
+                 cache_dir=None):
+        self.atlases = atlases
+        self.atlases_descr = atlases_descr
+        self.radius = radius
+        self.detrend = detrend
+        self.cache_dir = cache_dir
+
+    def fit(self, img):
+        """Compute the weights of the atlases on the grid of an image.
+
+        Parameters
+        ----------
+        img : 3D/4D Niimg-like object
+            An image defined on the grid of the functional images.
+
+        Returns
+        -------
+        self
+
+        """
+        img = check_niimg(img)
+        self.affine_ = img.affine
+        self.shape_ = tuple(img.shape[:3])
+        weights, self.slices_ = [], {}
+        n_regions = 0
+        for atlas, atlas_descr in zip(self.atlases, self.atlases_descr):
+            atlas_weights = _load_atlas_weights(
+                atlas, self.affine_, self.shape_, radius=self.radius,
+                cache_dir=self.cache_dir)
+            weights.append(atlas_weights)
+            self.slices_[atlas_descr] = slice(
+                n_regions, n_regions + atlas_weights.shape[0])
+            n_regions += atlas_weights.shape[0]
+        self.weights_ = sparse.vstack(weights).tocsr()
+        return self
+
+    def transform(self, img):
+        """Extract the time-series of all the atlases.
+
+        Parameters
+        ----------
+        img : 4D Niimg-like object
+            The functional image, already smoothed, on the grid given to
+            ``fit``.
+
+        Returns
+        -------
+        time_series : dict
+            The time-series, of shape (n_samples, n_regions), of each atlas.
+
+        """
+        img = check_niimg(img, ensure_ndim=4)
+        if (tuple(img.shape[:3]) != self.shape_ or
+                not np.allclose(img.affine, self.affine_)):
+            raise ValueError('The image is not defined on the grid on which '
+                             'the masker was fitted.')
+        data = np.asanyarray(img.dataobj).reshape(-1, img.shape[3])
+        if not np.all(np.isfinite(data)):
+            data = np.where(np.isfinite(data), data, 0)
+        signals = self.weights_.dot(data.astype(np.float64)).T
+        time_series = {}
+        for atlas_descr in self.atlases_descr:
+            ts = signals[:, self.slices_[atlas_descr]]
+            time_series[atlas_descr] = signal.clean(ts, detrend=self.detrend,
+                                                    standardize=False)
+        return time_series
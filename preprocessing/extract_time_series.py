@@ -15,6 +15,23 @@ PATH_OUTPUT : str
     dumped in a
     `PATH_OUTPUT/subject_id/atlas_descr/subject_id_task-Rest_confounds.pkl`
 
+PATH_LEDGER : str
+    Location of the ledger recording the time-series already extracted for
+    each (subject, run, atlas), the size of the stored file and the
+    modification time of the functional image. When re-running the script,
+    only the entries which are missing or stale are extracted. The rows of
+    each run are appended as it completes and the ledger is compacted to one
+    row per entry at the end.
+
+PATH_FAILURES : str
+    Location of the log recording the error raised for each (subject, run,
+    atlas) for which the extraction failed.
+
+PATH_CACHE : str
+    Location of the cache of the atlases resampled on the grid of the
+    functional images. They are computed once per grid and loaded from disk
+    by the workers.
+
 PATH_TO_RESTING_STATE : str
     Path to the resting functional MRI in each subject folder. Default is
     'session_1/rest_1/rest_res2standard.nii.gz'
@@ -24,42 +41,57 @@ PATH_TO_MOTION_CORRECTION : str
     folder. Default is 'session_1/rest_1/rest_mc.1D'.
 
 ATLASES : list of atlases
-    A list of the atlases to use.
+    A list of the atlases to use, fetched by ``_fetch_atlases``.
 
 ATLASES_DESCR : list of atlases names
     A list of the ATLASES name to store properly the data later on.
 
-N_JOBS : int
-    The number of workers. The parallel computation is performed for the
-    subjects.
+SMOOTHING_FWHM : float
+    The full-width at half maximum, in millimeters, of the spatial smoothing
+    applied to the functional images.
+
+The number of workers is given by the option ``--n-jobs``. The parallel
+computation is performed for the subjects: each functional image is loaded
+and smoothed once and all the atlases are applied to the same in-memory image.
+The time-series are written on disk as soon as a subject is processed. By
+default, the time-series of all the atlases are extracted with a single sparse
+product, see ``batched_masker.py``; use ``--engine nilearn`` to use one nilearn
+masker per atlas instead.
 
 """
 
+import argparse
 import glob
-from os import makedirs, listdir
-from os.path import join, basename, normpath, exists, isdir
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import getpid, makedirs, listdir, replace, stat
+from os.path import join, basename, normpath, exists, isdir, getsize
 from shutil import copy
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from joblib import Parallel, delayed
 
-from sklearn.datasets.base import Bunch
-from sklearn.externals import six
+from sklearn.utils import Bunch
 
 from nilearn import image
-from nilearn._utils import check_niimg
-from nilearn.input_data import (NiftiLabelsMasker, NiftiMapsMasker,
-                                NiftiSpheresMasker)
+try:
+    from nilearn.image import check_niimg
+    from nilearn.maskers import (NiftiLabelsMasker, NiftiMapsMasker,
+                                 NiftiSpheresMasker)
+except ImportError:
+    # nilearn < 0.9
+    from nilearn._utils import check_niimg
+    from nilearn.input_data import (NiftiLabelsMasker, NiftiMapsMasker,
+                                    NiftiSpheresMasker)
 from nilearn.datasets import (fetch_atlas_basc_multiscale_2015,
                               fetch_atlas_msdl, fetch_atlas_craddock_2012,
                               fetch_atlas_harvard_oxford,
                               fetch_coords_power_2011)
-from nilearn.connectome import ConnectivityMeasure
+
+from batched_masker import BatchedMasker, _atlas_key
 
 
-def _make_masker_from_atlas(atlas, memory=None, memory_level=1):
+def _make_masker_from_atlas(atlas, memory=None, memory_level=1,
+                            smoothing_fwhm=6):
     """Construct a maker from a given atlas.
 
     Parameters
@@ -76,6 +108,11 @@ def _make_masker_from_atlas(atlas, memory=None, memory_level=1):
         Rough estimator of the amount of memory used by caching. Higher value
         means more memory for caching.
 
+    smoothing_fwhm : float or None, optional (default=6)
+        The full-width at half maximum, in millimeters, of the spatial
+        smoothing applied by the masker. Use None if the functional images
+        are already smoothed.
+
     Returns
     -------
     masker : Nilearn Masker
@@ -83,14 +120,14 @@ def _make_masker_from_atlas(atlas, memory=None, memory_level=1):
 
     """
 
-    if isinstance(atlas, six.string_types):
+    if isinstance(atlas, str):
         atlas_ = check_niimg(atlas)
         atlas_dim = len(atlas_.shape)
         if atlas_dim == 3:
             masker = NiftiLabelsMasker(atlas_,
                                        memory=memory,
                                        memory_level=memory_level,
-                                       smoothing_fwhm=6,
+                                       smoothing_fwhm=smoothing_fwhm,
                                        detrend=True,
                                        verbose=1)
         elif atlas_dim == 4:
@@ -99,14 +136,14 @@ def _make_masker_from_atlas(atlas, memory=None, memory_level=1):
                 masker = NiftiLabelsMasker(atlas_,
                                            memory=memory,
                                            memory_level=memory_level,
-                                           smoothing_fwhm=6,
+                                           smoothing_fwhm=smoothing_fwhm,
                                            detrend=True,
                                            verbose=1)
             else:
                 masker = NiftiMapsMasker(atlas_,
                                          memory=memory,
                                          memory_level=memory_level,
-                                         smoothing_fwhm=6,
+                                         smoothing_fwhm=smoothing_fwhm,
                                          detrend=True,
                                          verbose=1)
     else:
@@ -118,7 +155,7 @@ def _make_masker_from_atlas(atlas, memory=None, memory_level=1):
                                     radius=5.,
                                     memory=memory,
                                     memory_level=memory_level,
-                                    smoothing_fwhm=6,
+                                    smoothing_fwhm=smoothing_fwhm,
                                     detrend=True,
                                     verbose=1)
 
@@ -126,20 +163,21 @@ def _make_masker_from_atlas(atlas, memory=None, memory_level=1):
 
 
 def _extract_timeseries(func,
-                        atlas=fetch_atlas_basc_multiscale_2015().scale064,
+                        atlas=None,
                         confounds=None,
                         memory=None,
-                        memory_level=1):
+                        memory_level=1,
+                        smoothing_fwhm=6):
     """Extract time series for a list of functional volume.
 
     Parameters
     ----------
-    func : str,
-        Path of Nifti volumes.
+    func : str or 4D Niimg-like object,
+        Path of Nifti volumes or functional image already loaded.
 
-    atlas : str or 3D/4D Niimg-like object, (default=BASC64)
+    atlas : str or 3D/4D Niimg-like object, (default=None)
         The atlas to use to create the masker. If string, it should corresponds
-        to the path of a Nifti image.
+        to the path of a Nifti image. If None, BASC64 is used.
 
     confounds : str,
         Path containing the confounds.
@@ -152,28 +190,231 @@ def _extract_timeseries(func,
         Rough estimator of the amount of memory used by caching. Higher value
         means more memory for caching.
 
-    n_jobs : integer, optional (default=1)
-        Used to process several subjects in parallel.
-        If -1, then the number of jobs is set to the number of
-        cores.
+    smoothing_fwhm : float or None, optional (default=6)
+        The full-width at half maximum, in millimeters, of the spatial
+        smoothing. Use None if ``func`` is already smoothed.
+    """
+
+    if atlas is None:
+        atlas = fetch_atlas_basc_multiscale_2015().scale064
+    masker = _make_masker_from_atlas(atlas, memory=memory,
+                                     memory_level=memory_level,
+                                     smoothing_fwhm=smoothing_fwhm)
+    if confounds is not None:
+        confounds_ = np.loadtxt(confounds)
+    else:
+        confounds_ = None
+
+    return masker.fit_transform(func, confounds=confounds_)
+
+
+def _atomic_savetxt(filename, ts):
+    """Write the time series in a temporary file and rename it."""
+    np.savetxt(filename + '.tmp', ts, delimiter=',')
+    replace(filename + '.tmp', filename)
+
+
+def _atomic_copy(src, dst):
+    """Copy a file in a temporary file and rename it."""
+    copy(src, dst + '.tmp')
+    replace(dst + '.tmp', dst)
+
+
+def _atomic_to_csv(df, filename):
+    """Write a DataFrame in a temporary file and rename it."""
+    df.to_csv(filename + '.tmp', index=False)
+    replace(filename + '.tmp', filename)
+
+
+def _read_entries(filename, columns):
+    """Read the ledger or the failure log keyed by (subject, run, atlas).
+
+    The last row of a key appended several times is kept.
+    """
+    if not exists(filename):
+        return {}
+    df = pd.read_csv(filename, dtype={'subject_id': str, 'run': str})
+    return {(row['subject_id'], row['run'], row['atlas']): row
+            for row in df[columns].to_dict(orient='records')}
+
+
+def _write_entries(entries, filename, columns):
+    """Write the ledger or the failure log, one row per key."""
+    _atomic_to_csv(pd.DataFrame([entries[key] for key in sorted(entries)],
+                                columns=columns), filename)
+
+
+def _append_entries(rows, filename, columns):
+    """Append rows to the ledger or the failure log.
+
+    A key appended several times is read as its last row by
+    :func:`_read_entries` until the file is compacted by
+    :func:`_write_entries`.
+    """
+    if not rows:
+        return
+    write_header = not exists(filename) or getsize(filename) == 0
+    with open(filename, 'a') as f:
+        pd.DataFrame(rows, columns=columns).to_csv(f, header=write_header,
+                                                   index=False)
+
+
+def _is_complete(entry, func_mtime_ns):
+    """Check that an entry of the ledger is complete and up to date.
+
+    An entry is stale if the functional image was modified after the
+    extraction or if the stored time series were removed or altered.
+    """
+    return (entry is not None and func_mtime_ns is not None and
+            entry['func_mtime_ns'] == func_mtime_ns and
+            exists(entry['filename']) and
+            getsize(entry['filename']) == entry['size'])
+
+
+def _resample_atlas(atlas, func_img, cache_dir=None):
+    """Resample an atlas image on the grid of the functional image.
+
+    The resampled atlas is written in ``cache_dir``, keyed as the weights of
+    ``BatchedMasker``, such that it is computed once per grid. Only the
+    resampling is cached, not the time series extracted with it. The labels
+    of the craddock atlas are selected before resampling, as done by
+    ``_make_masker_from_atlas``. The coordinates atlases are returned as is.
+    """
+    if not isinstance(atlas, str) or cache_dir is None:
+        return atlas
+    filename = join(cache_dir, _atlas_key(atlas, func_img.affine,
+                                          func_img.shape[:3]) + '.nii.gz')
+    if not exists(filename):
+        atlas_ = check_niimg(atlas)
+        if len(atlas_.shape) == 4 and 'craddock' in atlas:
+            atlas_ = image.index_img(atlas_, 25)
+        # the interpolations of the nilearn maskers
+        resampled = image.resample_img(
+            atlas_, target_affine=func_img.affine,
+            target_shape=func_img.shape[:3],
+            interpolation='nearest' if len(atlas_.shape) == 3 else 'linear')
+        if not exists(cache_dir):
+            makedirs(cache_dir, exist_ok=True)
+        tmp_filename = '{}.{}.tmp.nii.gz'.format(filename[:-7], getpid())
+        resampled.to_filename(tmp_filename)
+        replace(tmp_filename, filename)
+    return filename
+
+
+def _extract_subject_timeseries(func, motion, subject_id, run, atlases,
+                                atlases_descr, path_output,
+                                smoothing_fwhm=6, engine='batched',
+                                cache_dir=None):
+    """Extract and store the time series of the atlases for a run.
+
+    The functional image is loaded and smoothed once. Smoothing on the grid
+    of the functional image before masking is what each masker does when
+    given ``smoothing_fwhm``, such that the time series are unchanged.
+
+    Parameters
+    ----------
+    func : str,
+        Path of the Nifti volumes.
+
+    motion : str,
+        Path of the motion correction parameters.
+
+    subject_id : str,
+        The subject id.
+
+    run : str,
+        The name of the run folder.
+
+    atlases : list of atlases
+        The atlases to use.
+
+    atlases_descr : list of str
+        The names of the atlases used to store the data.
+
+    path_output : str
+        The location where the time series are stored.
+
+    smoothing_fwhm : float, optional (default=6)
+        The full-width at half maximum, in millimeters, of the spatial
+        smoothing.
+
+    engine : {'batched', 'nilearn'}, optional (default='batched')
+        Whether to extract all the atlases with a single ``BatchedMasker``
+        or with one nilearn masker per atlas.
+
+    cache_dir : str or None, optional (default=None)
+        The directory in which the atlases resampled on the functional grid
+        are cached and shared between the workers. The extracted time series
+        are not cached.
+
+    Returns
+    -------
+    outputs : dict
+        The filename and the size of the stored time series of each atlas for
+        which the extraction succeeded.
+
+    failures : dict
+        The error raised for each atlas for which the extraction failed.
     """
 
+    outputs, failures = {}, {}
     try:
-        masker = _make_masker_from_atlas(atlas, memory=memory,
-                                         memory_level=memory_level)
-        if confounds is not None:
-            confounds_ = np.loadtxt(confounds)
-        else:
-            confounds_ = None
+        func_img = image.smooth_img(check_niimg(func, ensure_ndim=4),
+                                    smoothing_fwhm)
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+        return outputs, dict.fromkeys(atlases_descr, error)
+
+    if engine == 'batched':
+        try:
+            extracted = BatchedMasker(
+                atlases, atlases_descr, cache_dir=cache_dir).fit(
+                func_img).transform(func_img)
+        except Exception as e:
+            error = '{}: {}'.format(type(e).__name__, e)
+            return outputs, dict.fromkeys(atlases_descr, error)
+    else:
+        extracted = {}
+        for atlas, atlas_descr in zip(atlases, atlases_descr):
+            try:
+                # Do not include the confounds when extracting the time
+                # series
+                extracted[atlas_descr] = _extract_timeseries(
+                    func_img, atlas=_resample_atlas(atlas, func_img,
+                                                    cache_dir=cache_dir),
+                    confounds=None, smoothing_fwhm=None)
+            except Exception as e:
+                # record the failure and carry on with the other atlases
+                failures[atlas_descr] = '{}: {}'.format(type(e).__name__, e)
+
+    for atlas_descr in atlases_descr:
+        if atlas_descr not in extracted:
+            continue
+        ts = extracted[atlas_descr]
+        # store the time series
+        path_subject = join(path_output, atlas_descr, subject_id, run)
+        if not exists(path_subject):
+            makedirs(path_subject)
+        filename = join(path_subject,
+                        '%s_task-Rest_confounds.csv' % subject_id)
+        _atomic_savetxt(filename, ts)
+        outputs[atlas_descr] = (filename, getsize(filename))
 
-        return masker.fit_transform(func, confounds=confounds_)
+    if outputs:
+        # store the confounds in a separate directories
+        path_subject = join(path_output, 'motions', subject_id, run)
+        if not exists(path_subject):
+            makedirs(path_subject)
+        _atomic_copy(motion, join(path_subject, 'motions.txt'))
+
+    return outputs, failures
 
-    except ValueError as e:
-        print(str(e))
 
-# pylint: disable=invalid-name
+SMOOTHING_FWHM = 6
 
-N_JOBS = 4
+LEDGER_COLUMNS = ['subject_id', 'run', 'atlas', 'filename', 'size',
+                  'func_mtime_ns']
+FAILURES_COLUMNS = ['subject_id', 'run', 'atlas', 'error']
 
 ###############################################################################
 # Path definition
@@ -182,94 +423,148 @@ PATH_TO_DATA = ['/home/lemaitre/Documents/data/INST/*']
 SUBJECTS_EXCLUDED = ('/home/lemaitre/Documents/data/'
                      'inst_excluded_subjects.csv')
 PATH_OUTPUT = '/home/lemaitre/Documents/data/INST_time_series'
-
-subjects_path = []
-for pdata in PATH_TO_DATA:
-    subjects_path += glob.glob(pdata)
-subjects_path = sorted(subjects_path)
-subjects_path = [sp for sp in subjects_path if isdir(sp)]
+PATH_LEDGER = join(PATH_OUTPUT, 'ledger.csv')
+PATH_FAILURES = join(PATH_OUTPUT, 'failures.csv')
+PATH_CACHE = join(PATH_OUTPUT, 'cache')
 
 PATH_TO_RESTING_STATE = 'session_1/rest_1/rest_res2standard.nii.gz'
 PATH_TO_MOTION_CORRECTION = 'session_1/rest_1/rest_mc.1D'
 
-# path to the atlases
-ATLASES = [fetch_atlas_msdl().maps,
-           fetch_atlas_basc_multiscale_2015().scale064,
-           fetch_atlas_basc_multiscale_2015().scale122,
-           fetch_atlas_basc_multiscale_2015().scale197,
-           fetch_atlas_harvard_oxford(atlas_name='cort-prob-2mm').maps,
-           fetch_atlas_craddock_2012().scorr_mean,
-           fetch_coords_power_2011()]
 ATLASES_DESCR = ['msdl', 'basc064', 'basc122', 'basc197',
                  'harvard_oxford_cort_prob_2mm', 'craddock_scorr_mean',
                  'power_2011']
 
-# load the list of patient to exclude
-excluded_subjects = pd.read_csv(
-    SUBJECTS_EXCLUDED,
-    dtype={'subject_id': object})['subject_id'].tolist()
 
-###############################################################################
-# Build the list with all path
-dataset = {'func': [], 'motion': [], 'subject_id': [], 'run': []}
-for i, path_subject in enumerate(subjects_path):
-    subject_id = basename(normpath(path_subject))
-    if subject_id in excluded_subjects:
-        continue
-    content_dir = listdir(path_subject)
-    run_path = sorted([folder
-                       for folder in content_dir
-                       if isdir(join(path_subject, folder)) and
-                       'run_' in folder])
-    for rp in run_path:
-        dataset['subject_id'].append(subject_id)
-        dataset['run'].append(rp)
-        dataset['func'].append(join(path_subject, rp,
-                                    PATH_TO_RESTING_STATE))
-        dataset['motion'].append(join(path_subject, rp,
-                                      PATH_TO_MOTION_CORRECTION))
-# Create a Bunch object
-dataset = Bunch(**dataset)
-
-for atlas, atlas_descr in zip(ATLASES, ATLASES_DESCR):
-
-    # Do not include the confounds when extracting the time series
-    time_series = Parallel(n_jobs=N_JOBS, verbose=1)(
-        delayed(
-            _extract_timeseries)(func, atlas=atlas, confounds=None)
-        for func, confounds in zip(dataset.func, dataset.motion))
-
-    for ts, subject_id, rp, original_confound in zip(time_series,
-                                                     dataset.subject_id,
-                                                     dataset.run,
-                                                     dataset.motion):
-        # skip subjects for which time series extraction did not work
-        if ts is None:
+def _fetch_atlases():
+    """Fetch the atlases in the order of ``ATLASES_DESCR``."""
+    basc = fetch_atlas_basc_multiscale_2015()
+    return [fetch_atlas_msdl().maps,
+            basc.scale064,
+            basc.scale122,
+            basc.scale197,
+            fetch_atlas_harvard_oxford(atlas_name='cort-prob-2mm').maps,
+            fetch_atlas_craddock_2012().scorr_mean,
+            fetch_coords_power_2011()]
+
+
+def _list_runs():
+    """List the functional images and motion parameters of each run."""
+    subjects_path = []
+    for pdata in PATH_TO_DATA:
+        subjects_path += glob.glob(pdata)
+    subjects_path = sorted(subjects_path)
+    subjects_path = [sp for sp in subjects_path if isdir(sp)]
+
+    # load the list of patient to exclude
+    excluded_subjects = pd.read_csv(
+        SUBJECTS_EXCLUDED,
+        dtype={'subject_id': object})['subject_id'].tolist()
+
+    dataset = {'func': [], 'motion': [], 'subject_id': [], 'run': []}
+    for path_subject in subjects_path:
+        subject_id = basename(normpath(path_subject))
+        if subject_id in excluded_subjects:
             continue
-        # store the time series
-        path_subject = join(PATH_OUTPUT, atlas_descr, subject_id, rp)
-        if not exists(path_subject):
-            makedirs(path_subject)
-        filename = join(path_subject,
-                        '%s_task-Rest_confounds.csv' % subject_id)
-        np.savetxt(filename, ts, delimiter=',')
-        # store the confounds in a separate directories
-        path_subject = join(PATH_OUTPUT, 'motions', subject_id, rp)
-        if not exists(path_subject):
-            makedirs(path_subject)
-        copy(original_confound, join(path_subject, 'motions.txt'))
-        # store the matrix of correlation for MSDL
-        if atlas_descr == 'msdl':
-            path_subject = join(PATH_OUTPUT, 'correlation')
-            if not exists(path_subject):
-                makedirs(path_subject)
-            connectivity_measure = ConnectivityMeasure(kind='correlation')
-            correlation_matrix = connectivity_measure.fit_transform([ts])[0]
-            plt.figure()
-            np.fill_diagonal(correlation_matrix, 0)
-            plt.imshow(correlation_matrix, vmin=-1., vmax=1., cmap='RdBu_r',
-                       interpolation='nearest')
-            plt.colorbar()
-            plt.title('Correlation matrix MSDL atlas')
-            path_image = join(path_subject, subject_id + '_' + rp + '.png')
-            plt.savefig(path_image, bbox_inches='tight')
+        content_dir = listdir(path_subject)
+        run_path = sorted([folder
+                           for folder in content_dir
+                           if isdir(join(path_subject, folder)) and
+                           'run_' in folder])
+        for rp in run_path:
+            dataset['subject_id'].append(subject_id)
+            dataset['run'].append(rp)
+            dataset['func'].append(join(path_subject, rp,
+                                        PATH_TO_RESTING_STATE))
+            dataset['motion'].append(join(path_subject, rp,
+                                          PATH_TO_MOTION_CORRECTION))
+    # Create a Bunch object
+    return Bunch(**dataset)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Extract the time series of several atlases from the '
+        'preprocessed functional MRI data.')
+    parser.add_argument('--n-jobs', type=int, default=4,
+                        help='Number of subjects processed in parallel. If '
+                        '-1, all the cores are used.')
+    parser.add_argument('--engine', default='batched',
+                        choices=['batched', 'nilearn'],
+                        help='Extract all the atlases with a single sparse '
+                        'product or with one nilearn masker per atlas.')
+    args = parser.parse_args()
+
+    atlases = _fetch_atlases()
+    dataset = _list_runs()
+
+    ###########################################################################
+    # Plan the extraction: only the (subject, run, atlas) which are missing
+    # or stale in the ledger are processed
+    if not exists(PATH_OUTPUT):
+        makedirs(PATH_OUTPUT)
+    ledger = _read_entries(PATH_LEDGER, LEDGER_COLUMNS)
+    failures = _read_entries(PATH_FAILURES, FAILURES_COLUMNS)
+
+    tasks = []
+    for func, motion, subject_id, rp in zip(dataset.func, dataset.motion,
+                                            dataset.subject_id, dataset.run):
+        try:
+            func_mtime_ns = stat(func).st_mtime_ns
+        except OSError:
+            func_mtime_ns = None
+        todo = []
+        for i, atlas_descr in enumerate(ATLASES_DESCR):
+            key = (subject_id, rp, atlas_descr)
+            if _is_complete(ledger.get(key), func_mtime_ns):
+                # extracted by a run interrupted before its compaction
+                failures.pop(key, None)
+            else:
+                todo.append(i)
+        if todo:
+            tasks.append((func, motion, subject_id, rp, func_mtime_ns, todo))
+    print('{} runs to process, {} already extracted'.format(
+        len(tasks), len(dataset.func) - len(tasks)))
+
+    ###########################################################################
+    # Each worker stores the time series of a run as soon as they are
+    # extracted and the rows of the run are appended to the ledger as it
+    # completes, such that an interrupted extraction can be resumed. Both
+    # files are compacted to one row per entry at the end. The quality check
+    # of the time series is a separate stage, see qc_correlation.py
+    with ProcessPoolExecutor(max_workers=None if args.n_jobs == -1
+                             else args.n_jobs) as executor:
+        futures = {
+            executor.submit(_extract_subject_timeseries, func, motion,
+                            subject_id, rp, [atlases[i] for i in todo],
+                            [ATLASES_DESCR[i] for i in todo], PATH_OUTPUT,
+                            smoothing_fwhm=SMOOTHING_FWHM,
+                            engine=args.engine, cache_dir=PATH_CACHE):
+            (subject_id, rp, func_mtime_ns)
+            for func, motion, subject_id, rp, func_mtime_ns, todo in tasks}
+        for future in as_completed(futures):
+            subject_id, rp, func_mtime_ns = futures[future]
+            outputs, errors = future.result()
+            ledger_rows, failure_rows = [], []
+            for atlas_descr, (filename, size) in outputs.items():
+                key = (subject_id, rp, atlas_descr)
+                ledger[key] = dict(subject_id=subject_id, run=rp,
+                                   atlas=atlas_descr, filename=filename,
+                                   size=size, func_mtime_ns=func_mtime_ns)
+                ledger_rows.append(ledger[key])
+                failures.pop(key, None)
+            for atlas_descr, error in errors.items():
+                print('Extraction failed for {} {} {}: {}'.format(
+                    subject_id, rp, atlas_descr, error))
+                key = (subject_id, rp, atlas_descr)
+                failures[key] = dict(subject_id=subject_id, run=rp,
+                                     atlas=atlas_descr, error=error)
+                failure_rows.append(failures[key])
+            _append_entries(ledger_rows, PATH_LEDGER, LEDGER_COLUMNS)
+            _append_entries(failure_rows, PATH_FAILURES, FAILURES_COLUMNS)
+
+    _write_entries(ledger, PATH_LEDGER, LEDGER_COLUMNS)
+    _write_entries(failures, PATH_FAILURES, FAILURES_COLUMNS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Index the repetition time of the functional images of a fcon tree.
+
+Only the header of each ``rest.nii.gz`` is read, in a pool of threads, instead
+of spawning ``fslinfo`` for each image. The table of the repetition times is
+written in the same format as the former ``get_tr.sh``::
+
+    python get_tr.py <fcon> <outfile>
+
+A second table, ``<outfile>`` with the suffix ``_header`` (or the path given
+with ``--header-file``), gives the dimensions and the voxel sizes of each
+image.
+"""
+
+import argparse
+import csv
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+
+from nifti_header import read_nifti_header
+
+PATH_PATTERN = re.compile(r'/([^/]+)/run_(.)/session_(.)/rest_1')
+
+
+def index_run(filename):
+    """Read the header of a functional image and identify its run."""
+    match = PATH_PATTERN.search(filename)
+    if match is None:
+        raise ValueError('error parsing nifti path {}'.format(filename))
+    subject, run, session = match.groups()
+    header = read_nifti_header(filename)
+    record = {'participant_id': subject, 'session_id': session,
+              'run_id': run, 'repetition_time': header['repetition_time']}
+    for i in range(1, 5):
+        record['dim{}'.format(i)] = header['dim'][i]
+    for i in range(1, 4):
+        record['pixdim{}'.format(i)] = header['pixdim'][i]
+    record['datatype'] = header['datatype']
+    record['filename'] = filename
+    return record
+
+
+def index_repetition_time(fcon, outfile, header_file=None, n_jobs=8):
+    """Write the repetition time and the header of the functional images.
+
+    Parameters
+    ----------
+    fcon : str
+        The directory prepared by ``prepare_fcon.py``.
+
+    outfile : str
+        The TSV file of the repetition times.
+
+    header_file : str or None, optional (default=None)
+        The TSV file of the dimensions and voxel sizes. By default, the
+        suffix ``_header`` is added to ``outfile``.
+
+    n_jobs : int, optional (default=8)
+        The number of threads reading the headers.
+
+    Returns
+    -------
+    records : list of dict
+        The header of each image.
+    """
+    if header_file is None:
+        root, ext = os.path.splitext(outfile)
+        header_file = root + '_header' + (ext or '.tsv')
+    filenames = sorted(glob(os.path.join(
+        fcon, '*', '*', 'run_?', 'session_?', 'rest_1', 'rest.nii.gz')))
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        records = list(executor.map(index_run, filenames))
+
+    with open(outfile, 'w') as f:
+        print('participant_id\tsession_id\trun_id\trepetition_time', file=f)
+        for record in records:
+            # same format as fslinfo
+            print('{participant_id}\t{session_id}\t{run_id}\t'
+                  '{repetition_time:f}'.format(**record), file=f)
+    with open(header_file, 'w') as f:
+        fieldnames = ['participant_id', 'session_id', 'run_id',
+                      'repetition_time', 'dim1', 'dim2', 'dim3', 'dim4',
+                      'pixdim1', 'pixdim2', 'pixdim3', 'datatype',
+                      'filename']
+        writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter='\t',
+                                lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(records)
+    return records
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Index the repetition time of the functional images of '
+        'a fcon tree.')
+    parser.add_argument('fcon', help='Directory prepared by prepare_fcon.py.')
+    parser.add_argument('outfile', help='TSV file of the repetition times.')
+    parser.add_argument('--header-file', default=None,
+                        help='TSV file of the dimensions and voxel sizes.')
+    parser.add_argument('--n-jobs', type=int, default=8,
+                        help='Number of threads reading the headers.')
+    args = parser.parse_args()
+
+    try:
+        index_repetition_time(args.fcon, args.outfile,
+                              header_file=args.header_file,
+                              n_jobs=args.n_jobs)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
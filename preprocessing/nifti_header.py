@@ -0,0 +1,51 @@
+"""Read the dimensions of a NIfTI-1 image from its header.
+
+Only the 348 bytes of the header are read, decompressing on the fly for the
+``.nii.gz`` files, which avoids spawning ``fslinfo`` or loading the image.
+"""
+
+import gzip
+import struct
+
+NIFTI1_HEADER_SIZE = 348
+
+# time units of the field xyzt_units, converted to seconds as fslinfo does
+TIME_UNITS = {8: 1., 16: 1e-3, 24: 1e-6}
+
+
+def read_nifti_header(filename):
+    """Read the dimensions and the voxel sizes of a NIfTI-1 image.
+
+    Parameters
+    ----------
+    filename : str
+        The path of a ``.nii`` or ``.nii.gz`` file.
+
+    Returns
+    -------
+    header : dict
+        ``dim`` and ``pixdim``, the 8 values of the fields of the same name,
+        ``repetition_time``, ``pixdim[4]`` in seconds, and ``datatype``.
+    """
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rb') as f:
+        header = f.read(NIFTI1_HEADER_SIZE)
+    if len(header) < NIFTI1_HEADER_SIZE:
+        raise ValueError('{} is not a NIfTI-1 file: truncated header.'
+                         .format(filename))
+    # the byte order is given by the size of the header
+    for endianness in '<>':
+        if struct.unpack(endianness + 'i', header[:4])[0] == \
+                NIFTI1_HEADER_SIZE:
+            break
+    else:
+        raise ValueError('{} is not a NIfTI-1 file.'.format(filename))
+    dim = struct.unpack(endianness + '8h', header[40:56])
+    datatype = struct.unpack(endianness + 'h', header[70:72])[0]
+    pixdim = struct.unpack(endianness + '8f', header[76:108])
+    xyzt_units = bytearray(header[123:124])[0]
+    # fslinfo prints 6 decimals, round to not expose the float32 precision
+    repetition_time = round(
+        pixdim[4] * TIME_UNITS.get(xyzt_units & 0x38, 1.), 6)
+    return {'dim': dim, 'pixdim': tuple(round(p, 6) for p in pixdim),
+            'repetition_time': repetition_time, 'datatype': datatype}
@@ -2,15 +2,25 @@
 """
 ntraut 2017
 order files for fcon scripts
+
+The sites are scanned and the images converted in a pool of threads. The
+dimensions of the functional images are read from their NIfTI header. The
+scanned runs are recorded in an inventory such that re-running the script only
+processes the new runs. The subjects of each site are split into batches of
+similar total number of volumes.
 """
 
 # pylint: disable=C0103
+import csv
 import os
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 import subprocess
 
+from nifti_header import read_nifti_header
+
 # intitial data structure (to be adapted)
-idir = "XXX" # Path to input dataset
+idir = "XXX"  # Path to input dataset
 siteTemplate = "*"
 sessionTemplate = "ses*"
 functionalTemplate = "func/*_task-rest_*bold.nii.gz"
@@ -19,14 +29,28 @@ anatomicalTemplate = "anat/*_T1w.nii.gz"
 # output directory
 odir = "$HOME/abide2/data/fcon"
 
-print("Generating file structure...")
-site_dirs = sorted(glob(os.path.join(idir, siteTemplate)))
-params = {}
-for site_dir in site_dirs:
+# number of threads scanning the sites and converting the images
+n_jobs = 8
+# total number of volumes of the subjects of a batch, about 20 runs of 200
+# volumes
+volumes_per_batch = 4000
+
+inventory_file = os.path.join(odir, "inventory.csv")
+inventory_fields = ["site_id", "subject_id", "run", "session", "source",
+                    "source_mtime_ns", "dim4", "pixdim4"]
+
+
+def convert(source, ofile):
+    """Convert an image to NIFTI_GZ with FSL."""
+    subprocess.call(["fslchfiletype", "NIFTI_GZ", source, ofile])
+    # os.link(source, ofile)
+
+
+def scan_site(site_dir):
+    """List the functional and anatomical images of a site."""
     site_id = os.path.basename(site_dir)
-    print(site_id)
     site_path = os.path.join(odir, site_id)
-    params[site_id] = []
+    functionals, anatomicals = [], []
     subject_dirs = sorted(glob(os.path.join(site_dir, "*")))
     for subject_dir in subject_dirs:
         subject_id = os.path.basename(subject_dir)
@@ -35,51 +59,121 @@ for site_dir in site_dirs:
         session_index = 0
         for session_dir in session_dirs:
             # Give a priority to images without acquisition label
-            functional_MRIs = sorted(glob(os.path.join(session_dir, functionalTemplate)),
-                                     key=lambda x: x.replace("_run", "1run"))
-            anatomical_MRIs = sorted(glob(os.path.join(session_dir, anatomicalTemplate)),
-                                     key=lambda x: x.replace("_run", "1run"))
+            functional_MRIs = sorted(
+                glob(os.path.join(session_dir, functionalTemplate)),
+                key=lambda x: x.replace("_run", "1run"))
+            anatomical_MRIs = sorted(
+                glob(os.path.join(session_dir, anatomicalTemplate)),
+                key=lambda x: x.replace("_run", "1run"))
             if not functional_MRIs or not anatomical_MRIs:
                 continue
             for run_index, functional_MRI in enumerate(functional_MRIs):
-                session_path = os.path.join(subject_path, "run_" + str(run_index + 1), "session_" +
-                                            str(session_index + 1))
-                functional_path = os.path.join(session_path, "rest_1")
-                os.makedirs(functional_path, exist_ok=True)
-                ofile = os.path.join(functional_path, "rest.nii.gz")
-                if not os.path.isfile(ofile):
-                    subprocess.call(["fslchfiletype", "NIFTI_GZ", functional_MRI, ofile])
-                    # os.link(functional_MRI, ofile)
-
-                # add to batch list only for session 1
-                if session_index == 0:
-                    output = subprocess.check_output("fslinfo " + ofile, shell=True).decode()
-                    infos = dict(item.split() for item in output.splitlines())
-                    dim4 = int(infos['dim4'])
-                    pixdim4 = float(infos['pixdim4'])
-                    subject_string = os.path.join(subject_id, "run_" + str(run_index + 1))
-                    found = False
-                    for param in params[site_id]:
-                        if param['dim4'] == dim4 and param['pixdim4'] == pixdim4:
-                            param['subjects'].append(subject_string)
-                            found = True
-                            break
-                    if not found:
-                        params[site_id].append({'dim4': dim4, 'pixdim4': pixdim4,
-                                                'subjects': [subject_string]})
-
-                for anatomical_index, anatomical_MRI in enumerate(anatomical_MRIs):
-                    anatomical_path = os.path.join(session_path, "anat_" +
-                                                   str(anatomical_index + 1))
-                    os.makedirs(anatomical_path, exist_ok=True)
-                    ofile = os.path.join(anatomical_path, "anat.nii.gz")
-                    if not os.path.isfile(ofile):
-                        subprocess.call(["fslchfiletype", "NIFTI_GZ", anatomical_MRI, ofile])
-                        # os.link(anatomical_MRI, ofile)
+                run = "run_" + str(run_index + 1)
+                session_path = os.path.join(
+                    subject_path, run, "session_" + str(session_index + 1))
+                functionals.append({
+                    'site_id': site_id, 'subject_id': subject_id, 'run': run,
+                    'session': session_index + 1, 'source': functional_MRI,
+                    'ofile': os.path.join(session_path, "rest_1",
+                                          "rest.nii.gz")})
+                for anatomical_index, anatomical_MRI in enumerate(
+                        anatomical_MRIs):
+                    anatomicals.append((anatomical_MRI, os.path.join(
+                        session_path, "anat_" + str(anatomical_index + 1),
+                        "anat.nii.gz")))
             session_index += 1
+    return functionals, anatomicals
+
+
+def prepare_functional(functional, cached):
+    """Convert a functional image and read its dimensions."""
+    ofile = functional['ofile']
+    source_mtime_ns = os.stat(functional['source']).st_mtime_ns
+    # reuse the inventory if the source did not change since the last scan
+    if (cached is not None and os.path.isfile(ofile) and
+            cached['source'] == functional['source'] and
+            int(cached['source_mtime_ns']) == source_mtime_ns):
+        dim4, pixdim4 = int(cached['dim4']), float(cached['pixdim4'])
+    else:
+        os.makedirs(os.path.dirname(ofile), exist_ok=True)
+        if not os.path.isfile(ofile) or cached is not None:
+            convert(functional['source'], ofile)
+        header = read_nifti_header(ofile)
+        dim4, pixdim4 = header['dim'][4], header['repetition_time']
+    record = {field: functional[field] for field in
+              ("site_id", "subject_id", "run", "session", "source")}
+    record.update(source_mtime_ns=source_mtime_ns, dim4=dim4, pixdim4=pixdim4)
+    return record
+
+
+def prepare_anatomical(anatomical):
+    """Convert an anatomical image if not already done."""
+    anatomical_MRI, ofile = anatomical
+    if not os.path.isfile(ofile):
+        os.makedirs(os.path.dirname(ofile), exist_ok=True)
+        convert(anatomical_MRI, ofile)
+
+
+def split_balanced(subjects, dim4, volumes_per_batch):
+    """Split subjects into batches of similar total number of volumes."""
+    n_batches = max(1, -(-len(subjects) * dim4 // volumes_per_batch))
+    size, remainder = divmod(len(subjects), n_batches)
+    batches, start = [], 0
+    for i in range(n_batches):
+        stop = start + size + (i < remainder)
+        batches.append(subjects[start:stop])
+        start = stop
+    return batches
+
+
+print("Generating file structure...")
+os.makedirs(odir, exist_ok=True)
+inventory = {}
+if os.path.isfile(inventory_file):
+    with open(inventory_file) as f:
+        inventory = {os.path.join(odir, row['site_id'], row['subject_id'],
+                                  row['run'], "session_" + row['session'],
+                                  "rest_1", "rest.nii.gz"): row
+                     for row in csv.DictReader(f)}
+
+site_dirs = sorted(glob(os.path.join(idir, siteTemplate)))
+with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+    scans = list(executor.map(scan_site, site_dirs))
+    functionals = [functional for functionals, _ in scans
+                   for functional in functionals]
+    anatomicals = [anatomical for _, anatomicals in scans
+                   for anatomical in anatomicals]
+    n_new = sum(functional['ofile'] not in inventory
+                for functional in functionals)
+    print("{} functional runs, {} new".format(len(functionals), n_new))
+    records = list(executor.map(
+        lambda functional: prepare_functional(
+            functional, inventory.get(functional['ofile'])), functionals))
+    list(executor.map(prepare_anatomical, anatomicals))
+
+with open(inventory_file + ".tmp", "w") as f:
+    writer = csv.DictWriter(f, fieldnames=inventory_fields)
+    writer.writeheader()
+    writer.writerows(records)
+os.replace(inventory_file + ".tmp", inventory_file)
+
+# add to batch list only for session 1
+params = {}
+for record in records:
+    if record['session'] != 1:
+        continue
+    dim4, pixdim4 = record['dim4'], record['pixdim4']
+    subject_string = os.path.join(record['subject_id'], record['run'])
+    site_params = params.setdefault(record['site_id'], [])
+    for param in site_params:
+        if param['dim4'] == dim4 and param['pixdim4'] == pixdim4:
+            param['subjects'].append(subject_string)
+            break
+    else:
+        site_params.append({'dim4': dim4, 'pixdim4': pixdim4,
+                            'subjects': [subject_string]})
 
 print("Writing batch list...")
-step = 20
 with open(os.path.join(odir, "batch_list.txt"), "w") as batch_list:
     for site in params:
         index = 0
@@ -87,11 +181,13 @@ with open(os.path.join(odir, "batch_list.txt"), "w") as batch_list:
             site_path = os.path.join(odir, site)
             dim4 = param['dim4']
             pixdim4 = param['pixdim4']
-            subjects = param['subjects']
-            for x in range(0, len(subjects), step):
-                subjects_file = os.path.join(site_path, "subjects-{}.txt".format(index + 1))
+            for subjects in split_balanced(param['subjects'], dim4,
+                                           volumes_per_batch):
+                subjects_file = os.path.join(
+                    site_path, "subjects-{}.txt".format(index + 1))
                 index += 1
                 with open(subjects_file, "w") as f:
-                    for line in subjects[x:x+step]:
+                    for line in subjects:
                         print(line, file=f)
-                print(site_path, subjects_file, 0, dim4-1, dim4, pixdim4, file=batch_list)
+                print(site_path, subjects_file, 0, dim4-1, dim4, pixdim4,
+                      file=batch_list)
@@ -0,0 +1,137 @@
+"""Quality check of the time-series extracted by ``extract_time_series.py``.
+
+The correlation matrices of the time-series of an atlas are computed in
+parallel from the files recorded in the ledger of the extraction and stored
+in a single file ``PATH_OUTPUT/correlation/<atlas>_correlation.npz``
+containing the arrays:
+
+* ``correlation``, of shape (n_runs, n_regions, n_regions);
+* ``subject_id`` and ``run``, identifying each matrix.
+
+With ``--thumbnails``, each matrix is also drawn in
+``PATH_OUTPUT/correlation/<subject_id>_<run>.png``.
+
+"""
+
+import argparse
+from os import makedirs, replace
+from os.path import join, exists
+
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt  # noqa: E402
+from joblib import Parallel, delayed  # noqa: E402
+
+from nilearn.connectome import ConnectivityMeasure  # noqa: E402
+
+from extract_time_series import LEDGER_COLUMNS, _read_entries  # noqa: E402
+
+
+def _correlation_matrices(filenames):
+    """Compute the correlation matrices of a batch of time-series files."""
+    time_series = [np.loadtxt(filename, delimiter=',', ndmin=2)
+                   for filename in filenames]
+    connectivity_measure = ConnectivityMeasure(kind='correlation')
+    return connectivity_measure.fit_transform(time_series)
+
+
+def _plot_thumbnails(correlation, names, path_output, atlas):
+    """Draw a batch of correlation matrices."""
+    for correlation_matrix, name in zip(correlation, names):
+        correlation_matrix = correlation_matrix.copy()
+        np.fill_diagonal(correlation_matrix, 0)
+        fig = plt.figure()
+        plt.imshow(correlation_matrix, vmin=-1., vmax=1., cmap='RdBu_r',
+                   interpolation='nearest')
+        plt.colorbar()
+        plt.title('Correlation matrix {} atlas'.format(atlas.upper()))
+        fig.savefig(join(path_output, name + '.png'), bbox_inches='tight')
+        # close the figure to not accumulate them in memory
+        plt.close(fig)
+
+
+def compute_correlation(path_output, atlas='msdl', n_jobs=1,
+                        thumbnails=False):
+    """Compute and store the correlation matrices of an atlas.
+
+    Parameters
+    ----------
+    path_output : str
+        The location where ``extract_time_series.py`` stored the time-series.
+
+    atlas : str, optional (default='msdl')
+        The name of the atlas.
+
+    n_jobs : int, optional (default=1)
+        The number of workers. If -1, all the cores are used.
+
+    thumbnails : bool, optional (default=False)
+        Whether to draw each correlation matrix in a PNG file.
+
+    Returns
+    -------
+    filename : str
+        The file in which the correlation matrices are stored.
+    """
+    path_ledger = join(path_output, 'ledger.csv')
+    if not exists(path_ledger):
+        raise IOError('No ledger found in {}. Run extract_time_series.py '
+                      'first.'.format(path_output))
+    # the ledger of an interrupted extraction has several rows per entry
+    ledger = pd.DataFrame(
+        list(_read_entries(path_ledger, LEDGER_COLUMNS).values()),
+        columns=LEDGER_COLUMNS)
+    ledger = ledger[ledger['atlas'] == atlas].sort_values(
+        ['subject_id', 'run'])
+    if ledger.empty:
+        raise ValueError('No time-series extracted for the atlas {}.'
+                         .format(atlas))
+
+    # a few batches per worker to balance the load
+    n_batches = min(len(ledger), 4 * (n_jobs if n_jobs > 0 else 8))
+    batches = np.array_split(np.arange(len(ledger)), n_batches)
+    filenames = ledger['filename'].values
+    correlation = np.concatenate(Parallel(n_jobs=n_jobs, verbose=1)(
+        delayed(_correlation_matrices)(filenames[batch])
+        for batch in batches))
+
+    path_correlation = join(path_output, 'correlation')
+    if not exists(path_correlation):
+        makedirs(path_correlation)
+    filename = join(path_correlation, '{}_correlation.npz'.format(atlas))
+    np.savez(filename + '.tmp.npz', correlation=correlation,
+             subject_id=np.asarray(ledger['subject_id'], dtype=str),
+             run=np.asarray(ledger['run'], dtype=str))
+    replace(filename + '.tmp.npz', filename)
+
+    if thumbnails:
+        names = (ledger['subject_id'] + '_' + ledger['run']).values
+        Parallel(n_jobs=n_jobs, verbose=1)(
+            delayed(_plot_thumbnails)(correlation[batch], names[batch],
+                                      path_correlation, atlas)
+            for batch in batches)
+
+    return filename
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compute the correlation matrices of the extracted '
+        'time-series for quality check.')
+    parser.add_argument('path_output',
+                        help='Location where the time-series were stored by '
+                        'extract_time_series.py.')
+    parser.add_argument('--atlas', default='msdl',
+                        help='Name of the atlas.')
+    parser.add_argument('--n-jobs', type=int, default=1,
+                        help='Number of workers. If -1, all the cores are '
+                        'used.')
+    parser.add_argument('--thumbnails', action='store_true',
+                        help='Draw each correlation matrix in a PNG file.')
+    args = parser.parse_args()
+
+    print('Correlation matrices stored in {}'.format(compute_correlation(
+        args.path_output, atlas=args.atlas, n_jobs=args.n_jobs,
+        thumbnails=args.thumbnails)))
@@ -1,4 +1,5 @@
 import os
+import pickle
 
 import numpy as np
 import pandas as pd
@@ -15,6 +16,13 @@ Predictions = rw.prediction_types.make_multiclass(
     label_names=_prediction_label_names)
 
 workflow = rw.workflows.FeatureExtractorClassifier()
+if os.environ.get('AUTISM_TRACE'):
+    # opt-in tracing of the stages of the workflow, see tracing.py
+    workflow = rw.utils.import_module_from_source(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     'tracing.py'),
+        'tracing').TracedFeatureExtractorClassifier(
+            os.environ['AUTISM_TRACE'])
 
 score_types = [
     rw.score_types.ROCAUC(name='auc', precision=3),
@@ -27,38 +35,100 @@ def get_cv(X, y):
     return cv.split(X, y)
 
 
-def _read_data(path, filename):
-    subject_id = pd.read_csv(os.path.join(path, 'data', filename), header=None)
+# metadata files joined into a single table, see _load_metadata
+_METADATA_FILENAMES = ('participants.csv', 'anatomy.csv', 'anatomy_qc.csv',
+                       'fmri_filename.csv', 'fmri_qc.csv',
+                       'fmri_repetition_time.csv')
+_METADATA_CACHE_FILENAME = 'metadata_cache.pkl'
+# bumped when _build_metadata changes to invalidate the pickled tables
+_METADATA_CACHE_VERSION = 2
+# metadata already loaded in this process, indexed by data directory
+_METADATA = {}
+
+
+def _build_metadata(data_path):
+    """Parse and join the metadata of all the subjects in a typed table."""
+    def read_csv(filename):
+        # the subject ids have 20 digits and only fit in unsigned integers
+        return pd.read_csv(os.path.join(data_path, filename), index_col=0,
+                           dtype={'subject_id': np.uint64})
+
     # read the list of the subjects
-    df_participants = pd.read_csv(os.path.join(path, 'data',
-                                               'participants.csv'),
-                                  index_col=0)
+    # site and sex keep the dtypes of the CSV file: categoricals would report
+    # the empty categories in value_counts and groupby
+    df_participants = read_csv('participants.csv')
     df_participants.columns = ['participants_' + col
                                for col in df_participants.columns]
     # load the structural and functional MRI data
-    df_anatomy = pd.read_csv(os.path.join(path, 'data', 'anatomy.csv'),
-                             index_col=0)
+    df_anatomy = read_csv('anatomy.csv').astype(np.float32)
     df_anatomy.columns = ['anatomy_' + col
                           for col in df_anatomy.columns]
-    df_fmri = pd.read_csv(os.path.join(path, 'data', 'fmri_filename.csv'),
-                          index_col=0)
+    df_fmri = read_csv('fmri_filename.csv')
     df_fmri.columns = ['fmri_' + col
                        for col in df_fmri.columns]
     # load the QC for structural and functional MRI data
-    df_anatomy_qc = pd.read_csv(os.path.join(path, 'data', 'anatomy_qc.csv'),
-                                index_col=0)
-    df_fmri_qc = pd.read_csv(os.path.join(path, 'data', 'fmri_qc.csv'),
-                             index_col=0)
-    df_fmri_tr = pd.read_csv(os.path.join(path, 'data',
-                                          'fmri_repetition_time.csv'),
-                             index_col=0)
+    df_anatomy_qc = read_csv('anatomy_qc.csv')
+    df_fmri_qc = read_csv('fmri_qc.csv')
+    df_fmri_tr = read_csv('fmri_repetition_time.csv')
     # rename the columns for the QC to have distinct names
     df_anatomy_qc = df_anatomy_qc.rename(columns={"select": "anatomy_select"})
     df_fmri_qc = df_fmri_qc.rename(columns={"select": "fmri_select"})
 
-    X = pd.concat([df_participants, df_anatomy, df_anatomy_qc, df_fmri,
-                   df_fmri_qc, df_fmri_tr], axis=1)
-    X = X.loc[subject_id[0]]
+    return pd.concat([df_participants, df_anatomy, df_anatomy_qc, df_fmri,
+                      df_fmri_qc, df_fmri_tr], axis=1)
+
+
+def _load_metadata(data_path):
+    """Load the metadata of all the subjects.
+
+    The joined table is pickled in ``data/metadata_cache.pkl`` and kept in
+    memory. Both are invalidated when one of the CSV files is modified or
+    when ``_METADATA_CACHE_VERSION`` changes.
+    """
+    mtimes = [_METADATA_CACHE_VERSION] + [
+        os.stat(os.path.join(data_path, filename)).st_mtime_ns
+        for filename in _METADATA_FILENAMES]
+    key = os.path.abspath(data_path)
+    if key in _METADATA and _METADATA[key][0] == mtimes:
+        return _METADATA[key][1]
+
+    cache_filename = os.path.join(data_path, _METADATA_CACHE_FILENAME)
+    metadata = None
+    try:
+        with open(cache_filename, 'rb') as f:
+            cached_mtimes, metadata = pickle.load(f)
+        if cached_mtimes != mtimes:
+            metadata = None
+    except Exception:
+        # missing cache or pickled by an incompatible version of pandas
+        metadata = None
+
+    if metadata is None:
+        metadata = _build_metadata(data_path)
+        try:
+            with open(cache_filename + '.tmp', 'wb') as f:
+                pickle.dump((mtimes, metadata), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_filename + '.tmp', cache_filename)
+        except (IOError, OSError):
+            # the data directory is read-only: only cache in memory
+            pass
+
+    _METADATA[key] = (mtimes, metadata)
+    return metadata
+
+
+def _read_data(path, filename):
+    data_path = os.path.join(path, 'data')
+    subject_id = pd.read_csv(os.path.join(data_path, filename), header=None,
+                             dtype=np.uint64)[0].values
+    metadata = _load_metadata(data_path)
+    subject_idx = metadata.index.get_indexer(subject_id)
+    if np.any(subject_idx < 0):
+        raise KeyError('Subjects {} are not in the metadata of {}.'.format(
+            subject_id[subject_idx < 0], data_path))
+    # copy the rows such that the cached table cannot be modified
+    X = metadata.iloc[subject_idx].copy()
     y = X['participants_asd']
     X = X.drop('participants_asd', axis=1)
 
@@ -75,6 +145,42 @@ def get_test_data(path='.'):
     return _read_data(path, filename)
 
 
+def get_fmri_time_series(X, atlas, path='.'):
+    """Load the fMRI time-series of the subjects in X for a given atlas.
+
+    If the atlas was packed with ``fmri_store.py``, the time-series are
+    zero-copy views of the memory-mapped store. Otherwise, or if the CSV file
+    of a subject changed since the packing, the CSV file is parsed.
+
+    Parameters
+    ----------
+    X : DataFrame
+        The data returned by :func:`get_train_data` or :func:`get_test_data`.
+
+    atlas : string
+        The name of the atlas.
+
+    path : string, default='.'
+        The root directory containing the ``data`` folder.
+
+    Returns
+    -------
+    time_series : list of ndarray, shape (n_samples_i, n_regions)
+        The time-series of each subject.
+
+    """
+    fmri_store = rw.utils.import_module_from_source(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     'fmri_store.py'), 'fmri_store')
+    store = fmri_store.load_fmri_store(atlas, path=path)
+    fmri_filenames = [os.path.join(path, subject_filename)
+                      for subject_filename in X['fmri_' + atlas]]
+    if store is not None:
+        return store.load(fmri_filenames)
+    return [pd.read_csv(subject_filename, header=None).values
+            for subject_filename in fmri_filenames]
+
+
 def save_submission(y_pred, data_path, output_path, suffix):
     np.savetxt(os.path.join(output_path, 'y_pred_{}.csv'.format(suffix)),
                y_pred)
@@ -0,0 +1,206 @@
+# coding: utf-8
+
+"""Run the region blasting experiment read by ``figure_3_regions_importance``.
+
+A functional submission is trained on the training set and tested on the test
+set once with all the regions of its atlas and once after removing ("blasting")
+each percentage of the most important regions, given by a ranking of the
+regions from the most to the least important. The predictions on the test set
+are written in the layout read by the figure 3 of ``scripts_figures``:
+``<submission>/training_output/y_pred_test.npy`` with all the regions and
+``<submission>_blast/training_output/y_pred_test.joblib``, the list of the
+predictions of each percentage::
+
+    python run_blasting.py --submission starting_kit_functional \\
+        --ranking msdl_ranking.txt --n-jobs 4
+
+The ranking is a text file with the index of a region of the atlas per line.
+
+The covariances of the subjects are loaded once with the first step of the
+``transformer_fmri`` pipeline of the feature extractor, from the cache of the
+covariances when available, and the blasted covariances are sliced out of
+them rather than estimated again from the time-series. The shrinkage of the
+Ledoit-Wolf estimator is thus the one estimated on all the regions. The
+percentages are run in a pool of processes which inherit the covariances when
+processes are forked.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import rampwf as rw
+from sklearn.preprocessing import FunctionTransformer
+
+PERCENTAGES = [25, 50, 75]
+
+# state shared with the workers, see _init_worker
+_STATE = {}
+
+
+def _load_state(ramp_kit_dir, ramp_data_dir, module_path, atlas):
+    problem = rw.utils.import_module_from_source(
+        os.path.join(ramp_kit_dir, 'problem.py'), 'problem')
+    feature_extractor = rw.utils.import_module_from_source(
+        os.path.join(module_path, 'feature_extractor.py'), 'feature_extractor')
+    classifier = rw.utils.import_module_from_source(
+        os.path.join(module_path, 'classifier.py'), 'classifier')
+    X_train, y_train = problem.get_train_data(path=ramp_data_dir)
+    X_test, _ = problem.get_test_data(path=ramp_data_dir)
+
+    transformer_fmri = getattr(feature_extractor.FeatureExtractor(),
+                               'transformer_fmri', None)
+    if transformer_fmri is None or not hasattr(transformer_fmri, 'steps'):
+        raise ValueError('The feature extractor of {} has no transformer_fmri '
+                         'pipeline loading the covariances.'
+                         .format(module_path))
+    fmri_filenames = np.concatenate([X_train['fmri_' + atlas].values,
+                                     X_test['fmri_' + atlas].values])
+    covariances = transformer_fmri.steps[0][1].fit_transform(fmri_filenames)
+    _STATE.update(feature_extractor=feature_extractor, classifier=classifier,
+                  X_train=X_train, y_train=y_train, X_test=X_test,
+                  covariances=covariances,
+                  rows={filename: row
+                        for row, filename in enumerate(fmri_filenames)})
+
+
+def _init_worker(ramp_kit_dir, ramp_data_dir, module_path, atlas):
+    # the state is inherited when the worker is forked but needs to be loaded
+    # again with the 'spawn' start method
+    if not _STATE:
+        _load_state(ramp_kit_dir, ramp_data_dir, module_path, atlas)
+
+
+def _select_covariances(fmri_filenames, regions):
+    """Slice the regions out of the loaded covariances of the subjects."""
+    rows = [_STATE['rows'][filename] for filename in fmri_filenames]
+    return _STATE['covariances'][np.ix_(rows, regions, regions)]
+
+
+def _run_blasting(regions):
+    """Train and test the submission on the given regions only."""
+    X_train, y_train = _STATE['X_train'], _STATE['y_train']
+    fe = _STATE['feature_extractor'].FeatureExtractor()
+    # replace the loading of the covariances by their slicing
+    step_name = fe.transformer_fmri.steps[0][0]
+    fe.transformer_fmri.set_params(**{step_name: FunctionTransformer(
+        func=_select_covariances, validate=False,
+        kw_args={'regions': regions})})
+    fe.fit(X_train, y_train)
+    clf = _STATE['classifier'].Classifier()
+    clf.fit(fe.transform(X_train), y_train)
+    return clf.predict_proba(fe.transform(_STATE['X_test']))
+
+
+def run_blasting(submission, ranking, percentages=PERCENTAGES, atlas='msdl',
+                 ramp_kit_dir='.', ramp_data_dir='.',
+                 ramp_submission_dir='submissions', n_jobs=None):
+    """Test a functional submission after removing its most important regions.
+
+    Parameters
+    ----------
+    submission : string
+        The name of the functional submission in ``ramp_submission_dir``.
+
+    ranking : array-like of int, shape (n_regions,)
+        The indices of the regions of the atlas, from the most to the least
+        important.
+
+    percentages : list of int, default=PERCENTAGES
+        The percentages of the most important regions removed.
+
+    atlas : string, default='msdl'
+        The atlas used by the submission.
+
+    ramp_kit_dir : string, default='.'
+        The directory containing ``problem.py``.
+
+    ramp_data_dir : string, default='.'
+        The directory containing the ``data`` folder.
+
+    ramp_submission_dir : string, default='submissions'
+        The directory containing the submissions.
+
+    n_jobs : int or None, default=None
+        The number of trainings run in parallel. By default, one process is
+        started per percentage, including the one without removed regions.
+
+    Returns
+    -------
+    y_pred_test : list of ndarray, shape (n_test_subjects, 2)
+        The predictions on the test set with all the regions followed by the
+        predictions of each percentage.
+
+    """
+    module_path = os.path.join(ramp_submission_dir, submission)
+    _load_state(ramp_kit_dir, ramp_data_dir, module_path, atlas)
+    n_regions = _STATE['covariances'].shape[-1]
+    ranking = np.asarray(ranking, dtype=int)
+    if not np.array_equal(np.sort(ranking), np.arange(n_regions)):
+        raise ValueError('The ranking should contain each of the {} regions '
+                         'of the atlas {} once.'.format(n_regions, atlas))
+    # keep the remaining regions in the order of the atlas
+    regions = [np.arange(n_regions)] + [
+        np.sort(ranking[int(round(n_regions * percentage / 100.)):])
+        for percentage in percentages]
+
+    start_methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        'fork' if 'fork' in start_methods else None)
+    with ProcessPoolExecutor(
+            max_workers=n_jobs or len(regions), mp_context=context,
+            initializer=_init_worker,
+            initargs=(ramp_kit_dir, ramp_data_dir, module_path,
+                      atlas)) as executor:
+        y_pred_test = list(executor.map(_run_blasting, regions))
+
+    training_output_paths = [
+        os.path.join(path, 'training_output')
+        for path in (module_path, module_path + '_blast')]
+    for training_output_path in training_output_paths:
+        if not os.path.exists(training_output_path):
+            os.makedirs(training_output_path)
+    np.save(os.path.join(training_output_paths[0], 'y_pred_test.npy'),
+            y_pred_test[0])
+    joblib.dump(y_pred_test[1:], os.path.join(training_output_paths[1],
+                                              'y_pred_test.joblib'))
+    return y_pred_test
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test a functional submission after removing the most '
+        'important regions of its atlas.')
+    parser.add_argument('--submission', default='starting_kit_functional',
+                        help='Name of the submission folder.')
+    parser.add_argument('--ranking', required=True,
+                        help='Text file with the index of a region per line, '
+                        'from the most to the least important.')
+    parser.add_argument('--percentages', nargs='+', type=int,
+                        default=PERCENTAGES,
+                        help='Percentages of the regions removed.')
+    parser.add_argument('--atlas', default='msdl',
+                        help='Atlas used by the submission.')
+    parser.add_argument('--n-jobs', type=int, default=None,
+                        help='Number of trainings run in parallel. By '
+                        'default, one process is started per percentage.')
+    args = parser.parse_args()
+
+    problem = rw.utils.import_module_from_source('problem.py', 'problem')
+    _, y_test = problem.get_test_data()
+    y_pred_test = run_blasting(args.submission,
+                               np.loadtxt(args.ranking, dtype=int),
+                               percentages=args.percentages, atlas=args.atlas,
+                               n_jobs=args.n_jobs)
+    scores = [problem.score_types[0].score_function(
+        problem.Predictions(y_true=y_test), problem.Predictions(y_pred=y_pred))
+        for y_pred in y_pred_test]
+    for percentage, score in zip([0] + args.percentages, scores):
+        print('{}% of the regions removed: {} = {:.3f}'.format(
+            percentage, problem.score_types[0].name, score))
@@ -0,0 +1,228 @@
+# coding: utf-8
+
+"""Evaluate a submission on the cross-validation folds in parallel.
+
+``ramp_test_submission`` trains the submission on the folds of
+``problem.get_cv`` one after the other. This script trains the folds in a
+pool of processes instead. The data are loaded once in the parent process and
+inherited by the workers when processes are forked, such that only the fold
+indices and the predictions are exchanged between processes. The time-series
+packed with ``fmri_store.py`` are memory-mapped and therefore shared between
+the workers through the page cache.
+
+The per-fold scores are written in
+``<submission>/training_output/fold_scores.csv`` and the bagged predictions
+in ``<submission>/training_output/y_pred__bagged_valid.csv`` and
+``<submission>/training_output/y_pred__bagged_test.csv``, the layout read by
+``scripts_figures/utils.py``. With ``--save-y-preds``, the predictions of
+each fold are also saved in ``<submission>/training_output/fold_<i>`` as
+``ramp_test_submission --save-y-preds`` does, such that the submissions can
+be blended with ``ramp_blend_submissions``.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import rampwf as rw
+
+# state shared with the workers, see _init_worker
+_STATE = {}
+
+
+def _load_state(ramp_kit_dir, ramp_data_dir, module_path,
+                save_y_preds=False):
+    problem = rw.utils.import_module_from_source(
+        os.path.join(ramp_kit_dir, 'problem.py'), 'problem')
+    X_train, y_train = problem.get_train_data(path=ramp_data_dir)
+    X_test, y_test = problem.get_test_data(path=ramp_data_dir)
+    _STATE.update(problem=problem, module_path=module_path,
+                  ramp_data_dir=ramp_data_dir, save_y_preds=save_y_preds,
+                  X_train=X_train, y_train=y_train,
+                  X_test=X_test, y_test=y_test)
+
+
+def _init_worker(ramp_kit_dir, ramp_data_dir, module_path, save_y_preds,
+                 max_memory):
+    if max_memory is not None:
+        import resource
+        max_bytes = int(max_memory * 1024 ** 3)
+        resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+    # the state is inherited when the worker is forked but needs to be loaded
+    # again with the 'spawn' start method
+    if not _STATE:
+        _load_state(ramp_kit_dir, ramp_data_dir, module_path, save_y_preds)
+
+
+def _score(y_true, y_proba):
+    problem = _STATE['problem']
+    ground_truths = problem.Predictions(y_true=y_true)
+    predictions = problem.Predictions(y_pred=y_proba)
+    return {score_type.name: score_type.score_function(ground_truths,
+                                                       predictions)
+            for score_type in problem.score_types}
+
+
+def _run_fold(fold_i, train_is, valid_is):
+    problem = _STATE['problem']
+    X_train, y_train = _STATE['X_train'], _STATE['y_train']
+    X_test, y_test = _STATE['X_test'], _STATE['y_test']
+    # fold of the events written when AUTISM_TRACE is set, see tracing.py
+    os.environ['AUTISM_TRACE_FOLD'] = str(fold_i)
+
+    trained_workflow = problem.workflow.train_submission(
+        _STATE['module_path'], X_train, y_train, train_is=train_is)
+    y_pred_train = problem.workflow.test_submission(trained_workflow,
+                                                    X_train)
+    y_pred_test = problem.workflow.test_submission(trained_workflow, X_test)
+    if _STATE['save_y_preds']:
+        fold_output_path = os.path.join(_STATE['module_path'],
+                                        'training_output',
+                                        'fold_{}'.format(fold_i))
+        if not os.path.exists(fold_output_path):
+            os.makedirs(fold_output_path)
+        for suffix, y_pred in (('train', y_pred_train),
+                               ('test', y_pred_test)):
+            rw.utils.io.save_y_pred(problem, y_pred,
+                                    data_path=_STATE['ramp_data_dir'],
+                                    output_path=fold_output_path,
+                                    suffix=suffix)
+
+    scores = []
+    for step, y_true, y_pred in (
+            ('train', y_train[train_is], y_pred_train[train_is]),
+            ('valid', y_train[valid_is], y_pred_train[valid_is]),
+            ('test', y_test, y_pred_test)):
+        scores.append(dict(fold=fold_i, step=step,
+                           **_score(y_true, y_pred)))
+    return scores, y_pred_train[valid_is], y_pred_test
+
+
+def run_cv(submission, ramp_kit_dir='.', ramp_data_dir='.',
+           ramp_submission_dir='submissions', n_jobs=None, max_memory=None,
+           save_y_preds=False):
+    """Train and evaluate a submission on the cross-validation folds.
+
+    Parameters
+    ----------
+    submission : string
+        The name of the submission folder in ``ramp_submission_dir``.
+
+    ramp_kit_dir : string, default='.'
+        The directory containing ``problem.py``.
+
+    ramp_data_dir : string, default='.'
+        The directory containing the ``data`` folder.
+
+    ramp_submission_dir : string, default='submissions'
+        The directory containing the submissions.
+
+    n_jobs : int or None, default=None
+        The number of folds trained in parallel. By default, one process is
+        started per fold. With 1, the folds are trained one after the other
+        in the current process, e.g. when it is already a worker of a pool.
+
+    max_memory : float or None, default=None
+        The maximum size of the address space of each worker, in GB. A fold
+        exceeding it fails with a MemoryError instead of exhausting the
+        memory of the machine. Not applied when the folds are trained in the
+        current process.
+
+    save_y_preds : bool, default=False
+        Whether to save the predictions of each fold in
+        ``<submission>/training_output/fold_<i>``.
+
+    Returns
+    -------
+    fold_scores : DataFrame
+        The scores of each fold on the train, valid and test steps.
+
+    """
+    module_path = os.path.join(ramp_submission_dir, submission)
+    _load_state(ramp_kit_dir, ramp_data_dir, module_path, save_y_preds)
+    problem = _STATE['problem']
+    y_train, y_test = _STATE['y_train'], _STATE['y_test']
+    cv = list(problem.get_cv(_STATE['X_train'], y_train))
+
+    if n_jobs == 1:
+        results = [_run_fold(fold_i, train_is, valid_is)
+                   for fold_i, (train_is, valid_is) in enumerate(cv)]
+    else:
+        # fork when possible to share the data already loaded with the
+        # workers
+        start_methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            'fork' if 'fork' in start_methods else None)
+        with ProcessPoolExecutor(
+                max_workers=n_jobs or len(cv), mp_context=context,
+                initializer=_init_worker,
+                initargs=(ramp_kit_dir, ramp_data_dir, module_path,
+                          save_y_preds, max_memory)) as executor:
+            futures = [executor.submit(_run_fold, fold_i, train_is,
+                                       valid_is)
+                       for fold_i, (train_is, valid_is) in enumerate(cv)]
+            results = [future.result() for future in futures]
+
+    # bag the predictions: the validation predictions are averaged over the
+    # folds in which a subject was validated, NaN if never validated
+    n_classes = len(problem.Predictions.label_names)
+    y_pred_valid = np.zeros((y_train.size, n_classes))
+    n_valid = np.zeros(y_train.size)
+    y_pred_test = np.zeros((y_test.size, n_classes))
+    fold_scores = []
+    for (_, valid_is), (scores, y_pred_fold_valid, y_pred_fold_test) in zip(
+            cv, results):
+        fold_scores += scores
+        y_pred_valid[valid_is] += y_pred_fold_valid
+        n_valid[valid_is] += 1
+        y_pred_test += y_pred_fold_test
+    with np.errstate(invalid='ignore'):
+        y_pred_valid /= n_valid[:, np.newaxis]
+    y_pred_test /= len(cv)
+
+    training_output_path = os.path.join(module_path, 'training_output')
+    if not os.path.exists(training_output_path):
+        os.makedirs(training_output_path)
+    for step, y_pred in (('valid', y_pred_valid), ('test', y_pred_test)):
+        problem.save_submission(y_pred, ramp_data_dir, training_output_path,
+                                '_bagged_{}'.format(step))
+    fold_scores = pd.DataFrame(fold_scores).set_index(['fold', 'step'])
+    fold_scores.to_csv(os.path.join(training_output_path,
+                                    'fold_scores.csv'))
+    return fold_scores
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Train and evaluate a submission on the '
+        'cross-validation folds in parallel.')
+    parser.add_argument('--submission', default='starting_kit_functional',
+                        help='Name of the submission folder.')
+    parser.add_argument('--ramp-kit-dir', default='.',
+                        help='Directory containing problem.py.')
+    parser.add_argument('--ramp-data-dir', default='.',
+                        help='Directory containing the data folder.')
+    parser.add_argument('--ramp-submission-dir', default='submissions',
+                        help='Directory containing the submissions.')
+    parser.add_argument('--n-jobs', type=int, default=None,
+                        help='Number of folds trained in parallel. By '
+                        'default, one process is started per fold.')
+    parser.add_argument('--max-memory', type=float, default=None,
+                        help='Maximum memory of each worker, in GB.')
+    parser.add_argument('--save-y-preds', action='store_true',
+                        help='Save the predictions of each fold.')
+    args = parser.parse_args()
+
+    fold_scores = run_cv(args.submission, ramp_kit_dir=args.ramp_kit_dir,
+                         ramp_data_dir=args.ramp_data_dir,
+                         ramp_submission_dir=args.ramp_submission_dir,
+                         n_jobs=args.n_jobs, max_memory=args.max_memory,
+                         save_y_preds=args.save_y_preds)
+    print(fold_scores.to_string())
+    print(fold_scores.groupby(level='step').agg(['mean', 'std']).to_string())
@@ -0,0 +1,320 @@
+# coding: utf-8
+
+"""Run the learning curve experiment read by ``figure_2_performance.py``.
+
+For each number of training subjects and each iteration, the subjects of
+``data/train.csv`` and ``data/test.csv`` are shuffled and split into a
+training set of this size and a test set of ``test_size`` subjects, written
+in ``learning_curve/it_<n_subjects>_<iteration>/data``. The submissions are
+trained on the cross-validation folds of this training set with
+``run_cv.run_cv`` and blended with ``ramp_blend_submissions``, which writes
+``learning_curve/it_<n_subjects>_<iteration>/submissions/training_output/
+y_pred_foldwise_best_bagged_{valid,test}.csv``.
+
+The iterations are run in a pool of processes and those already blended are
+skipped, such that an interrupted experiment can be resumed. The time-series
+are read through a link to ``data/fmri``, such that the covariances cached by
+the functional submissions are shared by all the iterations.
+
+The experiment can be stopped early once the parameters of the curve fitted
+in ``figure_2_performance.py`` change by less than a relative tolerance
+between consecutive iterations::
+
+    python run_learning_curve.py --n-jobs 8 --tol 0.01
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                wait)
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+import rampwf as rw
+from scipy.optimize import curve_fit
+from sklearn.metrics import roc_auc_score
+
+from run_cv import run_cv
+
+SUBMISSIONS = ['{}_original'.format(team) for team in (
+    'abethe', 'amicie', 'ayoub.ghriss', 'lbg', 'mk', 'nguigui', 'pearrr',
+    'Slasnista', 'vzantedeschi', 'wwwwmmmm')]
+# the training sizes and the test size fit in the 1150 subjects of the kit
+N_SUBJECTS = list(range(300, 901, 150))
+TEST_SIZE = 250
+
+_METADATA_FILENAMES = ('participants.csv', 'anatomy.csv', 'anatomy_qc.csv',
+                       'fmri_filename.csv', 'fmri_qc.csv',
+                       'fmri_repetition_time.csv')
+_ENGINE_FILENAMES = ('connectome.py', 'fmri_store.py')
+_BLENDED_FILENAME = 'y_pred_foldwise_best_bagged_{}.csv'
+
+
+def fit_func(x, a, b):
+    """Learning curve fitted in ``figure_2_performance.py``."""
+    return 0.5 + a * (1 - np.exp(-b * np.sqrt(x)))
+
+
+def _iteration_dir(output_dir, n_subjects, iteration):
+    return os.path.join(output_dir, 'it_{}_{}'.format(n_subjects, iteration))
+
+
+def _load_subject_id(ramp_kit_dir, ramp_data_dir):
+    """Subjects of the training and the test sets, subsampled together."""
+    problem = rw.utils.import_module_from_source(
+        os.path.join(ramp_kit_dir, 'problem.py'), 'problem')
+    return np.concatenate([
+        problem.get_train_data(path=ramp_data_dir)[0].index.values,
+        problem.get_test_data(path=ramp_data_dir)[0].index.values])
+
+
+def _check_split(n_subjects, test_size, n_available):
+    if n_subjects + test_size > n_available:
+        raise ValueError(
+            'Cannot draw {} training and {} test subjects out of the {} '
+            'subjects of the data: reduce n_subjects or test_size.'
+            .format(n_subjects, test_size, n_available))
+
+
+def _prepare_iteration(it_dir, ramp_kit_dir, ramp_data_dir,
+                       ramp_submission_dir, submissions, subject_id,
+                       n_subjects, test_size, random_state):
+    """Write the data and the submissions of an iteration."""
+    _check_split(n_subjects, test_size, len(subject_id))
+    data_dir = os.path.join(ramp_data_dir, 'data')
+    it_data_dir = os.path.join(it_dir, 'data')
+    if not os.path.exists(it_data_dir):
+        os.makedirs(it_data_dir)
+    for filename in _METADATA_FILENAMES:
+        shutil.copy(os.path.join(data_dir, filename), it_data_dir)
+    shuffled = random_state.permutation(subject_id)
+    for filename, subjects in (
+            ('train.csv', shuffled[:n_subjects]),
+            ('test.csv', shuffled[n_subjects:n_subjects + test_size])):
+        pd.Series(subjects).to_csv(os.path.join(it_data_dir, filename),
+                                   header=False, index=False)
+    fmri_link = os.path.join(it_data_dir, 'fmri')
+    if not os.path.lexists(fmri_link):
+        os.symlink(os.path.relpath(os.path.abspath(os.path.join(
+            data_dir, 'fmri')), os.path.abspath(it_data_dir)), fmri_link)
+
+    # the functional submissions load the connectome engine from the root of
+    # the kit, two levels above their folder
+    for filename in _ENGINE_FILENAMES:
+        if os.path.exists(os.path.join(ramp_kit_dir, filename)):
+            shutil.copy(os.path.join(ramp_kit_dir, filename), it_dir)
+    for submission in submissions:
+        submission_dir = os.path.join(it_dir, 'submissions', submission)
+        if not os.path.exists(submission_dir):
+            os.makedirs(submission_dir)
+        for filename in ('feature_extractor.py', 'classifier.py'):
+            shutil.copy(os.path.join(ramp_submission_dir, submission,
+                                     filename), submission_dir)
+
+
+def _run_iteration(n_subjects, iteration, output_dir, ramp_kit_dir,
+                   ramp_data_dir, ramp_submission_dir, submissions,
+                   test_size, random_state):
+    """Run an iteration if not done yet and return its test ROC-AUC."""
+    it_dir = _iteration_dir(output_dir, n_subjects, iteration)
+    it_submission_dir = os.path.join(it_dir, 'submissions')
+    training_output_path = os.path.join(it_submission_dir, 'training_output')
+    problem = rw.utils.import_module_from_source(
+        os.path.join(ramp_kit_dir, 'problem.py'), 'problem')
+
+    if not os.path.exists(os.path.join(training_output_path,
+                                       _BLENDED_FILENAME.format('test'))):
+        subject_id = _load_subject_id(ramp_kit_dir, ramp_data_dir)
+        # seed each iteration such that it does not depend on the schedule
+        _prepare_iteration(
+            it_dir, ramp_kit_dir, ramp_data_dir, ramp_submission_dir,
+            submissions, subject_id, n_subjects, test_size,
+            np.random.RandomState([random_state, n_subjects, iteration]))
+        with open(os.path.join(it_dir, 'log.txt'), 'w') as log, \
+                redirect_stdout(log):
+            for submission in submissions:
+                run_cv(submission, ramp_kit_dir=ramp_kit_dir,
+                       ramp_data_dir=it_dir,
+                       ramp_submission_dir=it_submission_dir, n_jobs=1,
+                       save_y_preds=True)
+            rw.utils.testing.blend_submissions(
+                submissions, ramp_kit_dir=ramp_kit_dir, ramp_data_dir=it_dir,
+                ramp_submission_dir=it_submission_dir, save_output=True)
+
+    _, y_true_test = problem.get_test_data(path=it_dir)
+    y_pred_test = np.loadtxt(os.path.join(training_output_path,
+                                          _BLENDED_FILENAME.format('test')))
+    return roc_auc_score(y_true_test, y_pred_test[:, 1])
+
+
+def _fit_learning_curve(scores):
+    """Fit the learning curve as in ``figure_2_performance.py``."""
+    scores = pd.Series(scores)
+    grouped = scores.groupby(level=0)
+    mean_lr = grouped.mean()
+    sigma_lr = grouped.std() / np.sqrt(grouped.size())
+    popt, _ = curve_fit(fit_func, mean_lr.index.values, mean_lr.values,
+                        p0=[1, 1 / mean_lr.index.max()], sigma=sigma_lr,
+                        absolute_sigma=True, bounds=(0, [1, np.inf]))
+    return popt
+
+
+def run_learning_curve(submissions=SUBMISSIONS, n_subjects=N_SUBJECTS,
+                       n_iterations=100, test_size=TEST_SIZE,
+                       output_dir=None,
+                       ramp_kit_dir='.', ramp_data_dir='.',
+                       ramp_submission_dir='submissions', n_jobs=1,
+                       tol=None, min_iterations=5, patience=3,
+                       random_state=0):
+    """Run the learning curve experiment.
+
+    Parameters
+    ----------
+    submissions : list of string, default=SUBMISSIONS
+        The names of the submissions blended at each iteration.
+
+    n_subjects : list of int, default=N_SUBJECTS
+        The numbers of training subjects.
+
+    n_iterations : int, default=100
+        The maximum number of iterations for each number of subjects.
+
+    test_size : int, default=TEST_SIZE
+        The number of test subjects of each iteration. Added to each number
+        of training subjects, it should not exceed the number of subjects of
+        the data.
+
+    output_dir : string or None, default=None
+        The directory of the iterations, ``<ramp_kit_dir>/learning_curve`` by
+        default, where ``scripts_figures/utils.py`` reads them.
+
+    ramp_kit_dir : string, default='.'
+        The directory containing ``problem.py``.
+
+    ramp_data_dir : string, default='.'
+        The directory containing the ``data`` folder to subsample.
+
+    ramp_submission_dir : string, default='submissions'
+        The directory containing the submissions.
+
+    n_jobs : int, default=1
+        The number of iterations run in parallel.
+
+    tol : float or None, default=None
+        If given, no iteration is started once the parameters of the fitted
+        learning curve change by less than this relative tolerance for
+        ``patience`` consecutive iterations.
+
+    min_iterations : int, default=5
+        The number of iterations before the curve is fitted.
+
+    patience : int, default=3
+        The number of consecutive iterations with converged parameters to
+        stop.
+
+    random_state : int, default=0
+        The seed of the splits.
+
+    Returns
+    -------
+    scores : DataFrame
+        The test ROC-AUC of each iteration run.
+
+    """
+    if output_dir is None:
+        output_dir = os.path.join(ramp_kit_dir, 'learning_curve')
+    # fail before starting any iteration
+    _check_split(max(n_subjects), test_size,
+                 len(_load_subject_id(ramp_kit_dir, ramp_data_dir)))
+    # schedule all the numbers of subjects of an iteration before the next
+    # one such that the curve can be fitted on complete iterations
+    runs = [(n, iteration) for iteration in range(1, n_iterations + 1)
+            for n in n_subjects]
+    scores = {}
+    n_complete, n_converged, previous_popt = 0, 0, None
+
+    context = multiprocessing.get_context(
+        'fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    with ProcessPoolExecutor(max_workers=n_jobs,
+                             mp_context=context) as executor:
+        pending = {}
+        while runs or pending:
+            while runs and len(pending) < n_jobs:
+                n, iteration = runs.pop(0)
+                future = executor.submit(
+                    _run_iteration, n, iteration, output_dir, ramp_kit_dir,
+                    ramp_data_dir, ramp_submission_dir, submissions,
+                    test_size, random_state)
+                pending[future] = (n, iteration)
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                scores[pending.pop(future)] = future.result()
+
+            # fit the curve on each newly completed iteration
+            while all((n, n_complete + 1) in scores for n in n_subjects):
+                n_complete += 1
+                if tol is None or n_complete < min_iterations:
+                    continue
+                popt = _fit_learning_curve(
+                    {key: score for key, score in scores.items()
+                     if key[1] <= n_complete})
+                if previous_popt is not None and np.all(
+                        np.abs(popt - previous_popt) <=
+                        tol * np.abs(previous_popt)):
+                    n_converged += 1
+                else:
+                    n_converged = 0
+                previous_popt = popt
+                print('Iteration {}: a={:.3f}, b={:.4f}'.format(
+                    n_complete, *popt))
+                if n_converged >= patience and runs:
+                    print('The learning curve converged after {} '
+                          'iterations.'.format(n_complete))
+                    runs = []
+
+    scores = pd.Series(scores, name='ROC-AUC test')
+    scores.index.names = ['# subjects', 'iteration']
+    return scores.sort_index().reset_index()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run the learning curve experiment of the figure 2.')
+    parser.add_argument('--submissions', nargs='+', default=SUBMISSIONS,
+                        help='Submissions blended at each iteration.')
+    parser.add_argument('--n-subjects', nargs='+', type=int,
+                        default=N_SUBJECTS,
+                        help='Numbers of training subjects.')
+    parser.add_argument('--n-iterations', type=int, default=100,
+                        help='Maximum number of iterations per number of '
+                        'subjects.')
+    parser.add_argument('--test-size', type=int, default=TEST_SIZE,
+                        help='Number of test subjects of each iteration.')
+    parser.add_argument('--output-dir', default=None,
+                        help='Directory of the iterations, learning_curve by '
+                        'default.')
+    parser.add_argument('--n-jobs', type=int, default=1,
+                        help='Number of iterations run in parallel.')
+    parser.add_argument('--tol', type=float, default=None,
+                        help='Relative tolerance on the parameters of the '
+                        'fitted curve to stop early.')
+    parser.add_argument('--patience', type=int, default=3,
+                        help='Number of consecutive converged iterations to '
+                        'stop early.')
+    parser.add_argument('--random-state', type=int, default=0,
+                        help='Seed of the splits.')
+    args = parser.parse_args()
+
+    scores = run_learning_curve(
+        submissions=args.submissions, n_subjects=args.n_subjects,
+        n_iterations=args.n_iterations, test_size=args.test_size,
+        output_dir=args.output_dir, n_jobs=args.n_jobs, tol=args.tol,
+        patience=args.patience, random_state=args.random_state)
+    print(scores.groupby('# subjects')['ROC-AUC test'].agg(
+        ['mean', 'std', 'size']).to_string())
@@ -17,14 +17,15 @@ from scipy.optimize import curve_fit
 from scipy import stats
 from sklearn.metrics import roc_curve
 from sklearn.metrics import auc
-from sklearn.metrics import roc_auc_score
 
-from utils import load_train_test_prediction
-from utils import load_train_test_prediction_aims
 from utils import load_train_test_blended_prediction
 from utils import load_train_test_blended_prediction_lc
 from utils import compute_roc_auc_score
+from utils import load_predictions
+from utils import load_score_matrices
+from roc import roc_auc_scores
 from problem import get_test_data
+from run_learning_curve import N_SUBJECTS
 
 
 with sns.plotting_context("poster"):
@@ -56,38 +57,18 @@ with sns.plotting_context("poster"):
         tn + "_" + mt for tn, mt in product(team_name, [group])
     ]
 
-    y_true_train, y_pred_train, y_true_test, y_pred_test = zip(
-        *[load_train_test_prediction(sub) for sub in all_submissions]
-    )
-    df = pd.DataFrame(
-        {
-            "y_true_train": y_true_train,
-            "y_pred_train": y_pred_train,
-            "y_true_test": y_true_test,
-            "y_pred_test": y_pred_test,
-        },
-        index=all_submissions,
-    )
-    df.index = df.index.str.split("_", n=1, expand=True)
-    df = df.reset_index()
-    df = df.rename(columns={"level_0": "team", "level_1": "modality"})
-    df["modality"] = df["modality"].str.replace("_", " + ")
-    df = df[df["modality"] == "original"]
+    _, _, y_true_test, y_score_test = load_score_matrices(
+        [os.path.join('../submissions', sub, 'training_output')
+         for sub in all_submissions], '..')
 
     plt.figure(figsize=(10, 10))
 
-    tprs = []
-    aucs = []
+    # the tpr interpolated on a linear fpr space
     mean_fpr = np.linspace(0, 1, 100)
+    aucs, tprs = roc_auc_scores(y_true_test, y_score_test, fpr=mean_fpr)
 
-    for _, r in df.iterrows():
-        fpr, tpr, _ = roc_curve(
-            r["y_true_test"], r["y_pred_test"][:, 1]
-        )
-        # interpolate the tpr on a linear fpr space
-        tprs.append(np.interp(mean_fpr, fpr, tpr))
-        roc_auc = auc(fpr, tpr)
-        aucs.append(roc_auc)
+    for y_score in y_score_test:
+        fpr, tpr, _ = roc_curve(y_true_test, y_score)
         # plot the roc for each submission
         plt.plot(fpr, tpr, ":", alpha=0.5, lw=1.5, color="tab:blue")
 
@@ -177,12 +158,12 @@ with sns.plotting_context("poster"):
     ]
 
     # compute the ROC-AUC for training and testing and create a dataframe
-    roc_auc_train, roc_auc_test = zip(
-        *[
-            compute_roc_auc_score(*load_train_test_prediction(sub))
-            for sub in all_submissions
-        ]
-    )
+    y_true_train, y_score_train, y_true_test, y_score_test = (
+        load_score_matrices(
+            [os.path.join('../submissions', sub, 'training_output')
+             for sub in all_submissions], '..'))
+    roc_auc_train = roc_auc_scores(y_true_train, y_score_train)
+    roc_auc_test = roc_auc_scores(y_true_test, y_score_test)
     df_roc_auc = pd.DataFrame(
         {"ROC AUC train": roc_auc_train, "ROC AUC test": roc_auc_test},
         index=all_submissions,
@@ -238,81 +219,38 @@ with sns.plotting_context("poster"):
         tn + "_" + mt for tn, mt in product(team_name, modality_type)
     ]
 
-    # Performance on private dataset
-    y_true_train, y_pred_train, y_true_test, y_pred_test = zip(
-        *[load_train_test_prediction(sub) for sub in all_submissions]
-    )
-    df = pd.DataFrame(
-        {
-            "y_true_train": y_true_train,
-            "y_pred_train": y_pred_train,
-            "y_true_test": y_true_test,
-            "y_pred_test": y_pred_test,
-        },
-        index=all_submissions,
-    )
-    df.index = df.index.str.split("_", n=1, expand=True)
-    df = df.reset_index()
-    df = df.rename(columns={"level_0": "team", "level_1": "modality"})
-    df["modality"] = df["modality"].str.replace("_", " + ")
-
-    # Performance on EU-Aims dataset
-    y_true_train, y_pred_train, y_true_test, y_pred_test = zip(*[load_train_test_prediction_aims(sub)
-                                                                 for sub in all_submissions])
-
-    df_aims = pd.DataFrame({'y_true_train': y_true_train, 'y_pred_train': y_pred_train,
-                       'y_true_test': y_true_test, 'y_pred_test': y_pred_test},
-                      index=all_submissions)
-
-    df_aims.index = df_aims.index.str.split('_', n=1, expand=True)
-    df_aims = df_aims.reset_index()
-    df_aims = df_aims.rename(columns={"level_0": "team", "level_1": "modality"})
-    df_aims["modality"] = df_aims["modality"].str.replace("_", " + ")
-
-
-    df_combin = df.merge(df_aims, on=['team', 'modality'], suffixes=('_ramp', '_aims'))
-    df_combin.head()
-    
     # Compute the performance only for RDB vs the others
     # Find the index corresponding to RDB
     # rdb_idx = np.load("rdb_idx.npy")
     X_test, y_test = get_test_data("..")
-    X_rdb_idx = X_test['participants_site']==24
-    rdb_idx = X_test.index.values[X_rdb_idx]
-
-    auc_ramp = []
-    auc_aims = []
-    auc_rdb = []
-    auc_other = []
-    for idx, serie in df_combin.iterrows():
-        y_true_ramp = serie['y_true_test_ramp']
-        y_pred_ramp = serie['y_pred_test_ramp']
-        roc_auc_ramp = roc_auc_score(y_true_ramp, y_pred_ramp[:, 1])
-        auc_ramp.append(roc_auc_ramp)
-
-        y_true_aims = serie['y_true_test_aims']
-        y_pred_aims = serie['y_pred_test_aims']
-        roc_auc_aims = roc_auc_score(y_true_aims, y_pred_aims[:, 1])
-        auc_aims.append(roc_auc_aims)
-        
-        y_true_rdb = serie['y_true_test_ramp'][X_rdb_idx]
-        y_pred_rdb = serie['y_pred_test_ramp'][X_rdb_idx]
-        roc_auc_rdb = roc_auc_score(y_true_rdb, y_pred_rdb[:, 1])
-        auc_rdb.append(roc_auc_rdb)
-
-        y_true_other = serie['y_true_test_ramp'][~X_rdb_idx]
-        y_pred_other = serie['y_pred_test_ramp'][~X_rdb_idx]
-        roc_auc_other = roc_auc_score(y_true_other, y_pred_other[:, 1])
-        auc_other.append(roc_auc_other)
-
-    df_combin['roc_auc_ramp'] = auc_ramp
-    df_combin['roc_auc_aims'] = auc_aims
-    df_combin['roc_auc_rdb'] = auc_rdb
-    df_combin['roc_auc_other'] = auc_other
+    X_rdb_idx = (X_test['participants_site'] == 24).values
+
+    # Performance on private dataset, on all the subjects, the ABIDE
+    # subjects and the RDB subjects
+    _, _, y_true_test, y_score_test = load_score_matrices(
+        [os.path.join('../submissions', sub, 'training_output')
+         for sub in all_submissions], '..')
+    auc_ramp, auc_other, auc_rdb = roc_auc_scores(
+        y_true_test, y_score_test,
+        masks=[np.ones_like(X_rdb_idx), ~X_rdb_idx, X_rdb_idx])
+
+    # Performance on EU-Aims dataset
+    _, _, y_true_test_aims, y_score_test_aims = load_score_matrices(
+        [os.path.join('../..', 'eu-aims', 'submissions', sub,
+                      'training_output') for sub in all_submissions],
+        '../../eu-aims')
+    auc_aims = roc_auc_scores(y_true_test_aims, y_score_test_aims)
 
     # Add new column to the dataframe with the AUC
     auc_dict = {'roc_auc_ramp': 'ABIDE+RDB', 'roc_auc_other': 'ABIDE', 'roc_auc_rdb': 'RDB', 'roc_auc_aims': 'EU-Aims'}
-    df_auc = df_combin[['team', 'modality', *auc_dict]]
+    df_auc = pd.DataFrame(
+        {'roc_auc_ramp': auc_ramp, 'roc_auc_other': auc_other,
+         'roc_auc_rdb': auc_rdb, 'roc_auc_aims': auc_aims},
+        index=pd.Index(all_submissions).str.split('_', n=1, expand=True))
+    df_auc = df_auc.reset_index()
+    df_auc = df_auc.rename(columns={"level_0": "team", "level_1": "modality"})
+    df_auc["modality"] = df_auc["modality"].str.replace("_", " + ")
+    df_auc = df_auc[['team', 'modality', *auc_dict]]
     df_auc = df_auc.rename(columns=auc_dict)
 
     fig, ax = plt.subplots(figsize=(8, 4))
@@ -349,16 +287,15 @@ with sns.plotting_context("poster"):
     ]
 
     data_dict = {'# subjects': [], 'iteration': [], 'ROC-AUC train': [], 'ROC-AUC test': []}
-    for nsub in range(500, 1501, 250):
-        for it in range(1,101):
-            data = load_train_test_blended_prediction_lc(nsub, it)
-            if data[0] is None:
-                continue
-            data_dict['# subjects'].append(nsub)
-            data_dict['iteration'].append(it)
-            auc_train, auc_test = compute_roc_auc_score(*data)
-            data_dict['ROC-AUC train'].append(auc_train)
-            data_dict['ROC-AUC test'].append(auc_test)
+    lc_args = list(product(N_SUBJECTS, range(1, 101)))
+    for (nsub, it), data in zip(lc_args, load_predictions(load_train_test_blended_prediction_lc, lc_args)):
+        if data[0] is None:
+            continue
+        data_dict['# subjects'].append(nsub)
+        data_dict['iteration'].append(it)
+        auc_train, auc_test = compute_roc_auc_score(*data)
+        data_dict['ROC-AUC train'].append(auc_train)
+        data_dict['ROC-AUC test'].append(auc_test)
 
     df = pd.DataFrame(data_dict)
     df = df.set_index('# subjects')
@@ -387,7 +324,7 @@ with sns.plotting_context("poster"):
                      mean_lr + std_lr,
                      alpha=0.2,
                      label=r'$\pm$ 1 std. dev.')
-    x_range = np.arange(500, 2701, 1)
+    x_range = np.arange(N_SUBJECTS[0], 2701, 1)
     fit_values = fit_func(x_range, *popt)
     fit_grad = fit_func_grad(x_range, *popt)
     fit_se = np.sqrt(np.diag(fit_grad.T @ pcov @ fit_grad))
@@ -399,13 +336,13 @@ with sns.plotting_context("poster"):
                      color='red',
                      alpha=0.15,
                      label=r'$\pm$ 1 std. err.')
-    plt.hlines(0.5 + popt[0], xmin=500, xmax=2700, color='red', linewidth=2, linestyle='--', label='asymptotic AUC')
+    plt.hlines(0.5 + popt[0], xmin=N_SUBJECTS[0], xmax=2700, color='red', linewidth=2, linestyle='--', label='asymptotic AUC')
     sns.despine(offset=10)
     plt.ylabel('ROC-AUC')
     plt.xlabel('# subjects in training set')
     plt.ylim([0.72, 0.86])
-    plt.xlim([500, 2700])
-    plt.xticks(np.arange(500, 2001, 500))
+    plt.xlim([N_SUBJECTS[0], 2700])
+    plt.xticks(np.arange(N_SUBJECTS[0], 2701, 600))
     plt.legend(loc='lower right')
     plt.title('Learning curve for different sample sizes')
     plt.savefig('../figures/fig_2e_learning_curve.svg', bbox_inches="tight")
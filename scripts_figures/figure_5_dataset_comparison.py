@@ -23,45 +23,23 @@ import seaborn as sns
 # from utils import load_train_test_prediction_aims
 # from utils import load_train_test_blended_prediction
 # from utils import load_train_test_blended_prediction_lc
-from utils import compute_roc_auc_score
-from problem import get_train_data, get_test_data
-
-def load_train_test_prediction_all(submission_name):
-    path_store_pred = os.path.join('..', 'submissions_all', submission_name, 'training_output')
-    
-    if not os.path.exists(os.path.join(path_store_pred, 'y_pred__bagged_valid.csv')):
-        return (None, None, None, None)
-    
-    y_pred_train = np.loadtxt(os.path.join(path_store_pred, 'y_pred__bagged_valid.csv'))
-    y_pred_test = np.loadtxt(os.path.join(path_store_pred, 'y_pred__bagged_test.csv'))
-    
-    _, y_true_train = get_train_data('..')
-    _, y_true_test = get_test_data('..')
-    
-    # remove y_train values for which we have no prediction because they never went in the test part of the cv
-    y_true_train = y_true_train[~np.isnan(y_pred_train[:,1])]
-    y_pred_train = y_pred_train[~np.isnan(y_pred_train[:,1]), :]
-    
-    return (y_true_train, y_pred_train, y_true_test, y_pred_test)
+from utils import load_score_matrices
+from roc import roc_auc_scores
 
 # with sns.plotting_context("poster"):
-submissions_all = os.listdir('../submissions_all')
+submissions_all = [
+    sub for sub in os.listdir('../submissions_all')
+    if os.path.exists(os.path.join('../submissions_all', sub, 'training_output',
+                                   'y_pred__bagged_valid.csv'))]
 best_submissions = ['abethe', 'amicie', 'ayoub.ghriss', 'lbg', 'mk', 'nguigui', 'pearrr', 'Slasnista', 'vzantedeschi', 'wwwwmmmm']
 
-y_true_train, y_pred_train, y_true_test, y_pred_test = zip(*[load_train_test_prediction_all(sub)
-                                                                 for sub in submissions_all])
-
-df_all = pd.DataFrame({'y_true_train': y_true_train, 'y_pred_train': y_pred_train,
-                       'y_true_test': y_true_test, 'y_pred_test': y_pred_test},
-                                         index=submissions_all)
-df_all.dropna(inplace=True)
-df_all.index = df_all.index.str.split('_', n=1, expand=True)
-
-auc_all = []
-
-for idx, serie in df_all.iterrows():
-    auc_all += [compute_roc_auc_score(*serie)]
-df_all_auc = pd.DataFrame(auc_all, columns=['Public set', 'Private set'], index=df_all.index)
+# score all the submissions at once
+y_true_train, y_score_train, y_true_test, y_score_test = load_score_matrices(
+    [os.path.join('../submissions_all', sub, 'training_output')
+     for sub in submissions_all], '..')
+df_all_auc = pd.DataFrame({'Public set': roc_auc_scores(y_true_train, y_score_train),
+                           'Private set': roc_auc_scores(y_true_test, y_score_test)},
+                          index=pd.Index(submissions_all).str.split('_', n=1, expand=True))
 df_roc_auc = df_all_auc.sort_values('Private set', ascending=False).reset_index().drop_duplicates('level_0').set_index(['level_0', 'level_1'])
 
 df = df_roc_auc.reset_index(1).drop('level_1', axis=1).sort_values(by=['Private set'], ascending=True)
@@ -0,0 +1,315 @@
+"""ROC-AUC and ROC curves of many submissions at once.
+
+The scores of all the submissions are stacked in a matrix of shape
+(n_submissions, n_subjects) sharing the same true labels. Each row is sorted
+once, and the AUC of any number of subsets of the subjects (e.g. the RDB or
+ABIDE subjects of the test set) is computed from rank statistics vectorized
+over the submissions. Missing predictions are given as NaN and ignored, such
+that the bagged validation predictions, which do not cover all the training
+subjects, can be stacked as well.
+
+The bootstrap confidence intervals and the permutation p-values reuse the
+sort of each submission: every resample is a matrix of weights (bootstrap) or
+labels (permutation) on the sorted subjects, such that thousands of resamples
+are scored by batches of cumulative sums without sorting again.
+
+"""
+
+import numpy as np
+from joblib import Parallel, delayed
+
+
+def _as_masks(masks, n_subjects):
+    if masks is None:
+        return np.ones((1, n_subjects), dtype=bool)
+    masks = np.atleast_2d(np.asarray(masks, dtype=bool))
+    if masks.shape[1] != n_subjects:
+        raise ValueError('The masks should have {} subjects. Got {} instead.'
+                         .format(n_subjects, masks.shape[1]))
+    return masks
+
+
+def _tie_groups(sorted_score):
+    """Index of the first and last element of the group of tied scores of
+    each element of the sorted rows."""
+    n_submissions, n_subjects = sorted_score.shape
+    position = np.broadcast_to(np.arange(n_subjects),
+                               sorted_score.shape)
+    # NaN are never equal, such that each missing score is its own group
+    tied = sorted_score[:, 1:] == sorted_score[:, :-1]
+    first = np.ones(sorted_score.shape, dtype=bool)
+    first[:, 1:] = ~tied
+    last = np.ones(sorted_score.shape, dtype=bool)
+    last[:, :-1] = ~tied
+    start = np.maximum.accumulate(np.where(first, position, 0), axis=1)
+    stop = np.minimum.accumulate(
+        np.where(last, position, n_subjects - 1)[:, ::-1], axis=1)[:, ::-1]
+    return start, stop
+
+
+def _mann_whitney(positive, negative, start, stop):
+    """AUC from the weights of the positives and negatives of sorted rows.
+
+    The ties count for one half. ``start`` and ``stop`` are the bounds of the
+    groups of ties, broadcast against the rows.
+    """
+    # weight of the negatives scored strictly lower than each element and
+    # lower or equal, from the cumulative weights at the bounds of its group
+    cum_negative = np.cumsum(negative, axis=1)
+    negative_lower = np.take_along_axis(cum_negative - negative, start,
+                                        axis=1)
+    negative_lower_equal = np.take_along_axis(cum_negative, stop, axis=1)
+    statistic = np.sum(positive * (negative_lower + negative_lower_equal),
+                       axis=1) / 2.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return statistic / (positive.sum(axis=1) * negative.sum(axis=1))
+
+
+def roc_auc_scores(y_true, y_score, masks=None, fpr=None):
+    """Compute the ROC-AUC of several submissions on several subsets.
+
+    Parameters
+    ----------
+    y_true : ndarray, shape (n_subjects, )
+        The true binary labels, shared by all the submissions.
+    y_score : ndarray, shape (n_submissions, n_subjects)
+        The score of the positive class given by each submission. NaN marks
+        the subjects without prediction.
+    masks : ndarray, shape (n_masks, n_subjects) or None, default=None
+        The subsets of the subjects on which the scores are computed. By
+        default, all the subjects are used.
+    fpr : ndarray, shape (n_fpr, ) or None, default=None
+        If given, the ROC curves are also returned, with the true positive
+        rates linearly interpolated at these false positive rates as with
+        ``np.interp(fpr, *roc_curve(y_true, y_score)[:2])``.
+
+    Returns
+    -------
+    auc : ndarray, shape (n_masks, n_submissions) or (n_submissions, )
+        The ROC-AUC of each submission on each subset. The first dimension is
+        dropped if ``masks`` is None. NaN if a subset has a single class.
+    tpr : ndarray, shape (n_masks, n_submissions, n_fpr) or \
+(n_submissions, n_fpr)
+        The interpolated ROC curves, only returned if ``fpr`` is given.
+
+    """
+    y_true = np.asarray(y_true).astype(bool)
+    y_score = np.atleast_2d(np.asarray(y_score, dtype=np.float64))
+    n_submissions, n_subjects = y_score.shape
+    all_masks = _as_masks(masks, n_subjects)
+
+    # a single sort per submission shared by all the subsets
+    order = np.argsort(y_score, axis=1, kind='mergesort')
+    sorted_score = np.take_along_axis(y_score, order, axis=1)
+    sorted_true = y_true[order]
+    start, stop = _tie_groups(sorted_score)
+    predicted = ~np.isnan(sorted_score)
+
+    auc = np.empty((all_masks.shape[0], n_submissions))
+    if fpr is not None:
+        fpr = np.asarray(fpr, dtype=np.float64)
+        tpr = np.empty((all_masks.shape[0], n_submissions, fpr.size))
+    for i, mask in enumerate(all_masks):
+        sorted_mask = mask[order] & predicted
+        positive = sorted_mask & sorted_true
+        negative = sorted_mask & ~sorted_true
+        auc[i] = _mann_whitney(positive, negative, start, stop)
+        if fpr is None:
+            continue
+        n_positive = positive.sum(axis=1)
+        n_negative = negative.sum(axis=1)
+        negative_lower = np.take_along_axis(
+            np.cumsum(negative, axis=1) - negative, start, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cum_positive = np.cumsum(positive, axis=1)
+            positive_lower = np.take_along_axis(cum_positive - positive,
+                                                start, axis=1)
+            # the scores above each threshold, from the highest threshold
+            # (no subject) to the lowest (all the subjects)
+            curve_fpr = np.zeros((n_submissions, n_subjects + 1))
+            curve_tpr = np.zeros((n_submissions, n_subjects + 1))
+            curve_fpr[:, 1:] = ((n_negative[:, np.newaxis] - negative_lower) /
+                                n_negative[:, np.newaxis])[:, ::-1]
+            curve_tpr[:, 1:] = ((n_positive[:, np.newaxis] - positive_lower) /
+                                n_positive[:, np.newaxis])[:, ::-1]
+        tpr[i] = _interp_rows(fpr, curve_fpr, curve_tpr)
+
+    if masks is None:
+        auc = auc[0]
+        if fpr is not None:
+            tpr = tpr[0]
+    return auc if fpr is None else (auc, tpr)
+
+
+def _interp_rows(x, xp, fp):
+    """``np.interp(x, xp[i], fp[i])`` for each row of the non-decreasing
+    ``xp`` in [0, 1]."""
+    n_rows, n_points = xp.shape
+    # shift the rows to search all of them in a single sorted array
+    offset = 2. * np.arange(n_rows)[:, np.newaxis]
+    flat_xp = (xp + offset).ravel()
+    left = np.searchsorted(flat_xp, (x + offset).ravel(), side='right') - 1
+    left = left.reshape(n_rows, x.size) - (offset / 2. * n_points).astype(int)
+    right = np.minimum(left + 1, n_points - 1)
+    x_left = np.take_along_axis(xp, left, axis=1)
+    x_right = np.take_along_axis(xp, right, axis=1)
+    y_left = np.take_along_axis(fp, left, axis=1)
+    y_right = np.take_along_axis(fp, right, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(x_right > x_left, (x - x_left) / (x_right - x_left),
+                          0.)
+    return y_left + weight * (y_right - y_left)
+
+
+def _resampled_roc_auc(y_true, y_score, masks, method, n_resamples, seeds,
+                       batch_size):
+    """AUC of the resamples of a single submission on each subset."""
+    order = np.argsort(y_score, kind='mergesort')
+    start, stop = _tie_groups(y_score[order][np.newaxis])
+    predicted = ~np.isnan(y_score)
+    # position of each subject in the sorted scores
+    rank = np.empty(y_score.size, dtype=int)
+    rank[order] = np.arange(y_score.size)
+    auc = np.empty((masks.shape[0], n_resamples))
+    for i, (mask, seed) in enumerate(zip(masks, seeds)):
+        # the resamples are drawn on the subjects in their original order,
+        # such that the submissions predicting the same subjects share them
+        subjects = np.flatnonzero(mask & predicted)
+        labels = y_true[subjects]
+        sorted_subjects = rank[subjects]
+        rng = np.random.RandomState(seed)
+        for batch in range(0, n_resamples, batch_size):
+            n_batch = min(batch_size, n_resamples - batch)
+            positive = np.zeros((n_batch, y_score.size))
+            negative = np.zeros((n_batch, y_score.size))
+            if method == 'bootstrap':
+                # the number of draws of each subject as its weight
+                draws = rng.randint(subjects.size,
+                                    size=(n_batch, subjects.size))
+                weights = np.bincount(
+                    (draws + subjects.size *
+                     np.arange(n_batch)[:, np.newaxis]).ravel(),
+                    minlength=n_batch * subjects.size).reshape(
+                        n_batch, subjects.size)
+                positive[:, sorted_subjects] = weights * labels
+                negative[:, sorted_subjects] = weights * ~labels
+            else:
+                permuted = labels[np.argsort(
+                    rng.rand(n_batch, subjects.size), axis=1)]
+                positive[:, sorted_subjects] = permuted
+                negative[:, sorted_subjects] = ~permuted
+            auc[i, batch:batch + n_batch] = _mann_whitney(
+                positive, negative, start, stop)
+    return auc
+
+
+def _resample(y_true, y_score, masks, method, n_resamples, random_state,
+              batch_size, n_jobs):
+    y_true = np.asarray(y_true).astype(bool)
+    y_score = np.atleast_2d(np.asarray(y_score, dtype=np.float64))
+    all_masks = _as_masks(masks, y_score.shape[1])
+    # the same seeds for all the submissions to compare them on the same
+    # resamples
+    seeds = np.random.RandomState(random_state).randint(
+        np.iinfo(np.int32).max, size=all_masks.shape[0])
+    resampled = Parallel(n_jobs=n_jobs)(
+        delayed(_resampled_roc_auc)(y_true, score, all_masks, method,
+                                    n_resamples, seeds, batch_size)
+        for score in y_score)
+    auc = roc_auc_scores(y_true, y_score, all_masks)
+    # shape (n_masks, n_submissions, n_resamples)
+    return auc, np.stack(resampled, axis=1)
+
+
+def bootstrap_roc_auc(y_true, y_score, masks=None, n_resamples=2000,
+                      confidence_level=0.95, random_state=0,
+                      batch_size=500, n_jobs=1):
+    """Bootstrap confidence intervals of the ROC-AUC of several submissions.
+
+    The subjects of each subset are drawn with replacement and the percentile
+    interval of the AUC of the resamples is returned.
+
+    Parameters
+    ----------
+    y_true, y_score, masks
+        See :func:`roc_auc_scores`.
+    n_resamples : int, default=2000
+        The number of bootstrap resamples.
+    confidence_level : float, default=0.95
+        The confidence level of the intervals.
+    random_state : int, default=0
+        The seed of the resamples. All the submissions share the same
+        resamples.
+    batch_size : int, default=500
+        The number of resamples scored at once.
+    n_jobs : int, default=1
+        The number of jobs scoring the submissions in parallel.
+
+    Returns
+    -------
+    auc : ndarray, shape (n_masks, n_submissions) or (n_submissions, )
+        The ROC-AUC of each submission on each subset.
+    ci_low, ci_high : ndarray, shape (n_masks, n_submissions) or \
+(n_submissions, )
+        The bounds of the confidence intervals.
+
+    """
+    auc, resampled = _resample(y_true, y_score, masks, 'bootstrap',
+                               n_resamples, random_state, batch_size, n_jobs)
+    alpha = (1 - confidence_level) / 2.
+    # the resamples with a single class have no AUC
+    ci_low, ci_high = np.nanpercentile(
+        resampled, [100 * alpha, 100 * (1 - alpha)], axis=-1)
+    if masks is None:
+        return auc[0], ci_low[0], ci_high[0]
+    return auc, ci_low, ci_high
+
+
+def permutation_test_roc_auc(y_true, y_score, masks=None,
+                             n_permutations=2000, alternative='greater',
+                             random_state=0, batch_size=500, n_jobs=1):
+    """Permutation test of the ROC-AUC of several submissions.
+
+    The labels of the subjects of each subset are permuted to estimate the
+    distribution of the AUC under the null hypothesis of no association.
+
+    Parameters
+    ----------
+    y_true, y_score, masks
+        See :func:`roc_auc_scores`.
+    n_permutations : int, default=2000
+        The number of permutations.
+    alternative : {'greater', 'two-sided'}, default='greater'
+        The alternative hypothesis: an AUC above chance, or different from
+        0.5.
+    random_state : int, default=0
+        The seed of the permutations. All the submissions share the same
+        permutations.
+    batch_size : int, default=500
+        The number of permutations scored at once.
+    n_jobs : int, default=1
+        The number of jobs scoring the submissions in parallel.
+
+    Returns
+    -------
+    auc : ndarray, shape (n_masks, n_submissions) or (n_submissions, )
+        The ROC-AUC of each submission on each subset.
+    pvalue : ndarray, shape (n_masks, n_submissions) or (n_submissions, )
+        The p-values, ``(1 + n_extreme) / (1 + n_permutations)``.
+
+    """
+    if alternative not in ('greater', 'two-sided'):
+        raise ValueError("'alternative' should be 'greater' or 'two-sided'. "
+                         "Got {} instead.".format(alternative))
+    auc, resampled = _resample(y_true, y_score, masks, 'permutation',
+                               n_permutations, random_state, batch_size,
+                               n_jobs)
+    if alternative == 'greater':
+        extreme = resampled >= auc[..., np.newaxis]
+    else:
+        extreme = (np.abs(resampled - 0.5) >=
+                   np.abs(auc - 0.5)[..., np.newaxis])
+    pvalue = (1. + extreme.sum(axis=-1)) / (1. + n_permutations)
+    if masks is None:
+        return auc[0], pvalue[0]
+    return auc, pvalue
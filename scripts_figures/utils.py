@@ -1,4 +1,7 @@
+import hashlib
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import joblib
 import numpy as np
@@ -6,6 +9,7 @@ import pandas as pd
 from sklearn.metrics import roc_auc_score
 
 from problem import get_train_data, get_test_data
+from roc import bootstrap_roc_auc, permutation_test_roc_auc
 
 
 def _get_data_rdb_out():
@@ -38,6 +42,94 @@ def _get_data_rdb_out():
             y_test[X_rdb_idx])
 
 
+# parsed predictions cached as binary arrays, keyed by the path, the size and
+# the modification time of the CSV files, see _read_prediction
+PREDICTION_CACHE = os.environ.get(
+    'AUTISM_PREDICTION_CACHE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '.prediction_cache'))
+# number of threads used by load_predictions
+N_JOBS = 8
+
+# true labels already loaded, indexed by dataset root
+_GROUND_TRUTH = {}
+_GROUND_TRUTH_LOCK = threading.Lock()
+
+
+def _load_ground_truth(path):
+    """Load the true labels of the training and testing sets of a dataset.
+
+    The labels are loaded once per dataset root and reloaded only if
+    ``train.csv`` or ``test.csv`` were modified.
+    """
+    key = os.path.abspath(path)
+    mtimes = [os.stat(os.path.join(path, 'data', filename)).st_mtime_ns
+              for filename in ('train.csv', 'test.csv')]
+    with _GROUND_TRUTH_LOCK:
+        if key not in _GROUND_TRUTH or _GROUND_TRUTH[key][0] != mtimes:
+            _, y_true_train = get_train_data(path)
+            _, y_true_test = get_test_data(path)
+            _GROUND_TRUTH[key] = (mtimes, y_true_train, y_true_test)
+        return _GROUND_TRUTH[key][1:]
+
+
+def _read_prediction(filename):
+    """Read a CSV file of predictions, parsed once and cached in binary."""
+    stat = os.stat(filename)
+    key = hashlib.sha1('{}:{}:{}'.format(
+        os.path.abspath(filename), stat.st_size,
+        stat.st_mtime_ns).encode()).hexdigest()
+    cache_filename = os.path.join(PREDICTION_CACHE, key + '.npy')
+    if os.path.isfile(cache_filename):
+        return np.load(cache_filename)
+    y_pred = np.loadtxt(filename)
+    try:
+        os.makedirs(PREDICTION_CACHE, exist_ok=True)
+        # write in a temporary file and rename it to be safe with concurrent
+        # threads and processes filling the same cache
+        tmp_filename = '{}.{}.{}.tmp.npy'.format(
+            cache_filename[:-4], os.getpid(), threading.get_ident())
+        np.save(tmp_filename, y_pred)
+        os.replace(tmp_filename, cache_filename)
+    except OSError:
+        # the cache is not writable: only parse the CSV file
+        pass
+    return y_pred
+
+
+def _load_train_test_prediction(path_store_pred, data_dir, prefix=''):
+    """Load the bagged predictions of a training output and the true labels.
+
+    Parameters
+    ----------
+    path_store_pred : str
+        The directory containing the ``y_pred_<prefix>_bagged_*.csv`` files.
+    data_dir : str
+        The root directory of the dataset containing the ``data`` folder.
+    prefix : str, default=''
+        The prefix of the bagged predictions, e.g. 'foldwise_best' for the
+        blended predictions.
+
+    Returns
+    -------
+    y_true_train, y_pred_train, y_true_test, y_pred_test : ndarray
+        See :func:`load_train_test_prediction`.
+
+    """
+    y_pred_train, y_pred_test = [
+        _read_prediction(os.path.join(
+            path_store_pred, 'y_pred_{}_bagged_{}.csv'.format(prefix, step)))
+        for step in ('valid', 'test')]
+
+    y_true_train, y_true_test = _load_ground_truth(data_dir)
+
+    # remove y_train values for which we have no prediction because they
+    # never went in the test part of the cv
+    predicted = ~np.isnan(y_pred_train[:, 1])
+    return (y_true_train[predicted], y_pred_train[predicted], y_true_test,
+            y_pred_test)
+
+
 def load_train_test_prediction(submission_name):
     """Load the true and predicted labels for a given submission.
 
@@ -60,69 +152,113 @@ def load_train_test_prediction(submission_name):
     """
     path_store_pred = os.path.join('../submissions', submission_name,
                                    'training_output')
+    return _load_train_test_prediction(path_store_pred, '..')
 
-    y_pred_train = np.loadtxt(os.path.join(path_store_pred, 'y_pred__bagged_valid.csv'))
-    y_pred_test = np.loadtxt(os.path.join(path_store_pred, 'y_pred__bagged_test.csv'))
-
-    _, y_true_train = get_train_data('..')
-    _, y_true_test = get_test_data('..')
-
-    # remove y_train values for which we have no prediction because they never went in the test part of the cv
-    y_true_train = y_true_train[~np.isnan(y_pred_train[:,1])]
-    y_pred_train = y_pred_train[~np.isnan(y_pred_train[:,1]), :]
-
-    return (y_true_train, y_pred_train, y_true_test, y_pred_test)
 
 def load_train_test_blended_prediction(group):
-    path_store_pred = os.path.join('../submissions', 'training_output_' + group)
-    
-    # we take foldwise because it corresponds to combined, may evolve with future versions of ramp workflow
-    y_pred_train = np.loadtxt(os.path.join(path_store_pred, 'y_pred_foldwise_best_bagged_valid.csv'))
-    y_pred_test = np.loadtxt(os.path.join(path_store_pred, 'y_pred_foldwise_best_bagged_test.csv'))
-    
-    _, y_true_train = get_train_data('..')
-    _, y_true_test = get_test_data('..')
-   
-    # remove y_train values for which we have no prediction because they never went in the test part of the cv
-    y_true_train = y_true_train[~np.isnan(y_pred_train[:,1])]
-    y_pred_train = y_pred_train[~np.isnan(y_pred_train[:,1]), :]
- 
-    return (y_true_train, y_pred_train, y_true_test, y_pred_test)
+    path_store_pred = os.path.join('../submissions',
+                                   'training_output_' + group)
+    # we take foldwise because it corresponds to combined, may evolve with
+    # future versions of ramp workflow
+    return _load_train_test_prediction(path_store_pred, '..',
+                                       prefix='foldwise_best')
+
 
 def load_train_test_prediction_aims(submission_name):
-    path_store_pred = os.path.join('../..', 'eu-aims', 'submissions', submission_name, 'training_output')
-    
-    y_pred_train = np.loadtxt(os.path.join(path_store_pred, 'y_pred__bagged_valid.csv'))
-    y_pred_test = np.loadtxt(os.path.join(path_store_pred, 'y_pred__bagged_test.csv'))
-
-    _, y_true_train = get_train_data("../../eu-aims")
-    _, y_true_test = get_test_data("../../eu-aims")
-    
-    # remove y_train values for which we have no prediction because they never went in the test part of the cv
-    y_true_train = y_true_train[~np.isnan(y_pred_train[:,1])]
-    y_pred_train = y_pred_train[~np.isnan(y_pred_train[:,1]), :]
-    
-    return (y_true_train, y_pred_train, y_true_test, y_pred_test)
+    path_store_pred = os.path.join('../..', 'eu-aims', 'submissions',
+                                   submission_name, 'training_output')
+    return _load_train_test_prediction(path_store_pred, '../../eu-aims')
+
 
 def load_train_test_blended_prediction_lc(nsub, it):
     data_dir = os.path.join('../learning_curve', 'it_{}_{}'.format(nsub, it))
     path_store_pred = os.path.join(data_dir, 'submissions/training_output')
-    
-    if not os.path.exists(os.path.join(path_store_pred, 'y_pred_foldwise_best_bagged_valid.csv')):
+
+    if not os.path.exists(os.path.join(
+            path_store_pred, 'y_pred_foldwise_best_bagged_valid.csv')):
         return (None, None, None, None)
 
-    # we take foldwise because it corresponds to combined, may evolve with future versions of ramp workflow
-    y_pred_train = np.loadtxt(os.path.join(path_store_pred, 'y_pred_foldwise_best_bagged_valid.csv'))
-    y_pred_test = np.loadtxt(os.path.join(path_store_pred, 'y_pred_foldwise_best_bagged_test.csv'))
-    
-    _, y_true_train = get_train_data(data_dir)
-    _, y_true_test = get_test_data(data_dir)
-    
-    # remove y_train values for which we have no prediction because they never went in the test part of the cv
-    y_true_train = y_true_train[~np.isnan(y_pred_train[:,1])]
-    y_pred_train = y_pred_train[~np.isnan(y_pred_train[:,1]), :]
-    
-    return (y_true_train, y_pred_train, y_true_test, y_pred_test)
+    # we take foldwise because it corresponds to combined, may evolve with
+    # future versions of ramp workflow
+    return _load_train_test_prediction(path_store_pred, data_dir,
+                                       prefix='foldwise_best')
+
+
+def load_predictions(loader, args, n_jobs=N_JOBS):
+    """Call one of the loaders of predictions concurrently.
+
+    The CSV files are read in a thread pool while the true labels of each
+    dataset are only loaded once.
+
+    Parameters
+    ----------
+    loader : callable
+        One of the ``load_train_test_*`` functions.
+    args : iterable
+        The arguments of each call, unpacked if they are tuples, e.g. the
+        names of the submissions or the ``(nsub, it)`` of the learning curve.
+    n_jobs : int, default=N_JOBS
+        The number of threads.
+
+    Returns
+    -------
+    predictions : list of tuple
+        The outputs of the loader, in the order of ``args``.
+
+    """
+    args = [arg if isinstance(arg, tuple) else (arg,) for arg in args]
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(lambda arg: loader(*arg), args))
+
+
+def load_score_matrices(path_store_preds, data_dir, prefix='',
+                        n_jobs=N_JOBS):
+    """Load the bagged predictions of several training outputs as matrices.
+
+    The matrices are meant for :func:`roc.roc_auc_scores`. The CSV files are
+    read in a thread pool.
+
+    Parameters
+    ----------
+    path_store_preds : list of str
+        The directories containing the ``y_pred_<prefix>_bagged_*.csv``
+        files, e.g. the ``training_output`` of each submission.
+    data_dir : str
+        The root directory of the dataset containing the ``data`` folder.
+    prefix : str, default=''
+        The prefix of the bagged predictions, e.g. 'foldwise_best' for the
+        blended predictions.
+    n_jobs : int, default=N_JOBS
+        The number of threads.
+
+    Returns
+    -------
+    y_true_train : ndarray, shape (n_train_samples, )
+        The true labels on the training set.
+    y_score_train : ndarray, shape (n_outputs, n_train_samples)
+        The predicted probability of ASD on the training set, NaN for the
+        subjects which never were in the test part of the cv.
+    y_true_test : ndarray, shape (n_test_samples, )
+        The true labels on the testing set.
+    y_score_test : ndarray, shape (n_outputs, n_test_samples)
+        The predicted probability of ASD on the testing set.
+
+    """
+    filenames = [
+        os.path.join(path_store_pred,
+                     'y_pred_{}_bagged_{}.csv'.format(prefix, step))
+        for path_store_pred in path_store_preds
+        for step in ('valid', 'test')]
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        y_pred = list(executor.map(_read_prediction, filenames))
+
+    y_true_train, y_true_test = _load_ground_truth(data_dir)
+    y_score_train = np.array([y[:, 1] for y in y_pred[0::2]]).reshape(
+        -1, y_true_train.size)
+    y_score_test = np.array([y[:, 1] for y in y_pred[1::2]]).reshape(
+        -1, y_true_test.size)
+    return y_true_train, y_score_train, y_true_test, y_score_test
+
 
 def compute_roc_auc_score(y_true_train, y_pred_train,
                           y_true_test, y_pred_test):
@@ -149,3 +285,56 @@ def compute_roc_auc_score(y_true_train, y_pred_train,
     """
     return (roc_auc_score(y_true_train, y_pred_train[:, 1]),
             roc_auc_score(y_true_test, y_pred_test[:, 1]))
+
+
+def compute_roc_auc_statistics(y_true_train, y_pred_train, y_true_test,
+                               y_pred_test, masks_test=None,
+                               n_resamples=2000, confidence_level=0.95,
+                               random_state=0):
+    """Compute the ROC-AUC with bootstrap confidence intervals and
+    permutation p-values for the training and testing set.
+
+    Parameters
+    ----------
+    y_true_train : ndarray, shape (n_train_samples, )
+        The true labels on the training set.
+    y_pred_train : ndarray, shape (n_train_samples, )
+        The predicted labels on the training set.
+    y_true_test : ndarray, shape (n_test_samples, )
+        The true labels on the testing set.
+    y_pred_test : ndarray, shape (n_test_samples, )
+        The predicted labels on the testing set.
+    masks_test : dict of ndarray, shape (n_test_samples, ), default=None
+        Subsets of the testing set, e.g. the subjects of a site, also scored.
+    n_resamples : int, default=2000
+        The number of bootstrap resamples and of permutations.
+    confidence_level : float, default=0.95
+        The confidence level of the intervals.
+    random_state : int, default=0
+        The seed of the resamples.
+
+    Returns
+    -------
+    statistics : DataFrame
+        The columns 'auc', 'ci_low', 'ci_high' and 'pvalue' for the
+        training set, the testing set and each subset.
+
+    """
+    masks_test = masks_test or {}
+    sets = [('train', y_true_train, y_pred_train, None),
+            ('test', y_true_test, y_pred_test,
+             [np.ones(len(y_true_test), dtype=bool)] +
+             [np.asarray(mask, dtype=bool) for mask in masks_test.values()])]
+    statistics = []
+    for name, y_true, y_pred, masks in sets:
+        auc, ci_low, ci_high = bootstrap_roc_auc(
+            y_true, y_pred[:, 1], masks=masks, n_resamples=n_resamples,
+            confidence_level=confidence_level, random_state=random_state)
+        _, pvalue = permutation_test_roc_auc(
+            y_true, y_pred[:, 1], masks=masks, n_permutations=n_resamples,
+            random_state=random_state)
+        statistics.append(np.column_stack(
+            [auc.ravel(), ci_low.ravel(), ci_high.ravel(), pvalue.ravel()]))
+    return pd.DataFrame(np.concatenate(statistics),
+                        columns=['auc', 'ci_low', 'ci_high', 'pvalue'],
+                        index=['train', 'test'] + list(masks_test))
@@ -16,17 +16,17 @@ class Classifier(BaseEstimator):
         self.meta_clf = LogisticRegression(C=1.)
 
     def fit(self, X, y):
-        X_anatomy = X[[col for col in X.columns if col.startswith('anatomy')]]
-        X_connectome = X[[col for col in X.columns
-                          if col.startswith('connectome')]]
+        # blocks of the BlockFeatures built by the feature extractor
+        X_anatomy = X.block('anatomy')
+        X_connectome = X.block('connectome')
         train_idx, validation_idx = train_test_split(range(y.size),
                                                      test_size=0.33,
                                                      shuffle=True,
                                                      random_state=42)
-        X_anatomy_train = X_anatomy.iloc[train_idx]
-        X_anatomy_validation = X_anatomy.iloc[validation_idx]
-        X_connectome_train = X_connectome.iloc[train_idx]
-        X_connectome_validation = X_connectome.iloc[validation_idx]
+        X_anatomy_train = X_anatomy[train_idx]
+        X_anatomy_validation = X_anatomy[validation_idx]
+        X_connectome_train = X_connectome[train_idx]
+        X_connectome_validation = X_connectome[validation_idx]
         y_train = y[train_idx]
         y_validation = y[validation_idx]
 
@@ -44,9 +44,8 @@ class Classifier(BaseEstimator):
         return self
 
     def predict(self, X):
-        X_anatomy = X[[col for col in X.columns if col.startswith('anatomy')]]
-        X_connectome = X[[col for col in X.columns
-                          if col.startswith('connectome')]]
+        X_anatomy = X.block('anatomy')
+        X_connectome = X.block('connectome')
 
         y_anatomy_pred = self.clf_anatomy.predict_proba(X_anatomy)
         y_connectome_pred = self.clf_connectome.predict_proba(X_connectome)
@@ -55,9 +54,8 @@ class Classifier(BaseEstimator):
             np.concatenate([y_connectome_pred, y_anatomy_pred], axis=1))
 
     def predict_proba(self, X):
-        X_anatomy = X[[col for col in X.columns if col.startswith('anatomy')]]
-        X_connectome = X[[col for col in X.columns
-                          if col.startswith('connectome')]]
+        X_anatomy = X.block('anatomy')
+        X_connectome = X.block('connectome')
 
         y_anatomy_pred = self.clf_anatomy.predict_proba(X_anatomy)
         y_connectome_pred = self.clf_connectome.predict_proba(X_connectome)
@@ -1,27 +1,85 @@
+import os
+
 import numpy as np
-import pandas as pd
+import rampwf as rw
 
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import FunctionTransformer
 
-from nilearn.connectome import ConnectivityMeasure
+# the connectome engine shared by the functional submissions, at the root of
+# the kit whatever the directory from which the submission is run
+connectome = rw.utils.import_module_from_source(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                 'connectome.py'), 'connectome')
+
+
+class BlockFeatures(np.ndarray):
+    """Feature matrix made of named blocks of contiguous columns.
+
+    The blocks are stored in a single array and looked up by name with
+    ``X.block(name)``, such that the classifier does not need to scan column
+    names. Selecting rows, e.g. ``X[train_is]``, keeps the blocks.
+
+    Parameters
+    ----------
+    blocks : list of (string, ndarray of shape (n_samples, n_features_i))
+        The name and the features of each block.
+
+    """
+
+    def __new__(cls, blocks):
+        n_samples = blocks[0][1].shape[0]
+        dtype = np.result_type(*[features for _, features in blocks])
+        X = np.empty((n_samples, sum(features.shape[1]
+                                     for _, features in blocks)),
+                     dtype=dtype).view(cls)
+        X.blocks = {}
+        start = 0
+        for name, features in blocks:
+            stop = start + features.shape[1]
+            X[:, start:stop] = features
+            X.blocks[name] = slice(start, stop)
+            start = stop
+        return X
+
+    def __array_finalize__(self, obj):
+        # the blocks are only valid if the columns were not sliced
+        blocks = getattr(obj, 'blocks', None)
+        if (blocks is not None and self.ndim == 2 and obj.ndim == 2 and
+                self.shape[1] == obj.shape[1]):
+            self.blocks = blocks
+        else:
+            self.blocks = None
+
+    def __reduce__(self):
+        # the blocks are pickled along with the state of the array
+        reconstruct, arguments, state = super(BlockFeatures,
+                                              self).__reduce__()
+        return reconstruct, arguments, (state, self.blocks)
 
+    def __setstate__(self, state):
+        state, self.blocks = state
+        super(BlockFeatures, self).__setstate__(state)
 
-def _load_fmri(fmri_filenames):
-    """Load time-series extracted from the fMRI using a specific atlas."""
-    return np.array([pd.read_csv(subject_filename,
-                                 header=None).values
-                     for subject_filename in fmri_filenames])
+    def block(self, name):
+        """Return a view of the features of a block."""
+        return np.asarray(self)[:, self.blocks[name]]
 
 
 class FeatureExtractor(BaseEstimator, TransformerMixin):
-    def __init__(self):
-        # make a transformer which will load the time series and compute the
-        # connectome matrix
+    def __init__(self, dtype=None):
+        self.dtype = dtype
+        # the precision can be lowered to float32 with AUTISM_DTYPE
+        dtype = connectome.get_dtype(dtype)
+        # make a transformer which will load the (cached) covariance matrices
+        # of the time series and compute the tangent connectome matrix
         self.transformer_fmri = make_pipeline(
-            FunctionTransformer(func=_load_fmri, validate=False),
-            ConnectivityMeasure(kind='tangent', vectorize=True))
+            FunctionTransformer(func=connectome.load_covariances,
+                                validate=False, kw_args={'dtype': dtype}),
+            connectome.BatchedConnectivityMeasure(
+                cov_estimator='precomputed', kind='tangent', vectorize=True,
+                dtype=dtype))
 
     def fit(self, X_df, y):
         fmri_filenames = X_df['fmri_msdl']
@@ -31,12 +89,12 @@ class FeatureExtractor(BaseEstimator, TransformerMixin):
     def transform(self, X_df):
         fmri_filenames = X_df['fmri_msdl']
         X_connectome = self.transformer_fmri.transform(fmri_filenames)
-        X_connectome = pd.DataFrame(X_connectome, index=X_df.index)
-        X_connectome.columns = ['connectome_{}'.format(i)
-                                for i in range(X_connectome.columns.size)]
         # get the anatomical information
-        X_anatomy = X_df[[col for col in X_df.columns
-                          if col.startswith('anatomy')]]
-        X_anatomy = X_anatomy.drop(columns='anatomy_select')
-        # concatenate both matrices
-        return pd.concat([X_connectome, X_anatomy], axis=1)
+        anatomy_columns = X_df.columns[
+            X_df.columns.str.startswith('anatomy') &
+            (X_df.columns != 'anatomy_select')]
+        X_anatomy = X_df[anatomy_columns].values.astype(
+            X_connectome.dtype, copy=False)
+        # store both matrices as blocks of a single array
+        return BlockFeatures([('connectome', X_connectome),
+                              ('anatomy', X_anatomy)])
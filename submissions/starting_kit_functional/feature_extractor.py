@@ -1,27 +1,31 @@
-import numpy as np
-import pandas as pd
+import os
+
+import rampwf as rw
 
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import FunctionTransformer
 
-from nilearn.connectome import ConnectivityMeasure
-
-
-def _load_fmri(fmri_filenames):
-    """Load time-series extracted from the fMRI using a specific atlas."""
-    return np.array([pd.read_csv(subject_filename,
-                                 header=None).values
-                     for subject_filename in fmri_filenames])
+# the connectome engine shared by the functional submissions, at the root of
+# the kit whatever the directory from which the submission is run
+connectome = rw.utils.import_module_from_source(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                 'connectome.py'), 'connectome')
 
 
 class FeatureExtractor(BaseEstimator, TransformerMixin):
-    def __init__(self):
-        # make a transformer which will load the time series and compute the
-        # connectome matrix
+    def __init__(self, dtype=None):
+        self.dtype = dtype
+        # the precision can be lowered to float32 with AUTISM_DTYPE
+        dtype = connectome.get_dtype(dtype)
+        # make a transformer which will load the (cached) covariance matrices
+        # of the time series and compute the tangent connectome matrix
         self.transformer_fmri = make_pipeline(
-            FunctionTransformer(func=_load_fmri, validate=False),
-            ConnectivityMeasure(kind='tangent', vectorize=True))
+            FunctionTransformer(func=connectome.load_covariances,
+                                validate=False, kw_args={'dtype': dtype}),
+            connectome.BatchedConnectivityMeasure(
+                cov_estimator='precomputed', kind='tangent', vectorize=True,
+                dtype=dtype))
 
     def fit(self, X_df, y):
         # get only the time series for the MSDL atlas
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import nibabel
+import numpy as np
+import pytest
+from sklearn.utils import Bunch
+
+# the scripts of the kit are not installed: import them from their folders
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in (ROOT, os.path.join(ROOT, 'preprocessing')):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+# the functional image and the atlases of the tests of the extraction
+SHAPE = (12, 13, 11)
+N_SAMPLES = 30
+FUNC_AFFINE = np.array([[3., 0., 0., -18.], [0., 3., 0., -20.],
+                        [0., 0., 3., -15.], [0., 0., 0., 1.]])
+
+
+@pytest.fixture
+def func_img():
+    rng = np.random.RandomState(0)
+    # noise with a trend such that the detrending matters
+    data = (rng.standard_normal(SHAPE + (N_SAMPLES,)) +
+            np.linspace(0, 2, N_SAMPLES) + 10)
+    return nibabel.Nifti1Image(data, FUNC_AFFINE)
+
+
+@pytest.fixture
+def atlases(tmp_path):
+    """A labels atlas and a maps atlas on a finer grid and a few seeds."""
+    rng = np.random.RandomState(1)
+    affine = np.diag([2., 2., 2., 1.])
+    affine[:3, 3] = [-18., -20., -15.]
+    shape = (18, 19, 16)
+
+    labels = np.zeros(shape, dtype=np.int32)
+    labels[2:8, 2:16, 2:14] = 1
+    labels[8:14, 2:9, 2:14] = 2
+    labels[8:14, 9:16, 2:14] = 5
+    labels_filename = str(tmp_path / 'labels.nii.gz')
+    nibabel.Nifti1Image(labels, affine).to_filename(labels_filename)
+
+    maps = np.zeros(shape + (3,))
+    maps[1:9, 1:17, 1:15, 0] = rng.uniform(0.1, 1, (8, 16, 14))
+    maps[7:15, 1:10, 1:15, 1] = rng.uniform(0.1, 1, (8, 9, 14))
+    maps[7:15, 8:17, 3:13, 2] = rng.uniform(0.1, 1, (8, 9, 10))
+    maps_filename = str(tmp_path / 'maps.nii.gz')
+    nibabel.Nifti1Image(maps, affine).to_filename(maps_filename)
+
+    coords = np.array([(-6., -5., 0.), (6., 4., 3.), (0., 10., -6.)])
+    rois = np.rec.fromarrays(coords.T, names=['x', 'y', 'z'])
+    return {'labels': labels_filename, 'maps': maps_filename,
+            'spheres': Bunch(rois=rois)}
@@ -0,0 +1,43 @@
+import nibabel
+import numpy as np
+import pytest
+
+from batched_masker import BatchedMasker
+
+try:
+    from nilearn.maskers import (NiftiLabelsMasker, NiftiMapsMasker,
+                                 NiftiSpheresMasker)
+except ImportError:
+    # nilearn < 0.9
+    from nilearn.input_data import (NiftiLabelsMasker, NiftiMapsMasker,
+                                    NiftiSpheresMasker)
+
+
+@pytest.mark.parametrize('cache', [False, True])
+def test_batched_masker_matches_nilearn(func_img, atlases, tmp_path, cache):
+    descr = ['labels', 'maps', 'spheres']
+    masker = BatchedMasker(
+        [atlases[name] for name in descr], descr,
+        cache_dir=str(tmp_path / 'cache') if cache else None)
+    time_series = masker.fit(func_img).transform(func_img)
+
+    rois = atlases['spheres'].rois
+    expected = {
+        'labels': NiftiLabelsMasker(atlases['labels'], detrend=True),
+        'maps': NiftiMapsMasker(atlases['maps'], detrend=True),
+        'spheres': NiftiSpheresMasker(
+            np.vstack((rois['x'], rois['y'], rois['z'])).T, radius=5.,
+            detrend=True)}
+    for name in descr:
+        expected_ts = expected[name].fit_transform(func_img)
+        assert time_series[name].shape == expected_ts.shape
+        np.testing.assert_allclose(time_series[name], expected_ts,
+                                   rtol=1e-5, atol=1e-6)
+
+
+def test_batched_masker_other_grid(func_img, atlases):
+    masker = BatchedMasker([atlases['labels']], ['labels']).fit(func_img)
+    other_img = nibabel.Nifti1Image(func_img.get_fdata()[:-1],
+                                    func_img.affine)
+    with pytest.raises(ValueError, match='grid'):
+        masker.transform(other_img)
@@ -0,0 +1,42 @@
+import os
+import pickle
+import sys
+
+import joblib
+import numpy as np
+import pytest
+import rampwf as rw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def BlockFeatures(monkeypatch):
+    feature_extractor = rw.utils.import_module_from_source(
+        os.path.join(ROOT, 'submissions', 'combine_anatomy_functional',
+                     'feature_extractor.py'), 'feature_extractor')
+    # as when the submission is imported, such that its classes are pickled
+    # by reference
+    monkeypatch.setitem(sys.modules, 'feature_extractor', feature_extractor)
+    return feature_extractor.BlockFeatures
+
+
+@pytest.mark.parametrize('round_trip', ['pickle', 'joblib'])
+def test_block_features_round_trip(BlockFeatures, tmp_path, round_trip):
+    anatomy = np.arange(12.).reshape(4, 3)
+    connectome = -np.arange(8.).reshape(4, 2)
+    X = BlockFeatures([('anatomy', anatomy), ('connectome', connectome)])
+
+    if round_trip == 'pickle':
+        X_loaded = pickle.loads(pickle.dumps(X))
+    else:
+        filename = str(tmp_path / 'X.joblib')
+        joblib.dump(X, filename)
+        X_loaded = joblib.load(filename)
+
+    assert type(X_loaded) is BlockFeatures
+    assert X_loaded.blocks == X.blocks
+    np.testing.assert_array_equal(X_loaded, X)
+    np.testing.assert_array_equal(X_loaded.block('anatomy'), anatomy)
+    np.testing.assert_array_equal(X_loaded[1:3].block('connectome'),
+                                  connectome[1:3])
@@ -0,0 +1,23 @@
+import os
+
+import check_precision
+from generate_data import generate_data
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_float32_keeps_the_scores(tmp_path, monkeypatch):
+    generate_data(str(tmp_path), n_subjects=150, reference_path=ROOT,
+                  atlases=['msdl'])
+    # the time-series filenames are relative to the root of the data
+    monkeypatch.chdir(str(tmp_path))
+    monkeypatch.delenv('AUTISM_TRACE', raising=False)
+    monkeypatch.delenv('AUTISM_DTYPE', raising=False)
+    scores = check_precision.check_precision(
+        'starting_kit_functional', ramp_kit_dir=ROOT, ramp_data_dir='.',
+        ramp_submission_dir=os.path.join(ROOT, 'submissions'))
+
+    assert (scores['float64', 'features_dtype'] == 'float64').all()
+    assert (scores['float32', 'features_dtype'] == 'float32').all()
+    assert scores['auc_difference'].max() <= check_precision.TOL
+    assert 'AUTISM_DTYPE' not in os.environ
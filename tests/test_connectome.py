@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from nilearn.connectome import ConnectivityMeasure
+from sklearn.covariance import EmpiricalCovariance
+
+from connectome import BatchedConnectivityMeasure
+
+KINDS = ['tangent', 'covariance', 'correlation', 'precision']
+# (vectorize, discard_diagonal)
+SHAPES = [(False, False), (True, False), (True, True)]
+
+
+@pytest.fixture
+def time_series():
+    rng = np.random.RandomState(0)
+    # correlated regions of different variances
+    mixing = rng.standard_normal((5, 5)) + 2 * np.eye(5)
+    return [rng.standard_normal((40, 5)).dot(mixing) *
+            rng.uniform(0.5, 2, 5) for _ in range(8)]
+
+
+def _assert_matches(batched, nilearn, X_batched, X_nilearn):
+    connectivities = batched.fit(X_batched).transform(X_batched)
+    expected = nilearn.fit(X_nilearn).transform(X_nilearn)
+    assert connectivities.shape == expected.shape
+    np.testing.assert_allclose(connectivities, expected, rtol=1e-7,
+                               atol=1e-10)
+    np.testing.assert_allclose(batched.mean_, nilearn.mean_, rtol=1e-7,
+                               atol=1e-10)
+
+
+@pytest.mark.parametrize('kind', KINDS)
+@pytest.mark.parametrize('vectorize, discard_diagonal', SHAPES)
+def test_batched_connectivity_matches_nilearn(time_series, kind, vectorize,
+                                              discard_diagonal):
+    params = dict(kind=kind, vectorize=vectorize,
+                  discard_diagonal=discard_diagonal)
+    _assert_matches(BatchedConnectivityMeasure(batch_size=3, **params),
+                    ConnectivityMeasure(**params), time_series, time_series)
+
+
+@pytest.mark.parametrize('kind', KINDS)
+@pytest.mark.parametrize('vectorize, discard_diagonal', SHAPES)
+def test_batched_connectivity_precomputed(time_series, kind, vectorize,
+                                          discard_diagonal):
+    # the empirical covariance does not depend on the standardization of the
+    # time-series of the correlations by nilearn
+    covariances = np.array([EmpiricalCovariance().fit(ts).covariance_
+                            for ts in time_series])
+    params = dict(kind=kind, vectorize=vectorize,
+                  discard_diagonal=discard_diagonal)
+    _assert_matches(
+        BatchedConnectivityMeasure(cov_estimator='precomputed', **params),
+        ConnectivityMeasure(cov_estimator=EmpiricalCovariance(), **params),
+        covariances, time_series)
+
+
+def test_batched_connectivity_kind():
+    with pytest.raises(ValueError, match='kind'):
+        BatchedConnectivityMeasure(kind='partial correlation').fit(
+            np.ones((2, 3, 3)))
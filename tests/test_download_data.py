@@ -0,0 +1,139 @@
+import hashlib
+import os
+import re
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pandas as pd
+import pytest
+
+import download_data
+
+MEMBERS = {'msdl/1/run_1/1.csv': b'0.1,0.2\n0.3,0.4\n' * 100,
+           'msdl/2/run_1/2.csv': b'1.5,2.5\n3.5,4.5\n' * 100}
+
+
+class _RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serve the files of the server, honouring ``Range: bytes=<start>-``."""
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('Range')))
+        with open(os.path.join(self.server.directory,
+                               self.path.lstrip('/')), 'rb') as f:
+            content = f.read()
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range') or '')
+        if match is None:
+            self.send_response(200)
+        else:
+            start = int(match.group(1))
+            if start >= len(content):
+                self.send_response(416)
+                self.end_headers()
+                return
+            content = content[start:]
+            self.send_response(206)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    directory = tmp_path / 'server'
+    directory.mkdir()
+    httpd = HTTPServer(('127.0.0.1', 0), _RangeRequestHandler)
+    httpd.directory = str(directory)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = 'http://127.0.0.1:{}/'.format(httpd.server_port)
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def archive(server, monkeypatch):
+    """Serve an archive of the msdl atlas and return its content."""
+    archive_file = os.path.join(server.directory, 'msdl.zip')
+    with zipfile.ZipFile(archive_file, 'w') as zip_ref:
+        for member, content in MEMBERS.items():
+            zip_ref.writestr(member, content)
+    with open(archive_file, 'rb') as f:
+        content = f.read()
+    monkeypatch.setitem(download_data.ARCHIVE, 'msdl',
+                        server.url + 'msdl.zip')
+    monkeypatch.setitem(download_data.CHECKSUM, 'msdl',
+                        hashlib.sha256(content).hexdigest())
+    return content
+
+
+def test_download_resumes_with_range(tmp_path, server, archive):
+    output_file = str(tmp_path / 'msdl.zip')
+    n_bytes = len(archive) // 2
+    # a download interrupted half-way
+    with open(output_file + '.part', 'wb') as f:
+        f.write(archive[:n_bytes])
+
+    download_data._download(download_data.ARCHIVE['msdl'], output_file,
+                            download_data.CHECKSUM['msdl'])
+
+    assert server.requests == [('/msdl.zip', 'bytes={}-'.format(n_bytes))]
+    assert not os.path.exists(output_file + '.part')
+    with open(output_file, 'rb') as f:
+        assert f.read() == archive
+
+
+def test_download_corrupted(tmp_path, server, archive):
+    output_file = str(tmp_path / 'msdl.zip')
+    with open(output_file + '.part', 'wb') as f:
+        f.write(b'not the archive')
+
+    with pytest.raises(IOError, match='corrupted'):
+        download_data._download(download_data.ARCHIVE['msdl'], output_file,
+                                download_data.CHECKSUM['msdl'])
+    assert not os.path.exists(output_file)
+    assert not os.path.exists(output_file + '.part')
+
+
+def test_fetch_repairs_and_skips(tmp_path, server, archive, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fmri_directory = tmp_path / 'data' / 'fmri'
+    manifest_file = fmri_directory / 'msdl' / download_data.MANIFEST_FILENAME
+
+    download_data.fetch_fmri_time_series('msdl')
+    assert server.requests == [('/msdl.zip', None)]
+    manifest = pd.read_csv(str(manifest_file)).set_index('member')
+    assert sorted(manifest.index) == sorted(MEMBERS)
+    for member, content in MEMBERS.items():
+        assert (fmri_directory / member).read_bytes() == content
+        assert (manifest.loc[member, 'sha256'] ==
+                hashlib.sha256(content).hexdigest())
+
+    # valid files are neither downloaded nor extracted again
+    mtime_ns = {member: os.stat(str(fmri_directory / member)).st_mtime_ns
+                for member in MEMBERS}
+    download_data.fetch_fmri_time_series('msdl')
+    assert len(server.requests) == 1
+    for member in MEMBERS:
+        assert (os.stat(str(fmri_directory / member)).st_mtime_ns ==
+                mtime_ns[member])
+
+    # a corrupted file and a missing file are restored from the archive kept
+    # locally, the other file is left untouched
+    corrupted, missing = sorted(MEMBERS)
+    content = MEMBERS[corrupted]
+    (fmri_directory / corrupted).write_bytes(content[:-1] + b'9')
+    os.remove(str(fmri_directory / missing))
+    download_data.fetch_fmri_time_series('msdl')
+    assert len(server.requests) == 1
+    for member, content in MEMBERS.items():
+        assert (fmri_directory / member).read_bytes() == content
+    manifest = pd.read_csv(str(manifest_file)).set_index('member')
+    for member in MEMBERS:
+        assert (manifest.loc[member, 'mtime_ns'] ==
+                os.stat(str(fmri_directory / member)).st_mtime_ns)
@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pytest
+
+from extract_time_series import _extract_subject_timeseries
+
+DESCR = ['labels', 'maps', 'spheres']
+
+
+@pytest.fixture
+def run_files(func_img, tmp_path):
+    func = str(tmp_path / 'func.nii.gz')
+    func_img.to_filename(func)
+    motion = str(tmp_path / 'motion.1D')
+    np.savetxt(motion, np.zeros((func_img.shape[3], 6)))
+    return func, motion
+
+
+def _extract(run_files, atlases, path_output, engine, cache_dir):
+    func, motion = run_files
+    outputs, failures = _extract_subject_timeseries(
+        func, motion, '1', 'run_1', [atlases[name] for name in DESCR], DESCR,
+        str(path_output), engine=engine, cache_dir=cache_dir)
+    assert not failures
+    return {name: np.loadtxt(outputs[name][0], delimiter=',')
+            for name in DESCR}
+
+
+def test_nilearn_engine_caches_only_the_atlases(run_files, atlases,
+                                                tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    cached = _extract(run_files, atlases, tmp_path / 'cached', 'nilearn',
+                      cache_dir)
+    # the labels and maps resampled on the functional grid, no time series
+    assert len(os.listdir(cache_dir)) == 2
+    assert all(filename.endswith('.nii.gz')
+               for filename in os.listdir(cache_dir))
+    # the cached atlases are reused
+    cached_again = _extract(run_files, atlases, tmp_path / 'cached_again',
+                            'nilearn', cache_dir)
+
+    uncached = _extract(run_files, atlases, tmp_path / 'uncached', 'nilearn',
+                        None)
+    batched = _extract(run_files, atlases, tmp_path / 'batched', 'batched',
+                       None)
+    for name in DESCR:
+        np.testing.assert_allclose(cached[name], uncached[name], rtol=1e-5,
+                                   atol=1e-6)
+        np.testing.assert_allclose(cached_again[name], cached[name])
+        np.testing.assert_allclose(batched[name], uncached[name], rtol=1e-5,
+                                   atol=1e-6)
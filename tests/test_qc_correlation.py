@@ -0,0 +1,25 @@
+import os
+
+import numpy as np
+
+from extract_time_series import LEDGER_COLUMNS, _append_entries
+from qc_correlation import compute_correlation
+
+
+def test_resumed_ledger_is_deduplicated(tmp_path):
+    rng = np.random.RandomState(0)
+    path_ledger = str(tmp_path / 'ledger.csv')
+    for subject_id in ('1', '2', '3'):
+        filename = str(tmp_path / '{}.csv'.format(subject_id))
+        np.savetxt(filename, rng.standard_normal((20, 4)), delimiter=',')
+        row = dict(subject_id=subject_id, run='run_1', atlas='msdl',
+                   filename=filename, size=os.path.getsize(filename),
+                   func_mtime_ns=0)
+        # an extraction interrupted and resumed appends the rows again
+        _append_entries([row], path_ledger, LEDGER_COLUMNS)
+        _append_entries([row], path_ledger, LEDGER_COLUMNS)
+
+    with np.load(compute_correlation(str(tmp_path), atlas='msdl')) as qc:
+        assert qc['correlation'].shape == (3, 4, 4)
+        assert list(qc['subject_id']) == ['1', '2', '3']
+        assert list(qc['run']) == ['run_1'] * 3
@@ -0,0 +1,275 @@
+# coding: utf-8
+
+"""Opt-in tracing of the stages of the workflow.
+
+When the environment variable ``AUTISM_TRACE`` gives a filename, the workflow
+of ``problem.py`` is replaced by :class:`TracedFeatureExtractorClassifier`,
+which records for each fold the wall time, the CPU time, the resident memory
+and the size of the inputs and outputs of:
+
+* the fit and the transform of the feature extractor and each step of its
+  ``transformer_fmri`` pipeline, if any;
+* the fit and the ``predict_proba`` of the classifier.
+
+With a ``.json`` filename, the events are written in the Chrome trace format,
+which can be opened in ``chrome://tracing`` or https://ui.perfetto.dev.
+Otherwise, one JSON event is written per line. For instance::
+
+    AUTISM_TRACE=trace.json ramp_test_submission --quick-test
+
+The resident memory of the process is recorded before and after each stage.
+On Linux, the peak resident memory of each stage is also recorded: the high
+water mark of the process is reset when a stage starts, through
+``/proc/self/clear_refs``, and read when it ends. The peak of a stage covers
+the stages nested in it. It is recorded as null where the mark cannot be reset.
+
+The events are appended, such that the traces of several processes, e.g. the
+folds trained in parallel by ``run_cv.py``, end up in the same file. The fold
+is given by the environment variable ``AUTISM_TRACE_FOLD`` if set, by the
+order of the calls to ``train_submission`` otherwise.
+
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import rampwf as rw
+
+
+def _rss():
+    """Resident memory of the process, in bytes, or None if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss():
+    """Peak resident memory since the last reset, in bytes, or None."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset the peak resident memory of the process, if possible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def _describe(data):
+    """Shape and size of an input or an output of a stage."""
+    if hasattr(data, 'shape'):
+        description = {'shape': list(data.shape)}
+        if hasattr(data, 'nbytes'):
+            description['nbytes'] = int(data.nbytes)
+        elif hasattr(data, 'memory_usage'):
+            description['nbytes'] = int(data.memory_usage(deep=False).sum())
+        return description
+    if isinstance(data, (list, tuple)):
+        return {'length': len(data),
+                'nbytes': int(sum(getattr(x, 'nbytes', 0) for x in data))}
+    return {'type': type(data).__name__}
+
+
+class Tracer(object):
+    """Write the events of the traced stages in a file.
+
+    Parameters
+    ----------
+    filename : string
+        The file in which the events are appended. The Chrome trace format is
+        used if it ends with ``.json``, one JSON event per line otherwise.
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.chrome_trace = filename.endswith('.json')
+        self._lock = threading.Lock()
+        # the objects whose wrapped methods are running and the peak resident
+        # memory of the running spans, per thread
+        self._local = threading.local()
+        if self.chrome_trace:
+            # the closing bracket is optional in the Chrome trace format
+            try:
+                fd = os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                pass
+            else:
+                os.write(fd, b'[\n')
+                os.close(fd)
+
+    def _write(self, event):
+        line = json.dumps(event) + (',\n' if self.chrome_trace else '\n')
+        with self._lock:
+            with open(self.filename, 'a') as f:
+                f.write(line)
+
+    @contextmanager
+    def span(self, name, fold=None, data=None):
+        """Trace a stage.
+
+        Parameters
+        ----------
+        name : string
+            The name of the stage.
+
+        fold : int or None, default=None
+            The fold of the cross-validation.
+
+        data : object or None, default=None
+            The input of the stage.
+
+        Yields
+        ------
+        args : dict
+            The arguments of the event. The output of the stage can be
+            described by setting ``args['output']``.
+
+        """
+        args = {'fold': fold}
+        if data is not None:
+            args['input'] = _describe(data)
+        # the peak of the enclosing span is kept before the mark is reset
+        peaks = self._local.__dict__.setdefault('peaks', [])
+        if peaks and peaks[-1] is not None:
+            peaks[-1] = max(peaks[-1], _peak_rss())
+        args['rss_before'] = _rss()
+        peaks.append(_peak_rss() if _reset_peak_rss() else None)
+        start, cpu_time = time.time(), time.process_time()
+        try:
+            yield args
+        finally:
+            args['cpu_time'] = time.process_time() - cpu_time
+            args['rss_after'] = _rss()
+            peak_rss = peaks.pop()
+            if peak_rss is not None:
+                peak_rss = max(peak_rss, _peak_rss())
+                if peaks and peaks[-1] is not None:
+                    peaks[-1] = max(peaks[-1], peak_rss)
+            args['peak_rss'] = peak_rss
+            if 'output' in args:
+                args['output'] = _describe(args['output'])
+            self._write({'name': name, 'cat': 'workflow', 'ph': 'X',
+                         'ts': int(start * 1e6),
+                         'dur': int((time.time() - start) * 1e6),
+                         'pid': os.getpid(),
+                         'tid': threading.current_thread().ident,
+                         'args': args})
+
+    def wrap(self, obj, method_name, name, fold):
+        """Trace a method of an object by replacing it on the instance.
+
+        Only the outermost of the wrapped methods of an object is traced, such
+        that a ``fit_transform`` calling the wrapped ``fit`` and
+        ``transform`` is not counted twice.
+
+        """
+        method = getattr(obj, method_name)
+
+        @functools.wraps(method)
+        def traced(X, *args, **kwargs):
+            running = self._local.__dict__.setdefault('running', set())
+            if id(obj) in running:
+                return method(X, *args, **kwargs)
+            running.add(id(obj))
+            try:
+                with self.span(name, fold=fold, data=X) as span_args:
+                    output = method(X, *args, **kwargs)
+                    if method_name != 'fit':
+                        span_args['output'] = output
+            finally:
+                running.discard(id(obj))
+            return output
+
+        setattr(obj, method_name, traced)
+
+
+class TracedFeatureExtractorClassifier(
+        rw.workflows.FeatureExtractorClassifier):
+    """Feature extractor and classifier workflow recording its stages.
+
+    Parameters
+    ----------
+    filename : string
+        The file in which the events are written, see :class:`Tracer`.
+
+    workflow_element_names : list of string
+        The names of the feature extractor and classifier modules.
+
+    """
+
+    def __init__(self, filename, workflow_element_names=[
+            'feature_extractor', 'classifier']):
+        super(TracedFeatureExtractorClassifier, self).__init__(
+            workflow_element_names)
+        self.tracer = Tracer(filename)
+        self._n_folds = 0
+
+    def _fold(self):
+        fold = os.environ.get('AUTISM_TRACE_FOLD')
+        if fold is not None:
+            return int(fold)
+        self._n_folds += 1
+        return self._n_folds - 1
+
+    def _wrap_transformer_fmri(self, fe, fold):
+        pipeline = getattr(fe, 'transformer_fmri', None)
+        if pipeline is None or not hasattr(pipeline, 'steps'):
+            return
+        for step_name, step in pipeline.steps:
+            for method_name in ('fit', 'transform', 'fit_transform'):
+                if hasattr(step, method_name):
+                    self.tracer.wrap(step, method_name, 'transformer_fmri.'
+                                     '{}.{}'.format(step_name, method_name),
+                                     fold)
+
+    def train_submission(self, module_path, X_df, y_array, train_is=None):
+        if train_is is None:
+            train_is = slice(None, None, None)
+        fold = self._fold()
+        tracer = self.tracer
+        feature_extractor = rw.utils.import_module_from_source(
+            os.path.join(module_path, self.element_names[0] + '.py'),
+            self.element_names[0])
+        fe = feature_extractor.FeatureExtractor()
+        self._wrap_transformer_fmri(fe, fold)
+        # the feature extractor is tagged with its fold for test_submission
+        fe._trace_fold = fold
+        X_train_df = X_df.iloc[train_is]
+        with tracer.span('feature_extractor.fit', fold, X_train_df):
+            fe.fit(X_train_df, y_array[train_is])
+        with tracer.span('feature_extractor.transform', fold,
+                         X_train_df) as args:
+            X_train_array = args['output'] = fe.transform(X_train_df)
+        with tracer.span('classifier.fit', fold, X_train_array):
+            clf = self.classifier_workflow.train_submission(
+                module_path, X_train_array, y_array[train_is])
+        return fe, clf
+
+    def test_submission(self, trained_model, X_df):
+        fe, clf = trained_model
+        fold = getattr(fe, '_trace_fold', None)
+        with self.tracer.span('feature_extractor.transform', fold,
+                              X_df) as args:
+            X_test_array = args['output'] = fe.transform(X_df)
+        with self.tracer.span('classifier.predict_proba', fold,
+                              X_test_array) as args:
+            y_proba = args['output'] = self.classifier_workflow.\
+                test_submission(clf, X_test_array)
+        return y_proba